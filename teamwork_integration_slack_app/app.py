@@ -2,12 +2,14 @@ import os
 import logging
 import json
 import re
-import requests
-import math
-from urllib.parse import urlparse, parse_qs
-from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone
 
+# .env is for local runs, on Lambda the configuration comes from the function's environment.
+# Loaded before the package imports, their module-level caches read the environment
+if not os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+    from dotenv import load_dotenv
+    load_dotenv()
+
 from slack_sdk import WebClient
 from slack_sdk.web import SlackResponse
 from slack_bolt.authorization import AuthorizeResult
@@ -15,12 +17,26 @@ from slack_bolt.authorization import AuthorizeResult
 from slack_bolt import App, Ack, Respond
 from slack_bolt.adapter.aws_lambda import SlackRequestHandler
 
-from teamwork_integration_slack_app.teamwork_api.tw_auth import TW_Connector, Employee_Leave_Request
+from teamwork_integration_slack_app.slack_api.slack_auth import Authorize_Cache
+from teamwork_integration_slack_app.slack_api.slack_users import slack_user_cache
+from teamwork_integration_slack_app.slack_api.slack_threads import thread_reader
+from teamwork_integration_slack_app.pipeline import Stage_Graph, Stage_Aborted
+from teamwork_integration_slack_app.instrumentation import instrumentation, Instrumented_WebClient
+from teamwork_integration_slack_app.deadline import Deadline, Deadline_Exceeded, deadlines
+from teamwork_integration_slack_app.idempotency import idempotency_guard
+from teamwork_integration_slack_app.log_config import configure_logging, log_payload
+from teamwork_integration_slack_app.vto_store import VTO_Offer_State, load_vto_state_store, QUEUE_FULL, FULL, \
+    FORM_LEASE_SECONDS, SUBMISSION_LEASE_SECONDS
+from teamwork_integration_slack_app.common import date_format, \
+    message_ts_from_link, slack_user_timezone, convert_vto_times, \
+    leave_request_fields, submission_errors, INVALID_RANGE_ERRORS, workflow_step_config_view, \
+    workflow_step_update, leave_request_form_view, open_form_message_blocks, text_blocks, \
+    submitted_vto_times, submission_retry_view, submission_status_view, bulk_request_form_view, submitted_bulk_agents
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-#logging.basicConfig(level=logging.DEBUG)
-date_format = "%Y-%m-%dT%H:%M:%S%z"
+# Keeps the auth.test result warm across invocations of the same container
+authorize_cache = Authorize_Cache(ttl_seconds=float(os.environ.get("SLACK_AUTH_CACHE_TTL", 3600)))
 
 # Initializes app with bot token and signing secret
 def authorize(client: WebClient):
@@ -28,27 +44,48 @@ def authorize(client: WebClient):
     token = os.environ["SLACK_BOT_TOKEN"]
     signing_secret = os.environ.get("SLACK_SIGNING_SECRET")
     
-    return AuthorizeResult.from_auth_test_response(
-        auth_test_response=client.auth_test(token=token),
-        bot_token=token,
-    )
+    return authorize_cache.authorize(Instrumented_WebClient.from_client(client), token)
 
+# SLACK_API_URL points the client at another Slack API endpoint, e.g. the benchmark stubs
 app = App(
     authorize=authorize,
-    process_before_response=True
+    process_before_response=True,
+    **({"client": WebClient(token=os.environ.get("SLACK_BOT_TOKEN"), base_url=os.environ["SLACK_API_URL"])}
+       if os.environ.get("SLACK_API_URL") else {})
     )
 
-# Rounding Numbering
-def rounding_vto_number(n, decimals=0):
-    if n < 1.0:
-        multiplier = 10 ** decimals
-        r = math.ceil(n * multiplier) / multiplier
-        print(f'{n} rounded up to {r}')
-    else:
-        multiplier = 10 ** decimals
-        r = math.floor(n * multiplier) / multiplier
-        print(f'{n} rounded down to {r}')
-    return r
+# Per-call latency of every Slack and Teamwork call, summarized once per invocation
+app.middleware(instrumentation.listener_middleware)
+# Slack retries and duplicate deliveries stop here, before any listener work
+app.middleware(idempotency_guard.listener_middleware)
+# Inline view submissions only have Slack's ack window
+app.middleware(deadlines.listener_middleware)
+
+def thread_offer_snapshot(channel_id, thread_ts):
+    # Without a VTO_STATE_STORE on Lambda the thread is the only count, so it is read fresh
+    thread_reader.invalidate(channel_id, thread_ts)
+    return thread_reader.snapshot(app.client, channel_id, thread_ts)
+
+# Slot counters of every VTO offer, so a reaction or click doesn't rescan the thread
+vto_state_store = load_vto_state_store(thread_offer_snapshot)
+
+@app.error
+def handle_errors(error: Exception, body: dict, logger: logging.Logger):
+    # A revoked or invalid bot token must not stay cached for the rest of the TTL
+    authorize_cache.invalidate_on_error(error)
+    logger.exception('Unhandled error: %s', error)
+
+@app.event("tokens_revoked")
+@app.event("app_uninstalled")
+def handle_tokens_revoked(ack: Ack):
+    ack()
+    authorize_cache.invalidate()
+
+@app.event("user_change")
+def handle_user_change(ack: Ack, event: dict):
+    # Keeps the cached profile (and email -> id mapping) in sync with Slack
+    ack()
+    slack_user_cache.update(event["user"])
 
 @app.action({"type": "workflow_step_edit", "callback_id": "leave_request"})
 def edit(body: dict, ack: Ack, client: WebClient):
@@ -56,141 +93,39 @@ def edit(body: dict, ack: Ack, client: WebClient):
     ack()
     configuration_view = client.views_open(
         trigger_id = body["trigger_id"],
-        view = {
-            "type": "workflow_step",
-            "callback_id": "vto_workflow_view",
-            "blocks": [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "VTO Request Trigger Setting"
-                    },
-                },
-                {
-                    "type": "input",
-                    "block_id": "vto_form_receipient_input",
-                    "element": {
-                        "type": "plain_text_input",
-                        "action_id": "vto_form_receipient"
-                    },
-                    "label": {
-                        "type": "plain_text",
-                        "text": "Place the person who reacted with email address in here please."
-                    }
-                },
-                {
-                    "type": "input",
-                    "block_id": "vto_channel_id_input",
-                    "element": {
-                        "type": "plain_text_input",
-                        "action_id": "vto_channel_id"
-                    },
-                    "label": {
-                        "type": "plain_text",
-                        "text": "Place the channel variable where the react was used in please."
-                    }
-                },
-                {
-                    "type": "input",
-                    "block_id": "vto_message_link_input",
-                    "element": {
-                        "type": "plain_text_input",
-                        "action_id": "vto_message_link"
-                    },
-                    "label": {
-                        "type": "plain_text",
-                        "text": "Place \"Link to message reacted on\" variable in here please."
-                    }
-                }
-            ]
-        }
+        view = workflow_step_config_view()
     )
 
 @app.view("vto_workflow_view")
 def save(ack: Ack, client: WebClient, body: dict):
     ack()
-    state_values = body["view"]["state"]["values"]
     
     response = client.api_call(
         api_method = "workflows.updateStep",
-        json = {
-            "workflow_step_edit_id": body["workflow_step"]["workflow_step_edit_id"],
-            
-            "inputs": {
-                "vtoFormReceipient": {
-                        "value": state_values["vto_form_receipient_input"]["vto_form_receipient"]["value"],
-                    },
-                "vtoChannelSource": {
-                        "value": state_values["vto_channel_id_input"]["vto_channel_id"]["value"],
-                    },
-                "vtoMessageLink": {
-                        "value": state_values["vto_message_link_input"]["vto_message_link"]["value"],
-                    },
-                },
-            "outputs": [
-                {
-                    "name": "vtoFormReceipient",
-                    "type": "text",
-                    "label": "VTO Form Receipient",
-                },
-                {
-                    "name": "vtoChannelSource",
-                    "type": "text",
-                    "label": "Channel Source",
-                },
-                {
-                    "name": "vtoMessageLink",
-                    "type": "text",
-                    "label": "Message Link",
-                },
-            ],
-        },
+        json = workflow_step_update(body),
     )
 
 @app.action("open-leave-request-form")
 def button_click(ack: Ack, body: dict, respond: Respond, client: WebClient):
-    print('--------------- open-leave-request-form ---------------')
+    logger.debug("open-leave-request-form")
     ack()
-    logging.info(body)
+    log_payload(logger, "open-leave-request-form body", body)
     
     parent_message_ts = body["message"]["blocks"][1]["block_id"]
     channel_id = body["container"]["channel_id"]
     thread_ts = body["container"]["thread_ts"]
     
-    conversation_replies = client.conversations_replies(channel=channel_id,
-                                            ts=thread_ts)
-    
-    vto_success_count = 0
-    for message in conversation_replies["messages"]:
-        if "username" in message:
-            if "Success" in message["username"]:
-                vto_success_count += 1
-    
-    parent_message_text = conversation_replies["messages"][0]["text"]
+    vto_state = offer_state(client, channel_id, thread_ts)
     
-    vto_limit = float(re.search(r"\d+\.\d+", parent_message_text).group(0))
-    vto_limit = rounding_vto_number(vto_limit)
-    
-    is_vto_full = False
-
-    print(f'Success counts: {vto_success_count}')
-    if vto_success_count >= vto_limit:
-        is_vto_full = True
+    logger.debug("Success counts: %s", vto_state.success_count)
+    is_vto_full = vto_state.is_full
     
     if is_vto_full:
         ack()
         response = client.chat_postMessage(
             #user=user_id,
             username="Teamwork Bot",
-            blocks=[
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"Oh, we've reached the limit of available VTO requests at this time! Thank you, everyone!"
-                    }
-                }],
+            blocks=text_blocks(f"Oh, we've reached the limit of available VTO requests at this time! Thank you, everyone!"),
                 #icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_404_512.png",
                 thread_ts=f"{thread_ts}",
                 channel=f"{channel_id}",
@@ -202,24 +137,16 @@ def button_click(ack: Ack, body: dict, respond: Respond, client: WebClient):
             message_mention = body["message"]["blocks"][0]["text"]["text"]
             match = re.search(r"<@(.*?)>",message_mention.strip())
             if not match:
-                print("No match found.")
+                logger.warning("No user mention found in the form message")
             else:
-                print(message_mention)
                 message_mention = match.group(1)
-                print(f'message_mention: {message_mention}')
+                logger.debug("message_mention: %s", message_mention)
                 user_id = body["user"]["id"]
                 if not user_id == message_mention:
                     response = client.chat_postEphemeral(
                         user=user_id,
                         username="Caution",
-                        blocks=[
-                            {
-                                "type": "section",
-                                "text": {
-                                    "type": "mrkdwn",
-                                    "text": f"Hi <@{user_id}>, please react :vto: to the post to open your vto request form."
-                                }
-                            }],
+                        blocks=text_blocks(f"Hi <@{user_id}>, please react :vto: to the post to open your vto request form."),
                             icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_404_512.png",
                             thread_ts=f"{thread_ts}",
                             channel=channel_id,
@@ -227,68 +154,37 @@ def button_click(ack: Ack, body: dict, respond: Respond, client: WebClient):
                     )
                     return
                 else:
-                    print("sends open form modal")
+                    # The slot held by this button, for as long as the form may stay open. An expired
+                    # lease (or a button posted before leases) takes a new slot if one is left
+                    lease = vto_state_store.renew(body["actions"][0].get("value", ""), FORM_LEASE_SECONDS)
+                    if lease is None:
+                        outcome, vto_state, lease = vto_state_store.reserve(channel_id, thread_ts, user_id, FORM_LEASE_SECONDS)
+                    if lease is None:
+                        response = client.chat_postEphemeral(
+                            user=user_id,
+                            username="Teamwork Bot",
+                            blocks=text_blocks(f"Oh, your VTO form has expired and the VTO request forms queue is full. Please try again soon, <@{user_id}>."),
+                                thread_ts=f"{thread_ts}",
+                                channel=channel_id,
+                                text="fallback text"
+                        )
+                        return
+                    logger.debug("sends open form modal")
                     res = client.views_open(
                         trigger_id = body["trigger_id"],
-                        view={
-                            "type": "modal",
-                            "callback_id": "leave-request-submission",
-                            "title": {
-                                "type": "plain_text",
-                                "text": "VTO Request Form",
-                            },
-                            "submit": {
-                                "type": "plain_text",
-                                "text": "Submit",
-                            },
-                            "close": {
-                                "type": "plain_text",
-                                "text": "Cancel",
-                            },
-                            "blocks": [
-                                {
-                                    "type": "input",
-                                    "block_id": "vto_start_time_input",
-                                    "element": {
-                                        "type": "datetimepicker",
-                                        "action_id": "vto_start_time",
-                                        "initial_date_time": int(datetime.today().replace(microsecond=0, second=0, minute=0).timestamp())
-                                    },
-                                    "label": {
-                                        "type": "plain_text",
-                                        "text": "VTO Start Time",
-                                    }
-                                },
-                                {
-                                    "type": "input",
-                                    "block_id": "vto_end_time_input",
-                                    "element": {
-                                        "type": "datetimepicker",
-                                        "action_id": "vto_end_time",
-                                        "initial_date_time": int((datetime.today().replace(microsecond=0, second=0, minute=0) + timedelta(hours=1)).timestamp())
-                                    },
-                                    "label": {
-                                        "type": "plain_text",
-                                        "text": "VTO End Time",
-                                    }
-                                }
-                            ],
-                            "notify_on_close": True,
-                            "private_metadata": f'{{\
-                                "thread_ts": "{thread_ts}",\
-                                "message_ts": "{body["container"]["message_ts"]}",\
-                                "response_url": "{body["response_url"]}",\
-                                "message_mention": "{message_mention}",\
-                                "channel_id": "{channel_id}"\
-                                }}'
-                        }
+                        view=leave_request_form_view(thread_ts = thread_ts,
+                                                     message_ts = body["container"]["message_ts"],
+                                                     response_url = body["response_url"],
+                                                     message_mention = message_mention,
+                                                     channel_id = channel_id,
+                                                     lease_id = lease.lease_id)
                     )
 
 @app.view_closed("leave-request-submission")
 def handle_view_closed_events(ack: Ack, body: dict, client: WebClient):
-    print('--------------- leave-request-form-closed ---------------')
+    logger.debug("leave-request-form-closed")
     ack()
-    logging.info(body)
+    log_payload(logger, "leave-request-form-closed body", body)
     private_metadata = json.loads(body["view"]["private_metadata"])
     response_url = private_metadata["response_url"]
     message_ts = private_metadata["message_ts"]
@@ -304,15 +200,12 @@ def handle_view_closed_events(ack: Ack, body: dict, client: WebClient):
         ack()
         if (user_id == message_mention and not message_mention == ""):
             response = client.chat_delete(channel=channel_id,ts=message_ts)
+            # The form button is gone, so is the slot it was holding
+            vto_state_store.release(channel_id, thread_ts, private_metadata.get("lease_id", ""))
         response = client.chat_postEphemeral(
             user=user_id,
             username="Cancel",
-            blocks=[{"type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"I see that you have closed the VTO form, <@{user_id}>. You can try again if by accident."
-                }
-            }],
+            blocks=text_blocks(f"I see that you have closed the VTO form, <@{user_id}>. You can try again if by accident."),
             icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_error_512.png",
             thread_ts=f"{thread_ts}",
             channel=f"{channel_id}",
@@ -323,11 +216,92 @@ def handle_view_closed_events(ack: Ack, body: dict, client: WebClient):
         
     
 
-@app.view("leave-request-submission")
 def handle_submission(ack: Ack, body: dict, client: WebClient):
     
-    print('--------------- leave-request-submission ---------------')
+    logger.debug("leave-request-submission")
     ack()
+    submit_leave_request(body, client, ack)
+
+def ack_submission(ack: Ack, body: dict, client: WebClient):
+    # SUBMISSION_FAST_ACK: validate inline, then swap the form for a status view within Slack's 3 seconds
+    logger.debug("leave-request-submission (fast ack)")
+    vto_start_time, vto_end_time = submitted_vto_times(body["view"])
+    if vto_start_time >= vto_end_time:
+        ack(INVALID_RANGE_ERRORS)
+        return
+    if held_lease(client, json.loads(body["view"]["private_metadata"]), body["user"]["id"]) is None:
+        # process_submission finds the same and shows it on the retry view
+        ack(OFFER_FULL_ERRORS)
+        return
+    ack(response_action="update",
+        view=submission_status_view("Submitting your VTO request to Teamwork...", body["view"]["private_metadata"]))
+
+def process_submission(body: dict, client: WebClient):
+    # Lazy listener, runs after the ack: a self-invocation on Lambda, a worker thread otherwise
+    vto_start_time, vto_end_time = submitted_vto_times(body["view"])
+    if vto_start_time >= vto_end_time:
+        # Lazy listeners run even when the ack returned errors
+        return
+    view_id = body["view"]["id"]
+    
+    def respond(response=None):
+        # Shows what the ack of handle_submission would have, on the status view
+        if response and response.get("response_action") == "errors":
+            error = next(iter(response["errors"].values()))
+            idempotency_guard.release(body)
+            client.views_update(view_id=view_id, view=submission_retry_view(body["view"], error))
+        elif response:
+            client.views_update(view_id=view_id,
+                                view=submission_status_view("Your VTO request was processed, the result is in the thread.",
+                                                            body["view"]["private_metadata"]))
+    
+    try:
+        submit_leave_request(body, client, respond)
+    except Exception as e:
+        # Without a response the status view would say "Submitting..." for good
+        logger.exception("Unhandled error in the VTO submission: %s", e)
+        respond(FAILED_ERRORS)
+
+OFFER_FULL_ERRORS = submission_errors("Your VTO slot has expired and the other slots are taken. Thank you!")
+CONFLICT_ERRORS = submission_errors("Conflicted with other request, Try again.")
+UNAVAILABLE_ERRORS = submission_errors("Teamwork is unavailable right now. Please try again in a few minutes.")
+TIMED_OUT_ERRORS = submission_errors("Teamwork is taking too long to answer. Please submit again.")
+FAILED_ERRORS = submission_errors("Teamwork could not take the request, Try again.")
+
+def offer_state(client: WebClient, channel_id, thread_ts):
+    vto_state = vto_state_store.get(channel_id, thread_ts)
+    if vto_state is None:
+        # Fallback: rebuild the offer state from the thread the first time it is seen
+        snapshot = thread_reader.snapshot(client, channel_id, thread_ts)
+        vto_state = vto_state_store.seed(VTO_Offer_State(channel_id=channel_id,
+                                                         thread_ts=thread_ts,
+                                                         vto_limit=snapshot.vto_limit,
+                                                         success_count=snapshot.success_count))
+    return vto_state
+
+def held_lease(client: WebClient, private_metadata, user_id):
+    # The form's VTO slot, renewed for the submission. A lease that expired (or was released)
+    # is replaced by a new one while the offer has room; None only once the offer is full
+    lease_id = private_metadata.get("lease_id")
+    lease = vto_state_store.renew(lease_id, SUBMISSION_LEASE_SECONDS) if lease_id else None
+    if lease is None:
+        channel_id, thread_ts = private_metadata["channel_id"], private_metadata["thread_ts"]
+        offer_state(client, channel_id, thread_ts)
+        outcome, vto_state, lease = vto_state_store.reserve(channel_id, thread_ts, user_id, SUBMISSION_LEASE_SECONDS)
+        logger.info("lease %s of %s was gone, new slot: %s %s", lease_id, user_id, outcome, vto_state)
+    return lease
+
+def submit_leave_request(body: dict, client: WebClient, ack):
+    # ack is the view_submission Ack, or process_submission's respond in the fast ack mode
+    # Deferred: only submissions need the Teamwork stack (requests, sessions, caches)
+    from teamwork_integration_slack_app.teamwork_api.tw_auth import TW_Connector, Employee_Leave_Request
+    from teamwork_integration_slack_app.teamwork_api.tw_leave_types import leave_type_catalog, TW_Leave_Type_Not_Found
+    from teamwork_integration_slack_app.teamwork_api.tw_directory import employee_directory
+    from teamwork_integration_slack_app.teamwork_api.tw_locations import location_registry
+    from teamwork_integration_slack_app.teamwork_api.tw_day_hours import day_hours_engine
+    from teamwork_integration_slack_app.teamwork_api.tw_conflicts import leave_conflicts
+    from teamwork_integration_slack_app.teamwork_api.tw_breaker import TW_Unavailable
+    
     private_metadata = json.loads(body["view"]["private_metadata"])
     response_url = private_metadata["response_url"]
     message_ts = private_metadata["message_ts"]
@@ -337,224 +311,309 @@ def handle_submission(ack: Ack, body: dict, client: WebClient):
     
     #if body["view"]["private_metadata"]
     
-    vto_start_time = body["view"]["state"]["values"]["vto_start_time_input"]["vto_start_time"]["selected_date_time"]
-    vto_end_time = body["view"]["state"]["values"]["vto_end_time_input"]["vto_end_time"]["selected_date_time"]
+    vto_start_time, vto_end_time = submitted_vto_times(body["view"])
     # Validate inputs
     if vto_start_time >= vto_end_time or vto_end_time <= vto_start_time:
-        ack({
-            "response_action": "errors",
-            "errors": {
-                "vto_start_time_input": "This cannot be more than or equal to the VTO End Time.",
-                "vto_end_time_input": "This cannot be less than or equal to the VTO Start Time."
-            }
-        })
+        ack(INVALID_RANGE_ERRORS)
         return
     
-    logging.info(body)
+    user_id = body["user"]["id"]
     
-    user = client.users_info(user=body["user"]["id"])
-    user_id = user["user"]["id"]
-    user_email = user["user"]["profile"]["email"]
-
-    print(f'{vto_start_time}\n{vto_end_time}')
-    print(f'{os.environ.get("TEAMWORK_URL")}\n')
+    # Shed before any Teamwork call: no slot is left for a form whose lease is gone
+    lease = held_lease(client, private_metadata, user_id)
+    if lease is None:
+        ack(OFFER_FULL_ERRORS)
+        return
+    lease_id = lease.lease_id
+    
+    log_payload(logger, "leave-request-submission body", body)
+    
+    logger.debug("VTO times %s - %s", vto_start_time, vto_end_time)
     
     tw_connector = TW_Connector(base_url = os.environ.get("TEAMWORK_URL"),
                                 portal = os.environ.get("TEAMWORK_PORTAL"),
                                 code = os.environ.get("TEAMWORK_CODE"),
                                 username = os.environ.get("TEAMWORK_USERNAME"),
                                 password = os.environ.get("TEAMWORK_PASSWORD"))
-    tw_connector._authenicate_tw()
+    # Teamwork is down: answer now instead of waiting on calls that would fail anyway
+    if not tw_connector.available():
+        ack(UNAVAILABLE_ERRORS)
+        return
     
-    # Find the employee information by email
-    response = tw_connector.get_employee_by_email(user_email)
-    if response.json()['Total'] == 0:
+    # Each stage receives the results of the stages it depends on,
+    # independent stages (e.g. leave types and the Slack user) run concurrently
+    def slack_user():
+        return slack_user_cache.get_user(client, user_id)
+    
+    def tw_employee(slack_user):
+        # Find the employee information by email
+        employee = employee_directory.lookup(tw_connector, slack_user["profile"]["email"])
+        if employee is None:
+            raise Stage_Aborted("not_registered")
+        return employee
+    
+    def tw_location(tw_employee):
+        # Get the active location of an employee's, with its resolved timezone
+        my_tw_location = location_registry.get_default_location(tw_connector, tw_employee['Id'])
+        logger.debug("TW location: %s", my_tw_location)
+        return my_tw_location
+    
+    def tw_leave_type():
+        # Get a VTO Slack leave type from the cached catalog of leave types
+        return leave_type_catalog.get_vto_leave_type(tw_connector)
+    
+    def vto_times(slack_user, tw_location):
+        # Create VTO datetime objects with aware timezone based on slack user's local timezone,
+        # then convert them to teamwork location's timezone
+        times = dict(zip(("start", "end", "tw_start", "tw_end"),
+                         convert_vto_times(vto_start_time, vto_end_time, slack_user_timezone(slack_user), tw_location.tz)))
+        logger.debug("TW VTO times %s - %s (%s)", times["tw_start"], times["tw_end"], times["tw_start"].tzinfo)
+        return times
+    
+    def leave_conflict(tw_employee, tw_location, vto_times):
+        # Overlapping leave is refused here, before any Teamwork write
+        conflict = leave_conflicts.conflict(tw_connector, tw_employee["Id"], vto_times["tw_start"], vto_times["tw_end"], tw_location.tz)
+        if conflict is not None:
+            logger.info("VTO request of employee %s overlaps %s leave", tw_employee["Id"], conflict.source)
+            raise Stage_Aborted("leave_conflict")
+    
+    def leave_request(tw_employee, tw_leave_type, tw_location, vto_times, leave_conflict):
+        # Initialize a leave request
+        tw_leave_request = Employee_Leave_Request(**leave_request_fields(tw_employee,
+                                                                         tw_leave_type,
+                                                                         datetime.strftime(vto_times["tw_start"],date_format),
+                                                                         datetime.strftime(vto_times["tw_end"],date_format)))
         
+        # Validate leave request by calculating & checking daily hours...
+        # response_check_daily_hours = tw_connector.request("PUT","/api/leave/checkdailyhours",tw_leave_request.to_json())
+        # tw_leave_request = tw_leave_request.from_json(response_check_daily_hours)
+        
+        # Daily hours from the location's rules, or Teamwork's calcdailyhours without one
+        tw_leave_request.DayHours = day_hours_engine.day_hours(tw_connector, tw_leave_request, tw_location,
+                                                               vto_times["tw_start"], vto_times["tw_end"])
+        return tw_leave_request
+    
+    def final_response(tw_employee, leave_request):
+        # The post isn't idempotent: once it's made it runs on the Lambda budget, not Slack's ack
+        # window, so a leave request that reaches Teamwork is always confirmed
+        deadlines.widen()
+        # Submit a leave request!
+        log_payload(logger, "leave request", leave_request.to_dict())
+        return tw_connector.post_leave_request(tw_employee["Id"], leave_request.to_json())
+    
+    submission = Stage_Graph() \
+        .add("slack_user", slack_user) \
+        .add("tw_leave_type", tw_leave_type) \
+        .add("tw_employee", tw_employee, deps=("slack_user",)) \
+        .add("tw_location", tw_location, deps=("tw_employee",)) \
+        .add("vto_times", vto_times, deps=("slack_user", "tw_location")) \
+        .add("leave_conflict", leave_conflict, deps=("tw_employee", "tw_location", "vto_times")) \
+        .add("leave_request", leave_request, deps=("tw_employee", "tw_leave_type", "tw_location", "vto_times", "leave_conflict")) \
+        .add("final_response", final_response, deps=("tw_employee", "leave_request"))
+    
+    try:
+        results = submission.run()
+    except Stage_Aborted as e:
+        if e.reason == "leave_conflict":
+            ack(CONFLICT_ERRORS)
+            return
         # Call the chat_postMessage or chat_postEphemeral or chat_update
         ack({"response_action": "clear"})
-        
         if (user_id == message_mention and not message_mention == ""):
-            response = client.chat_delete(channel=channel_id,ts=message_ts)
+            vto_state_store.release(channel_id, thread_ts, lease_id)
         
-        response = client.chat_postMessage(
-            #user=user_id,
+        finish_submission(client, user_id, message_mention, channel_id, message_ts,
             username="Error",
-            blocks=[{"type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"Sorry, <@{user_id}>, you cannot request VTO because you are not a registered employee in the Teamwork system. Please contact the admin for help."
-                }
-            }],
+            blocks=text_blocks(f"Sorry, <@{user_id}>, you cannot request VTO because you are not a registered employee in the Teamwork system. Please contact the admin for help."),
             icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_error_512.png",
             thread_ts=f"{thread_ts}",
             channel=f"{channel_id}",
             text=f"Sorry, <@{user_id}>, you cannot take VTO request because you are not registered employee in Teamwork system. Please contact admin for help."
-            #text=f"Good news! <@{user_id}|{user_name}> has submitted successfully!\nVTO Start Time: {formatted_vto_start_time}\nVTO End Time: {formatted_vto_end_time}\nVTO Timezone: {vto_timezone_label}"
         )
         return
-    else:
-        
-        tw_employee = response.json()['Data']
-
-        # Get the active location of an employee's
-        my_tw_location = []
-        response = tw_connector.request(request_method="GET",
-                                        endpoint=f"/api/employees/{tw_employee[0]['Id']}/locations",
-                                        payload="")
-        tw_locations = response.json()
-        
-        if not len(tw_locations) == 0:
-            for loc in tw_locations:
-                if loc['IsDefault']:
-                    response = tw_connector.get(f"/api/locations/{loc['BusinessId']}").json()
-                    response = json.dumps(response)
-                    loc['TimeZone'] = json.loads(response)['TimeZone']
-                    my_tw_location = loc
-                    
-        print(my_tw_location)
-        
-        # Get the user's local timezone offset based on slack
-        user_tz_offset = user["user"]["tz_offset"]
-        # Create a timetime object based on slack user's local timezone offset
-        #slack_tz_offset = timezone(timedelta(seconds=user_tz_offset))
-        
-        # Create VTO datetime objects with aware timezone
-        aware_vto_start_time = datetime.fromtimestamp(vto_start_time, timezone(timedelta(seconds=user_tz_offset)))
-        aware_vto_end_time = datetime.fromtimestamp(vto_end_time, timezone(timedelta(seconds=user_tz_offset)))
-        print(f'{aware_vto_start_time} | {aware_vto_start_time.tzinfo}\n{aware_vto_end_time} | {aware_vto_end_time.tzinfo}')
-        
-        # Convert VTO datetime objects to UTC
-        aware_utc_vto_start_time = aware_vto_start_time.astimezone(timezone.utc)
-        aware_utc_vto_end_time = aware_vto_end_time.astimezone(timezone.utc)
-        print(f'{aware_utc_vto_start_time} | {aware_utc_vto_start_time.tzinfo}\
-            \n{aware_utc_vto_end_time} | {aware_utc_vto_end_time.tzinfo}\n')
-
-        # Get the timezone of the user's associated location in the Teamwork system.
-        tw_local_timezone_string = my_tw_location['TimeZone'][1:-1].split(") ")[0]
-        tw_aware_timezone = datetime.strptime(tw_local_timezone_string,"UTC%z")
-        print(f'tw aware timezone: {tw_aware_timezone.tzinfo}')
-        print(f'Convert to aware timezone offset based on tw location\'s')
-        tw_aware_tz_offset = tw_aware_timezone.tzinfo.utcoffset(datetime(1970,1,1)).total_seconds()
-        
-        print(f'\n#5 convert vto times to teamwork location\'s timezone')
-        aware_tw_vto_start_time = aware_utc_vto_start_time.astimezone(timezone(timedelta(seconds=tw_aware_tz_offset)))
-        aware_tw_vto_end_time = aware_utc_vto_end_time.astimezone(timezone(timedelta(seconds=tw_aware_tz_offset)))
-        print(f'{aware_tw_vto_start_time} | {aware_tw_vto_start_time.tzinfo}\
-            \n{aware_tw_vto_end_time} | {aware_tw_vto_end_time.tzinfo}')
-        
-        # reformat vto datetime objects
-        formatted_tw_start_time = datetime.strftime(aware_tw_vto_start_time,date_format)
-        formatted_tw_end_time = datetime.strftime(aware_tw_vto_end_time,date_format)
-        
-        # Get the list of leave types
-        response = tw_connector.get('/api/leave/leavetypes')
-        tw_leave_types = response.json()
-        #print(f'--- List of Teamwork\'s Leave Types ---\n{tw_leave_types}\n---')
-        
-        # Get a VTO Slack leave type
-        if not len(tw_leave_types) == 0:
-            for i in tw_leave_types:
-                if i["Title"] == "VTO: Slack" or i["Code"] == "VTOSLACK":
-                    selected_leave_type = i
-        
-        # Initialize a leave request
-        tw_leave_request = Employee_Leave_Request(EmpId = tw_employee[0]["Id"],
-                                                  EmpName = tw_employee[0]["FullName"],
-                                                  Employees = [{"Id": tw_employee[0]["Id"],
-                                                                "Title": tw_employee[0]["FullName"]}],
-                                                  Start = formatted_tw_start_time,
-                                                  End = formatted_tw_end_time,
-                                                  StartTime = formatted_tw_start_time,
-                                                  EndTime = formatted_tw_end_time,
-                                                  TypeId=selected_leave_type['Id'],
-                                                  LeaveTypes = [selected_leave_type],
-                                                  MinDate = datetime.today().strftime(date_format),
-                                                  MaxDate = (datetime.today() + timedelta(days=365*2)).strftime(date_format),
-                                                  DayHours = [{
-                                                      "Date": formatted_tw_start_time,
-                                                      "Count": None,
-                                                      "Value": 1,
-                                                      "Description": None,
-                                                      "Id": 0,
-                                                      "Title": None
-                                                      }]
-                                                  )
-        
-        # Validate leave request by calculating & checking daily hours...
-        # response_check_daily_hours = tw_connector.request("PUT","/api/leave/checkdailyhours",tw_leave_request.to_json())
-        # tw_leave_request = tw_leave_request.from_json(response_check_daily_hours)
-        
-        # Calculate the daily hours of a leave request
-        response = tw_connector.request(request_method = "PUT",
-                                        endpoint = "/api/leave/calcdailyhours/",
-                                        payload = tw_leave_request.to_json())
-        day_hours_obj = [{"DayHours": response.json()}]
-        
-        tw_leave_request.from_json(json.dumps(day_hours_obj))
+    except TW_Leave_Type_Not_Found as e:
+        logger.error("%s", e)
+        ack(submission_errors("VTO leave type is not set up in Teamwork. Please contact the admin for help."))
+        return
+    except TW_Unavailable as e:
+        # The breaker opened while this submission was running
+        logger.warning("%s", e)
+        ack(UNAVAILABLE_ERRORS)
+        return
+    except Deadline_Exceeded as e:
+        # Only calls before the leave post are cut to the ack window; the form and its lease stay
+        logger.warning("%s", e)
+        ack(TIMED_OUT_ERRORS)
+        return
+    finally:
+        logger.info("leave-request-submission stages: %s", submission.report())
+    
+    final_response = results["final_response"]
+    my_tw_location = results["tw_location"]
+    times = results["vto_times"]
+    user_tz_offset = results["slack_user"]["tz_offset"]
+    
+    employee_id = results["tw_employee"]["Id"]
+    if final_response.status_code == 409:
+        # Teamwork knew leave the index didn't: reload the employee's leave on the next check
+        leave_conflicts.forget(employee_id)
+        ack(CONFLICT_ERRORS)
+        return
+        #\n*Unix VTO Start Time:*\n{vto_start_time}\
+        #\n*Unix VTO End Time:*\n{vto_end_time}\
+    elif final_response.status_code == 200:
+        if os.environ.get("DEBUG"):
+            text_output = f'VTO Submission from <@{user_id}> completed:\
+                \n*VTO Start Time:*\n{times["start"]}\
+                \n*VTO End Time:*\n{times["end"]}\
+                \n*Slack User\'s Local Timezone Offset:*\n{user_tz_offset}\
+                \n*Converted to UTC VTO Start Time:*\n{times["start"].astimezone(timezone.utc)}\
+                \n*Converted to UTC VTO End Time:*\n{times["end"].astimezone(timezone.utc)}\
+                \n*Defaulted TW Location Name:*\n{my_tw_location.business_name}\
+                \n*Defaulted TW Location\'s timezone:*\n{my_tw_location.timezone_string}\
+                \n*Converted VTO Start Time based on TW Location:*\n{times["tw_start"]}\
+                \n*Converted VTO End Time based on TW Location:*\n{times["tw_end"]}'
+        else:
+            text_output = f"VTO Submission from <@{user_id}> completed:\
+                \n*VTO Start Time:* \n{times['start'].strftime('%A, %B %d %Y %I:%M%p')}\
+                \n*VTO End Time:* \n{times['end'].strftime('%A, %B %d %Y %I:%M%p')}"
         
-        # Submit a leave request!
-        print(json.loads(tw_leave_request.to_json()))
-        leave_json_data = json.loads(tw_leave_request.to_json())
-        final_response = tw_connector.request(request_method = "PUT",
-                                        endpoint = f'/api/leave/post/{tw_employee[0]["Id"]}',
-                                        payload = json.dumps(leave_json_data),
-                                        params = {"validatedOnServer":"false"})
+        vto_state_store.confirm(channel_id, thread_ts, lease_id)
+        leave_conflicts.add(employee_id, times["tw_start"], times["tw_end"])
         
-        if final_response.status_code == 409:
-            ack({
-                "response_action": "errors",
-                "errors": {
-                    "vto_start_time_input": "Conflicted with other request, Try again.",
-                    "vto_end_time_input": "Conflicted with other request, Try again."
-                }
-            })
-            return
-            #\n*Unix VTO Start Time:*\n{vto_start_time}\
-            #\n*Unix VTO End Time:*\n{vto_end_time}\
-        elif final_response.status_code == 200:
-            user_name = user["user"]["profile"]["display_name"]
-            if os.environ.get("DEBUG"):
-                text_output = f'VTO Submission from <@{user_id}> completed:\
-                    \n*VTO Start Time:*\n{aware_vto_start_time}\
-                    \n*VTO End Time:*\n{aware_vto_end_time}\
-                    \n*Slack User\'s Local Timezone Offset:*\n{user_tz_offset}\
-                    \n*Converted to UTC VTO Start Time:*\n{aware_utc_vto_start_time}\
-                    \n*Converted to UTC VTO End Time:*\n{aware_utc_vto_end_time}\
-                    \n*Defaulted TW Location Name:*\n{my_tw_location["BusinessName"]}\
-                    \n*Defaulted TW Location\'s timezone:*\n{tw_local_timezone_string}\
-                    \n*Converted VTO Start Time based on TW Location:*\n{aware_tw_vto_start_time}\
-                    \n*Converted VTO End Time based on TW Location:*\n{aware_tw_vto_end_time}'
-            else:
-                text_output = f"VTO Submission from <@{user_id}> completed:\
-                    \n*VTO Start Time:* \n{aware_vto_start_time.strftime('%A, %B %d %Y %I:%M%p')}\
-                    \n*VTO End Time:* \n{aware_vto_end_time.strftime('%A, %B %d %Y %I:%M%p')}"
-            
-            # Call the chat_postMessage or chat_postEphemeral
-            if (user_id == message_mention and not message_mention == ""):
-                response = client.chat_delete(channel=channel_id,ts=message_ts)
-            ack({"response_action": "clear"})
-            response = client.chat_postMessage(
-                #user=user_id,
-                username="Success",
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": text_output
-                        }
-                    }],
-                    icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_success_512.png",
-                    thread_ts=f"{thread_ts}",
-                    channel=f"{channel_id}",
-                    text=f"fallback text"
-            )
-            print(response)
-            return
+        # Call the chat_postMessage or chat_postEphemeral
+        ack({"response_action": "clear"})
+        finish_submission(client, user_id, message_mention, channel_id, message_ts,
+            #user=user_id,
+            username="Success",
+            blocks=text_blocks(text_output),
+            icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_success_512.png",
+            thread_ts=f"{thread_ts}",
+            channel=f"{channel_id}",
+            text=f"fallback text"
+        )
+        return
+    else:
+        logger.warning("Teamwork answered the leave request with %s: %s", final_response.status_code, final_response.text)
+        ack(FAILED_ERRORS)
+
+if os.environ.get("SUBMISSION_FAST_ACK", "").lower() in ("1", "true", "yes"):
+    app.view("leave-request-submission")(ack=ack_submission, lazy=[process_submission])
+else:
+    app.view("leave-request-submission")(handle_submission)
+
+def finish_submission(client: WebClient, user_id, message_mention, channel_id, message_ts, **message):
+    # Removing the form button and posting the outcome don't depend on each other
+    cleanup = Stage_Graph().add("chat_postMessage", lambda: client.chat_postMessage(**message))
+    if (user_id == message_mention and not message_mention == ""):
+        cleanup.add("chat_delete", lambda: client.chat_delete(channel=channel_id,ts=message_ts))
+    results = cleanup.run()
+    logger.debug("chat_postMessage: %s", results["chat_postMessage"])
+
+# Slack user ids allowed to grant VTO in bulk, nobody when unset
+BULK_SUBMISSION_USERS = {u.strip() for u in os.environ.get("BULK_SUBMISSION_USERS", "").split(",") if u.strip()}
+# BULK_SUBMISSION_ADMINS=true also allows the workspace's admins and owners
+BULK_SUBMISSION_ADMINS = os.environ.get("BULK_SUBMISSION_ADMINS", "").lower() in ("1", "true", "yes")
+BULK_MAX_EMPLOYEES = int(os.environ.get("BULK_SUBMISSION_MAX_EMPLOYEES", 50))
 
 @app.shortcut("leave-request-shortcut")
 def open_modal(ack: Ack, body: dict, client: WebClient):
-    pass
+    ack()
+    user_id = body["user"]["id"]
+    if not bulk_allowed(client, user_id):
+        client.views_open(trigger_id=body["trigger_id"],
+                          view=submission_status_view(f"Sorry, <@{user_id}>, bulk VTO requests are limited to supervisors. Please contact the admin for help.",
+                                                      "", title="Bulk VTO Request"))
+        return
+    client.views_open(trigger_id=body["trigger_id"], view=bulk_request_form_view())
+
+def bulk_allowed(client: WebClient, user_id):
+    if user_id in BULK_SUBMISSION_USERS:
+        return True
+    if BULK_SUBMISSION_ADMINS:
+        user = slack_user_cache.get_user(client, user_id)
+        return bool(user.get("is_admin") or user.get("is_owner"))
+    return False
+
+def bulk_submission_errors(view):
+    # Inline errors of the bulk request form, or None
+    vto_start_time, vto_end_time = submitted_vto_times(view)
+    if vto_start_time >= vto_end_time:
+        return INVALID_RANGE_ERRORS
+    user_ids, emails = submitted_bulk_agents(view)
+    if not user_ids and not emails:
+        return {"response_action": "errors", "errors": {"bulk_agents_input": "Pick at least one agent or enter their emails."}}
+    if len(user_ids) + len(emails) > BULK_MAX_EMPLOYEES:
+        return {"response_action": "errors", "errors": {"bulk_agents_input": f"At most {BULK_MAX_EMPLOYEES} agents at a time."}}
+    return None
+
+def ack_bulk_submission(ack: Ack, body: dict):
+    # Always acked first: tens of leave requests don't fit in Slack's 3 seconds
+    errors = bulk_submission_errors(body["view"])
+    if errors:
+        ack(errors)
+        return
+    user_ids, emails = submitted_bulk_agents(body["view"])
+    ack(response_action="update",
+        view=submission_status_view(f"Submitting VTO requests for {len(user_ids) + len(emails)} agents to Teamwork...",
+                                    "", title="Bulk VTO Request"))
+
+def process_bulk_submission(body: dict, client: WebClient):
+    # Lazy listener of the bulk request form, the report goes to the supervisor as a direct message
+    if bulk_submission_errors(body["view"]):
+        # Lazy listeners run even when the ack returned errors
+        return
+    from teamwork_integration_slack_app.teamwork_api.tw_leave_types import TW_Leave_Type_Not_Found
+    from teamwork_integration_slack_app.teamwork_api.tw_breaker import TW_Unavailable
+    
+    user_id = body["user"]["id"]
+    vto_start_time, vto_end_time = submitted_vto_times(body["view"])
+    user_ids, emails = submitted_bulk_agents(body["view"])
+    
+    status = "Your bulk VTO request was processed, the report was sent to you."
+    try:
+        report = submit_bulk_request(client, user_id, user_ids, emails, vto_start_time, vto_end_time)
+    except TW_Leave_Type_Not_Found as e:
+        logger.error("%s", e)
+        report = "VTO leave type is not set up in Teamwork. Please contact the admin for help."
+    except TW_Unavailable as e:
+        logger.warning("%s", e)
+        report = "Teamwork is unavailable right now, no VTO was submitted. Please try again in a few minutes."
+    except Exception as e:
+        # Without a report the status view would say "Submitting..." for good
+        logger.exception("Unhandled error in the bulk VTO submission: %s", e)
+        status = "Your bulk VTO request failed, the report was sent to you."
+        report = ("The bulk VTO request failed before every agent was submitted, some may have VTO in Teamwork. "
+                  "Please check Teamwork before trying again, or contact the admin for help.")
+    
+    client.views_update(view_id=body["view"]["id"],
+                        view=submission_status_view(status, "", title="Bulk VTO Request"))
+    client.chat_postMessage(channel=user_id, username="Teamwork Bot", blocks=text_blocks(report), text=report)
+
+def submit_bulk_request(client: WebClient, user_id, user_ids, emails, vto_start_time, vto_end_time):
+    # The report text of one bulk request
+    from teamwork_integration_slack_app.teamwork_api.tw_auth import TW_Connector
+    from teamwork_integration_slack_app.bulk import submit_bulk_leave_requests, bulk_report_text, Bulk_Result, NOT_REGISTERED
+    
+    # Agents picked in Slack are submitted by their Slack profile email
+    unresolved = []
+    for agent_id in user_ids:
+        email = slack_user_cache.get_user(client, agent_id).get("profile", {}).get("email")
+        if email:
+            emails.append(email)
+        else:
+            unresolved.append(Bulk_Result(email=f"<@{agent_id}>", status=NOT_REGISTERED))
+    
+    tw_connector = TW_Connector(base_url = os.environ.get("TEAMWORK_URL"),
+                                portal = os.environ.get("TEAMWORK_PORTAL"),
+                                code = os.environ.get("TEAMWORK_CODE"),
+                                username = os.environ.get("TEAMWORK_USERNAME"),
+                                password = os.environ.get("TEAMWORK_PASSWORD"))
+    results = submit_bulk_leave_requests(tw_connector, emails, vto_start_time, vto_end_time,
+                                         slack_user_timezone(slack_user_cache.get_user(client, user_id)))
+    return bulk_report_text(results + unresolved)
+
+app.view("bulk-leave-request-submission")(ack=ack_bulk_submission, lazy=[process_bulk_submission])
 
 ###################################
 #@app.event("workflow_step_completed")
@@ -570,9 +629,9 @@ def open_modal(ack: Ack, body: dict, client: WebClient):
 ###################################
 @app.event("workflow_step_execute")
 def execute(ack: Ack, body: dict, respond: Respond, client: WebClient):
-    print('--------------- workflow_step_execute ---------------')
+    logger.debug("workflow_step_execute")
     ack()
-    logging.info(body)
+    log_payload(logger, "workflow_step_execute body", body)
     
     step = body["event"]["workflow_step"]
     #completion = client.api_call(
@@ -591,75 +650,21 @@ def execute(ack: Ack, body: dict, respond: Respond, client: WebClient):
     vto_channel_source = re.sub('[^A-Za-z0-9]+', '', step["inputs"]["vtoChannelSource"]["value"])
     vto_message_link = step["inputs"]["vtoMessageLink"]["value"]
     
-    parsed_url = urlparse(vto_message_link)
-    msg_path = parsed_url.path
-    raw_msg_id = re.sub('\D','',os.path.split(msg_path)[-1])
-    message_ts = raw_msg_id[:-6] + "." + raw_msg_id[-6:]
-    
-    user = client.users_lookupByEmail(email=vto_form_receipient)
-    vto_user_id = user["user"]["id"]
-    
-    response = client.conversations_history(channel=vto_channel_source,
-                                                    latest=message_ts,
-                                                    limit=1,
-                                                    inclusive=True)
-    
-    message_text = response["messages"][0]["text"]
-    thread_ts = response["messages"][0]["ts"]
-    
-    conversation_replies = client.conversations_replies(channel=vto_channel_source,
-                                            ts=thread_ts)
-    vto_reaction_count = 0
-    vto_success_count = 0
-    vto_opened_form_count = 0
-    is_vto_in_queue = False
-    is_vto_full = False
-    has_no_thread = False
-    if not "messages" in conversation_replies:
-        has_no_thread = True
-        is_vto_full = False
-    else:
-        for r in conversation_replies["messages"][0]["reactions"]:
-            if r["name"] == "vto":
-                vto_reaction_count = r["count"]
-        
-        if len(conversation_replies["messages"]) > 1:
-            
-            for message in conversation_replies["messages"]:
-                if "username" in message:
-                    if "Success" in message["username"]:
-                        vto_success_count += 1
-                    if "Teamwork Bot" in message["username"] and "Click button to open a leave request form" in message["text"]:
-                        vto_opened_form_count += 1
-        
-        
-                            
-    
-    vto_limit = float(re.search(r"\d+\.\d+", message_text).group(0))
-    vto_limit = rounding_vto_number(vto_limit)
-    
-    logging.info(response)
-    print(f'is_vto_full {is_vto_full}')
-    print(f'has_no_thread {has_no_thread}')
-    print(f'vto_success_count: {vto_success_count}')
-    print(f'vto_opened_form_count: {vto_opened_form_count}')
-    
-    
-    
-    if not is_vto_full and has_no_thread and vto_success_count == 0:
-        is_vto_full = False
-        print(f'set is_vto_full to {is_vto_full}')
-    elif vto_opened_form_count >= vto_limit and vto_opened_form_count > vto_success_count:
-        is_vto_in_queue = True
-        print(f'set is_vto_in_queue to {is_vto_in_queue}')
-        is_vto_full = True
-        print(f'set is_vto_full to {is_vto_full}')
-    elif vto_success_count >= vto_limit:
-        is_vto_full = True
-        print(f'set is_vto_full to {is_vto_full}')
-    else:
-        is_vto_full = False
-        print(f'set is_vto_full to {is_vto_full}')
+    message_ts = message_ts_from_link(vto_message_link)
+    
+    user = slack_user_cache.lookup_by_email(client, vto_form_receipient)
+    vto_user_id = user["id"]
+    
+    # The VTO offer post is the thread root, so its ts is the thread_ts
+    thread_ts = message_ts
+    vto_state = offer_state(client, vto_channel_source, thread_ts)
+    
+    # Atomically take a slot, leased to the form button about to be posted
+    outcome, vto_state, lease = vto_state_store.reserve(vto_channel_source, thread_ts, vto_user_id)
+    logger.info("vto slot: %s %s", outcome, vto_state)
+    
+    is_vto_in_queue = outcome == QUEUE_FULL
+    is_vto_full = outcome in (QUEUE_FULL, FULL)
     
     if is_vto_full:
         ack()
@@ -667,14 +672,7 @@ def execute(ack: Ack, body: dict, respond: Respond, client: WebClient):
             response = client.chat_postEphemeral(
                 user=vto_user_id,
                 username="Teamwork Bot",
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"Oh, the VTO request forms queue is full. Please try again soon, <@{vto_user_id}>."
-                        }
-                    }],
+                blocks=text_blocks(f"Oh, the VTO request forms queue is full. Please try again soon, <@{vto_user_id}>."),
                     #icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_404_512.png",
                     thread_ts=f"{message_ts}",
                     channel=vto_channel_source,
@@ -685,14 +683,7 @@ def execute(ack: Ack, body: dict, respond: Respond, client: WebClient):
             response = client.chat_postMessage(
                 #user=user_id,
                 username="Teamwork Bot",
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"Oh, we've reached the limit of available VTO requests at this time! Thank you, everyone!"
-                        }
-                    }],
+                blocks=text_blocks(f"Oh, we've reached the limit of available VTO requests at this time! Thank you, everyone!"),
                     #icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_404_512.png",
                     thread_ts=f"{message_ts}",
                     channel=vto_channel_source,
@@ -704,42 +695,54 @@ def execute(ack: Ack, body: dict, respond: Respond, client: WebClient):
             #user=f"{vto_user_id}",
             channel=f"{vto_channel_source}",
             text="Click button to open a leave request form.",
-            blocks=[
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"Hello <@{vto_user_id}>!\nTo submit your VTO, Please fill out this form."
-                    }
-                },
-                {
-                    "type": "actions",
-                    "block_id": f"{message_ts}",
-                    "elements": [
-                        {
-                            "type": "button",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "Open VTO form",
-                                "emoji": True
-                            },
-                            "value": "open-leave-request-form",
-                            "action_id": "open-leave-request-form"
-                        }
-                    ]
-                }
-            ],
+            blocks=open_form_message_blocks(vto_user_id, message_ts, lease.lease_id),
             username="Teamwork Bot",
             icon_url="https://drive.google.com/file/d/10sWFW8BDAVGVzX7Jk-J7mxeCVCn49e2p",
             thread_ts=f"{thread_ts}"
         )
 
 SlackRequestHandler.clear_all_log_handlers()
-logging.basicConfig(format="%(asctime)s %(message)s", level=logging.DEBUG)
+configure_logging()
+
+# Built once per container, not per invocation
+slack_handler = SlackRequestHandler(app=app)
+
+def warm_up(targets=None):
+    # Init phase hook: WARM_UP="slack,teamwork" pays the first auth.test, the Teamwork
+    # imports and login before the first event instead of during it; "users" also fills
+    # the Slack user cache from users.list
+    targets = targets or [t.strip() for t in os.environ.get("WARM_UP", "").split(",") if t.strip()]
+    try:
+        if "slack" in targets:
+            authorize_cache.authorize(app.client, os.environ["SLACK_BOT_TOKEN"])
+        if "users" in targets:
+            slack_user_cache.warm(app.client)
+        if "teamwork" in targets:
+            from teamwork_integration_slack_app.teamwork_api.tw_auth import TW_Connector
+            from teamwork_integration_slack_app.teamwork_api import tw_leave_types, tw_directory, tw_locations
+            TW_Connector(base_url = os.environ.get("TEAMWORK_URL"),
+                         portal = os.environ.get("TEAMWORK_PORTAL"),
+                         code = os.environ.get("TEAMWORK_CODE"),
+                         username = os.environ.get("TEAMWORK_USERNAME"),
+                         password = os.environ.get("TEAMWORK_PASSWORD"))._ensure_session()
+    except Exception as e:
+        # A failed warm-up only means the first event pays for it
+        logger.warning("warm up %s failed: %s", targets, e)
+
+if os.environ.get("WARM_UP"):
+    warm_up()
 
 def handler(event, context):
-    slack_handler = SlackRequestHandler(app=app)
-    return slack_handler.handle(event, context)
+    authorize_cache.begin_invocation()
+    # Opened here so auth.test, which runs before the listener middleware, is counted too;
+    # every Slack and Teamwork call of the invocation is cut to the Lambda's remaining time
+    with deadlines.invocation(Deadline.from_lambda_context(context)), instrumentation.invocation(), \
+        idempotency_guard.invocation() as claim:
+        response = slack_handler.handle(event, context)
+        # A failed request is handled again when Slack retries it
+        idempotency_guard.finish(claim, response.get("statusCode", 200), response.get("body", ""))
+    logger.debug("authorize cache: %s", authorize_cache.report())
+    return response
 
 # Start teamwork integration slack app
 #if __name__ == "__main__":
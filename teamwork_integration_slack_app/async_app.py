@@ -0,0 +1,364 @@
+import os
+import logging
+import json
+import re
+from datetime import datetime, timezone
+
+# .env is for local runs, a deployed worker gets its configuration from its environment.
+# Loaded before the package imports, their module-level caches read the environment
+if not os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+from slack_sdk.web.async_client import AsyncWebClient
+from slack_bolt.async_app import AsyncApp, AsyncAck
+
+from teamwork_integration_slack_app.teamwork_api.tw_auth import Employee_Leave_Request
+from teamwork_integration_slack_app.teamwork_api.tw_async import AsyncTW_Connector
+from teamwork_integration_slack_app.teamwork_api.tw_locations import TW_Location, resolve_timezone
+from teamwork_integration_slack_app.teamwork_api.tw_day_hours import day_hours_engine
+from teamwork_integration_slack_app.teamwork_api.tw_leave_types import leave_type_catalog, TW_Leave_Type_Not_Found
+from teamwork_integration_slack_app.slack_api.slack_auth import Authorize_Cache
+from teamwork_integration_slack_app.slack_api.slack_threads import thread_reader
+from teamwork_integration_slack_app.slack_api.slack_users import slack_user_cache
+from teamwork_integration_slack_app.instrumentation import instrumentation
+from teamwork_integration_slack_app.log_config import configure_logging
+from teamwork_integration_slack_app.common import date_format, \
+    message_ts_from_link, slack_user_timezone, convert_vto_times, \
+    leave_request_fields, submission_errors, INVALID_RANGE_ERRORS, workflow_step_config_view, \
+    workflow_step_update, leave_request_form_view, open_form_message_blocks, text_blocks, \
+    submitted_vto_times, submission_retry_view, submission_status_view
+
+logger = logging.getLogger(__name__)
+
+# AsyncApp variant of app.py for a long-running worker: every listener awaits its
+# Slack and Teamwork calls, so one event loop can multiplex many submissions.
+# Run with: python -m teamwork_integration_slack_app.async_app
+
+authorize_cache = Authorize_Cache(ttl_seconds=float(os.environ.get("SLACK_AUTH_CACHE_TTL", 3600)))
+
+async def authorize(client: AsyncWebClient):
+    token = os.environ["SLACK_BOT_TOKEN"]
+    return await authorize_cache.authorize_async(client, token)
+
+app = AsyncApp(authorize=authorize)
+
+# Per-call latency of every Slack and Teamwork call, summarized once per request
+app.middleware(instrumentation.async_listener_middleware)
+
+# One connector (and aiohttp connection pool) for the whole worker
+tw_connector = AsyncTW_Connector(base_url = os.environ.get("TEAMWORK_URL", ""),
+                                 portal = os.environ.get("TEAMWORK_PORTAL", ""),
+                                 code = os.environ.get("TEAMWORK_CODE", ""),
+                                 username = os.environ.get("TEAMWORK_USERNAME", ""),
+                                 password = os.environ.get("TEAMWORK_PASSWORD", ""))
+
+@app.error
+async def handle_errors(error: Exception, body: dict, logger: logging.Logger):
+    authorize_cache.invalidate_on_error(error)
+    logger.exception('Unhandled error: %s', error)
+
+@app.event("tokens_revoked")
+@app.event("app_uninstalled")
+async def handle_tokens_revoked(ack: AsyncAck):
+    await ack()
+    authorize_cache.invalidate()
+
+@app.event("user_change")
+async def handle_user_change(ack: AsyncAck, event: dict):
+    # Keeps the cached profile (and email -> id mapping) in sync with Slack
+    await ack()
+    slack_user_cache.update(event["user"])
+
+@app.action({"type": "workflow_step_edit", "callback_id": "leave_request"})
+async def edit(body: dict, ack: AsyncAck, client: AsyncWebClient):
+    await ack()
+    await client.views_open(trigger_id = body["trigger_id"],
+                            view = workflow_step_config_view())
+
+@app.view("vto_workflow_view")
+async def save(ack: AsyncAck, client: AsyncWebClient, body: dict):
+    await ack()
+    await client.api_call(api_method = "workflows.updateStep",
+                          json = workflow_step_update(body))
+
+@app.action("open-leave-request-form")
+async def button_click(ack: AsyncAck, body: dict, client: AsyncWebClient):
+    await ack()
+
+    channel_id = body["container"]["channel_id"]
+    thread_ts = body["container"]["thread_ts"]
+
+    snapshot = await thread_reader.asnapshot(client, channel_id, thread_ts)
+
+    if snapshot.is_full:
+        await client.chat_postMessage(
+            username="Teamwork Bot",
+            blocks=text_blocks(f"Oh, we've reached the limit of available VTO requests at this time! Thank you, everyone!"),
+            thread_ts=f"{thread_ts}",
+            channel=f"{channel_id}",
+            text=f"fallback text"
+        )
+        return
+
+    message_mention = body["message"]["blocks"][0]["text"]["text"]
+    match = re.search(r"<@(.*?)>", message_mention.strip())
+    if not match:
+        return
+    message_mention = match.group(1)
+    user_id = body["user"]["id"]
+    if not user_id == message_mention:
+        await client.chat_postEphemeral(
+            user=user_id,
+            username="Caution",
+            blocks=text_blocks(f"Hi <@{user_id}>, please react :vto: to the post to open your vto request form."),
+            icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_404_512.png",
+            thread_ts=f"{thread_ts}",
+            channel=channel_id,
+            text="fallback text"
+        )
+        return
+
+    await client.views_open(
+        trigger_id = body["trigger_id"],
+        view=leave_request_form_view(thread_ts = thread_ts,
+                                     message_ts = body["container"]["message_ts"],
+                                     response_url = body["response_url"],
+                                     message_mention = message_mention,
+                                     channel_id = channel_id)
+    )
+
+@app.view_closed("leave-request-submission")
+async def handle_view_closed_events(ack: AsyncAck, body: dict, client: AsyncWebClient):
+    await ack()
+    private_metadata = json.loads(body["view"]["private_metadata"])
+    message_ts = private_metadata["message_ts"]
+    message_mention = private_metadata["message_mention"]
+    thread_ts = private_metadata["thread_ts"]
+    channel_id = private_metadata["channel_id"]
+    user_id = body["user"]["id"]
+
+    if body["view"]["notify_on_close"] and not body["is_cleared"]:
+        if (user_id == message_mention and not message_mention == ""):
+            await client.chat_delete(channel=channel_id, ts=message_ts)
+        await client.chat_postEphemeral(
+            user=user_id,
+            username="Cancel",
+            blocks=text_blocks(f"I see that you have closed the VTO form, <@{user_id}>. You can try again if by accident."),
+            icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_error_512.png",
+            thread_ts=f"{thread_ts}",
+            channel=f"{channel_id}",
+            text=f"You've cancelled the form, <@{user_id}>"
+        )
+
+async def handle_submission(ack: AsyncAck, body: dict, client: AsyncWebClient):
+    await submit_leave_request(body, client, ack)
+
+async def ack_submission(ack: AsyncAck, body: dict):
+    # SUBMISSION_FAST_ACK: validate inline, then swap the form for a status view right away
+    vto_start_time, vto_end_time = submitted_vto_times(body["view"])
+    if vto_start_time >= vto_end_time:
+        await ack(INVALID_RANGE_ERRORS)
+        return
+    await ack(response_action="update",
+              view=submission_status_view("Submitting your VTO request to Teamwork...", body["view"]["private_metadata"]))
+
+async def process_submission(body: dict, client: AsyncWebClient):
+    # Lazy listener, runs as a task on the event loop after the ack
+    vto_start_time, vto_end_time = submitted_vto_times(body["view"])
+    if vto_start_time >= vto_end_time:
+        # Lazy listeners run even when the ack returned errors
+        return
+    view_id = body["view"]["id"]
+
+    async def respond(response=None):
+        # Shows what the ack of handle_submission would have, on the status view
+        if response and response.get("response_action") == "errors":
+            error = next(iter(response["errors"].values()))
+            await client.views_update(view_id=view_id, view=submission_retry_view(body["view"], error))
+        elif response:
+            await client.views_update(view_id=view_id,
+                                      view=submission_status_view("Your VTO request was processed, the result is in the thread.",
+                                                                  body["view"]["private_metadata"]))
+
+    try:
+        await submit_leave_request(body, client, respond)
+    except Exception as e:
+        # Without a response the status view would say "Submitting..." for good
+        logger.exception("Unhandled error in the VTO submission: %s", e)
+        await respond(submission_errors("Teamwork could not take the request, Try again."))
+
+async def submit_leave_request(body: dict, client: AsyncWebClient, ack):
+    # Without process_before_response the first ack() is sent right away, so ack exactly once
+    private_metadata = json.loads(body["view"]["private_metadata"])
+    message_ts = private_metadata["message_ts"]
+    message_mention = private_metadata["message_mention"]
+    thread_ts = private_metadata["thread_ts"]
+    channel_id = private_metadata["channel_id"]
+
+    vto_start_time, vto_end_time = submitted_vto_times(body["view"])
+    if vto_start_time >= vto_end_time:
+        await ack(INVALID_RANGE_ERRORS)
+        return
+
+    user = await slack_user_cache.get_user_async(client, body["user"]["id"])
+    user_id = user["id"]
+    user_email = user["profile"]["email"]
+
+    response = await tw_connector.get_employee_by_email(user_email)
+    if response.json()['Total'] == 0:
+        await ack({"response_action": "clear"})
+        if (user_id == message_mention and not message_mention == ""):
+            await client.chat_delete(channel=channel_id, ts=message_ts)
+        await client.chat_postMessage(
+            username="Error",
+            blocks=text_blocks(f"Sorry, <@{user_id}>, you cannot request VTO because you are not a registered employee in the Teamwork system. Please contact the admin for help."),
+            icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_error_512.png",
+            thread_ts=f"{thread_ts}",
+            channel=f"{channel_id}",
+            text=f"Sorry, <@{user_id}>, you cannot take VTO request because you are not registered employee in Teamwork system. Please contact admin for help."
+        )
+        return
+    tw_employee = response.json()['Data'][0]
+
+    my_tw_location = None
+    tw_locations = (await tw_connector.get_employee_locations(tw_employee['Id'])).json()
+    for loc in tw_locations:
+        if loc['IsDefault']:
+            tw_timezone = (await tw_connector.get_location(loc['BusinessId'])).json()['TimeZone']
+            my_tw_location = TW_Location(business_id=loc['BusinessId'],
+                                         business_name=loc.get('BusinessName'),
+                                         timezone_label=tw_timezone,
+                                         tz=resolve_timezone(tw_timezone))
+
+    user_tz_offset = user["tz_offset"]
+    aware_vto_start_time, aware_vto_end_time, aware_tw_vto_start_time, aware_tw_vto_end_time = \
+        convert_vto_times(vto_start_time, vto_end_time, slack_user_timezone(user), my_tw_location.tz)
+    formatted_tw_start_time = datetime.strftime(aware_tw_vto_start_time,date_format)
+    formatted_tw_end_time = datetime.strftime(aware_tw_vto_end_time,date_format)
+
+    try:
+        selected_leave_type = await leave_type_catalog.get_vto_leave_type_async(tw_connector)
+    except TW_Leave_Type_Not_Found as e:
+        logger.error("%s", e)
+        await ack(submission_errors("VTO leave type is not set up in Teamwork. Please contact the admin for help."))
+        return
+
+    tw_leave_request = Employee_Leave_Request(**leave_request_fields(tw_employee,
+                                                                     selected_leave_type,
+                                                                     formatted_tw_start_time,
+                                                                     formatted_tw_end_time))
+    # Daily hours from the location's rules, Teamwork's calcdailyhours without one or for a verified sample
+    day_hours = day_hours_engine.calculate(my_tw_location.business_id, my_tw_location.tz,
+                                           aware_tw_vto_start_time, aware_tw_vto_end_time)
+    if day_hours is None or day_hours_engine.should_verify():
+        server_day_hours = (await tw_connector.calc_daily_hours(tw_leave_request.to_json())).json()
+        day_hours = server_day_hours if day_hours is None \
+            else day_hours_engine.verify(day_hours, server_day_hours, my_tw_location.business_id)
+    tw_leave_request.DayHours = day_hours
+
+    final_response = await tw_connector.post_leave_request(tw_employee["Id"], tw_leave_request.to_json())
+
+    if final_response.status_code == 409:
+        await ack(submission_errors("Conflicted with other request, Try again."))
+        return
+    elif final_response.status_code == 200:
+        if os.environ.get("DEBUG"):
+            text_output = f'VTO Submission from <@{user_id}> completed:\
+                \n*VTO Start Time:*\n{aware_vto_start_time}\
+                \n*VTO End Time:*\n{aware_vto_end_time}\
+                \n*Slack User\'s Local Timezone Offset:*\n{user_tz_offset}\
+                \n*Converted to UTC VTO Start Time:*\n{aware_vto_start_time.astimezone(timezone.utc)}\
+                \n*Converted to UTC VTO End Time:*\n{aware_vto_end_time.astimezone(timezone.utc)}\
+                \n*Defaulted TW Location Name:*\n{my_tw_location.business_name}\
+                \n*Defaulted TW Location\'s timezone:*\n{my_tw_location.timezone_string}\
+                \n*Converted VTO Start Time based on TW Location:*\n{aware_tw_vto_start_time}\
+                \n*Converted VTO End Time based on TW Location:*\n{aware_tw_vto_end_time}'
+        else:
+            text_output = f"VTO Submission from <@{user_id}> completed:\
+                \n*VTO Start Time:* \n{aware_vto_start_time.strftime('%A, %B %d %Y %I:%M%p')}\
+                \n*VTO End Time:* \n{aware_vto_end_time.strftime('%A, %B %d %Y %I:%M%p')}"
+
+        await ack({"response_action": "clear"})
+        if (user_id == message_mention and not message_mention == ""):
+            await client.chat_delete(channel=channel_id, ts=message_ts)
+        await client.chat_postMessage(
+            username="Success",
+            blocks=text_blocks(text_output),
+            icon_url="https://convorelay.com/wp-content/uploads/2023/01/convo_bot_success_512.png",
+            thread_ts=f"{thread_ts}",
+            channel=f"{channel_id}",
+            text=f"fallback text"
+        )
+    else:
+        await ack(submission_errors("Teamwork could not take the request, Try again."))
+
+if os.environ.get("SUBMISSION_FAST_ACK", "").lower() in ("1", "true", "yes"):
+    app.view("leave-request-submission")(ack=ack_submission, lazy=[process_submission])
+else:
+    app.view("leave-request-submission")(handle_submission)
+
+@app.shortcut("leave-request-shortcut")
+async def open_modal(ack: AsyncAck, body: dict, client: AsyncWebClient):
+    await ack()
+
+@app.event("workflow_step_execute")
+async def execute(ack: AsyncAck, body: dict, client: AsyncWebClient):
+    await ack()
+
+    step = body["event"]["workflow_step"]
+    vto_form_receipient = step["inputs"]["vtoFormReceipient"]["value"]
+    vto_channel_source = re.sub('[^A-Za-z0-9]+', '', step["inputs"]["vtoChannelSource"]["value"])
+    message_ts = message_ts_from_link(step["inputs"]["vtoMessageLink"]["value"])
+
+    user = await slack_user_cache.lookup_by_email_async(client, vto_form_receipient)
+    vto_user_id = user["id"]
+
+    # The VTO offer post is the thread root, so its ts is the thread_ts
+    thread_ts = message_ts
+    snapshot = await thread_reader.asnapshot(client, vto_channel_source, thread_ts)
+    vto_success_count = snapshot.success_count
+    vto_opened_form_count = snapshot.opened_form_count
+    has_no_thread = snapshot.message_count <= 1
+    vto_limit = snapshot.vto_limit
+
+    is_vto_in_queue = False
+    if has_no_thread and vto_success_count == 0:
+        is_vto_full = False
+    elif vto_opened_form_count >= vto_limit and vto_opened_form_count > vto_success_count:
+        is_vto_in_queue = True
+        is_vto_full = True
+    else:
+        is_vto_full = vto_success_count >= vto_limit
+
+    if is_vto_in_queue:
+        await client.chat_postEphemeral(
+            user=vto_user_id,
+            username="Teamwork Bot",
+            blocks=text_blocks(f"Oh, the VTO request forms queue is full. Please try again soon, <@{vto_user_id}>."),
+            thread_ts=f"{message_ts}",
+            channel=vto_channel_source,
+            text=f"Oh, the VTO request forms queue is full. Please try again soon, <@{vto_user_id}>."
+        )
+    elif is_vto_full:
+        await client.chat_postMessage(
+            username="Teamwork Bot",
+            blocks=text_blocks(f"Oh, we've reached the limit of available VTO requests at this time! Thank you, everyone!"),
+            thread_ts=f"{message_ts}",
+            channel=vto_channel_source,
+            text=f"fallback text"
+        )
+    else:
+        await client.chat_postMessage(
+            channel=f"{vto_channel_source}",
+            text="Click button to open a leave request form.",
+            blocks=open_form_message_blocks(vto_user_id, message_ts),
+            username="Teamwork Bot",
+            icon_url="https://drive.google.com/file/d/10sWFW8BDAVGVzX7Jk-J7mxeCVCn49e2p",
+            thread_ts=f"{thread_ts}"
+        )
+
+# Start the asyncio worker
+if __name__ == "__main__":
+    configure_logging()
+    app.start(port=int(os.environ.get("PORT", 3000)))
@@ -0,0 +1,124 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+import contextvars
+import logging
+import os
+
+from teamwork_integration_slack_app.common import date_format, convert_vto_times, leave_request_fields
+from teamwork_integration_slack_app.teamwork_api.tw_auth import Employee_Leave_Request
+from teamwork_integration_slack_app.teamwork_api.tw_leave_types import leave_type_catalog
+from teamwork_integration_slack_app.teamwork_api.tw_directory import employee_directory
+from teamwork_integration_slack_app.teamwork_api.tw_locations import location_registry
+from teamwork_integration_slack_app.teamwork_api.tw_day_hours import day_hours_engine
+from teamwork_integration_slack_app.teamwork_api.tw_conflicts import leave_conflicts
+
+logger = logging.getLogger(__name__)
+
+# Leave requests in flight at once, kept below the Teamwork transport's pool size
+BULK_CONCURRENCY = int(os.environ.get("BULK_SUBMISSION_CONCURRENCY", 5))
+
+# Per-employee outcomes of a bulk submission
+SUBMITTED = "submitted"
+NOT_REGISTERED = "not_registered"
+NO_LOCATION = "no_location"
+CONFLICT = "conflict"
+FAILED = "failed"
+
+@dataclass
+class Bulk_Result(object):
+    email: str
+    status: str
+    employee_id: int = None
+    employee_name: str = None
+    start: str = None
+    end: str = None
+    status_code: int = None
+    detail: str = None
+
+    @property
+    def ok(self):
+        return self.status == SUBMITTED
+
+
+def submit_bulk_leave_requests(connector, emails, vto_start_time, vto_end_time, user_tz, concurrency=None):
+    """Grants the same VTO window to every employee in emails, returns a Bulk_Result per email.
+
+    vto_start_time and vto_end_time are unix timestamps, shown in user_tz (the
+    supervisor's timezone) and converted to each employee's location timezone.
+    The VTO leave type is looked up once, all employees are resolved in one
+    directory pass, and at most concurrency leave requests are in flight.
+    Raises TW_Leave_Type_Not_Found before any leave request is sent.
+    """
+    emails = list(dict.fromkeys(email.strip() for email in emails if email and email.strip()))
+    leave_type = leave_type_catalog.get_vto_leave_type(connector)
+    employees = employee_directory.lookup_many(connector, emails)
+
+    def submit(email):
+        employee = employees.get(email)
+        if employee is None:
+            return Bulk_Result(email=email, status=NOT_REGISTERED)
+        try:
+            return _submit_one(connector, email, employee, leave_type, vto_start_time, vto_end_time, user_tz)
+        except Exception as e:
+            logger.warning("bulk leave request for employee %s failed: %s", employee["Id"], e, exc_info=True)
+            return Bulk_Result(email=email, status=FAILED, employee_id=employee["Id"],
+                               employee_name=employee["FullName"], detail=str(e))
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency or BULK_CONCURRENCY),
+                            thread_name_prefix="bulk-leave-request") as pool:
+        # Each submission gets a copy of the context, so its calls count towards the current invocation
+        futures = [pool.submit(contextvars.copy_context().run, submit, email) for email in emails]
+        results = [future.result() for future in futures]
+
+    logger.info("bulk leave requests: %s", summarize(results))
+    return results
+
+def _submit_one(connector, email, employee, leave_type, vto_start_time, vto_end_time, user_tz):
+    # Same steps as a single form submission: location, conflicts, daily hours, then the leave request
+    location = location_registry.get_default_location(connector, employee["Id"])
+    if location is None:
+        return Bulk_Result(email=email, status=NO_LOCATION, employee_id=employee["Id"], employee_name=employee["FullName"])
+
+    _, _, tw_start, tw_end = convert_vto_times(vto_start_time, vto_end_time, user_tz, location.tz)
+    start, end = datetime.strftime(tw_start, date_format), datetime.strftime(tw_end, date_format)
+    if leave_conflicts.conflict(connector, employee["Id"], tw_start, tw_end, location.tz) is not None:
+        return Bulk_Result(email=email, status=CONFLICT, employee_id=employee["Id"], employee_name=employee["FullName"],
+                           start=start, end=end, detail="Conflicted with another leave request")
+    leave_request = Employee_Leave_Request(**leave_request_fields(employee, leave_type, start, end))
+    leave_request.DayHours = day_hours_engine.day_hours(connector, leave_request, location, tw_start, tw_end)
+
+    response = connector.post_leave_request(employee["Id"], leave_request.to_json())
+    result = Bulk_Result(email=email, status=SUBMITTED, employee_id=employee["Id"], employee_name=employee["FullName"],
+                         start=start, end=end, status_code=response.status_code)
+    if response.status_code == 409:
+        leave_conflicts.forget(employee["Id"])
+        result.status = CONFLICT
+        result.detail = "Conflicted with another leave request"
+    elif response.status_code == 200:
+        leave_conflicts.add(employee["Id"], tw_start, tw_end)
+    else:
+        result.status = FAILED
+        result.detail = f"Teamwork answered {response.status_code}"
+    return result
+
+def summarize(results):
+    # {"submitted": 18, "not_registered": 2}
+    summary = {}
+    for result in results:
+        summary[result.status] = summary.get(result.status, 0) + 1
+    return summary
+
+def bulk_report_text(results):
+    # mrkdwn report of a bulk submission, one line per employee that wasn't submitted
+    summary = summarize(results)
+    lines = [f'*Bulk VTO submission:* {summary.get(SUBMITTED, 0)} of {len(results)} submitted']
+    labels = {NOT_REGISTERED: "not a registered employee in Teamwork",
+              NO_LOCATION: "no default location in Teamwork",
+              CONFLICT: "conflicted with another leave request",
+              FAILED: "failed"}
+    for result in results:
+        if not result.ok:
+            detail = f' ({result.detail})' if result.status == FAILED and result.detail else ""
+            lines.append(f'• {result.employee_name or result.email}: {labels[result.status]}{detail}')
+    return "\n".join(lines)
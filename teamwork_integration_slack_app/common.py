@@ -0,0 +1,391 @@
+import os
+import re
+import json
+import math
+import logging
+from urllib.parse import urlparse
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Shared by the sync (app.py) and async (async_app.py) listeners
+
+logger = logging.getLogger(__name__)
+
+date_format = "%Y-%m-%dT%H:%M:%S%z"
+
+VTO_LEAVE_TYPE_TITLE = "VTO: Slack"
+VTO_LEAVE_TYPE_CODE = "VTOSLACK"
+
+# Rounding Numbering
+def rounding_vto_number(n, decimals=0):
+    if n < 1.0:
+        multiplier = 10 ** decimals
+        r = math.ceil(n * multiplier) / multiplier
+        logger.debug('%s rounded up to %s', n, r)
+    else:
+        multiplier = 10 ** decimals
+        r = math.floor(n * multiplier) / multiplier
+        logger.debug('%s rounded down to %s', n, r)
+    return r
+
+def parse_vto_limit(message_text):
+    # The VTO offer post carries the number of available slots as a decimal, e.g. "2.0"
+    return rounding_vto_number(float(re.search(r"\d+\.\d+", message_text).group(0)))
+
+def message_ts_from_link(message_link):
+    # https://<workspace>.slack.com/archives/<channel>/p1671234567123456 -> 1671234567.123456
+    msg_path = urlparse(message_link).path
+    raw_msg_id = re.sub(r'\D', '', os.path.split(msg_path)[-1])
+    return raw_msg_id[:-6] + "." + raw_msg_id[-6:]
+
+def vto_message_kind(message):
+    # "success" for a posted leave request, "opened" for a form button still in the thread
+    username = message.get("username", "")
+    if "Success" in username:
+        return "success"
+    if "Teamwork Bot" in username and "Click button to open a leave request form" in message.get("text", ""):
+        return "opened"
+    return None
+
+def slack_user_timezone(slack_user):
+    # The IANA zone keeps DST right for dates after a change, tz_offset is only right for today
+    try:
+        return ZoneInfo(slack_user["tz"])
+    except (KeyError, TypeError, ValueError, ZoneInfoNotFoundError):
+        return timezone(timedelta(seconds=slack_user["tz_offset"]))
+
+def convert_vto_times(vto_start_time, vto_end_time, user_tz, tw_tz):
+    # Slack datetimepicker values are unix timestamps, show them in the user's and the location's timezone
+    aware_vto_start_time = datetime.fromtimestamp(vto_start_time, user_tz)
+    aware_vto_end_time = datetime.fromtimestamp(vto_end_time, user_tz)
+    aware_tw_vto_start_time = aware_vto_start_time.astimezone(tw_tz)
+    aware_tw_vto_end_time = aware_vto_end_time.astimezone(tw_tz)
+    return aware_vto_start_time, aware_vto_end_time, aware_tw_vto_start_time, aware_tw_vto_end_time
+
+def leave_request_fields(tw_employee, selected_leave_type, formatted_tw_start_time, formatted_tw_end_time):
+    # Keyword arguments for Employee_Leave_Request
+    return dict(EmpId = tw_employee["Id"],
+                EmpName = tw_employee["FullName"],
+                Employees = [{"Id": tw_employee["Id"],
+                              "Title": tw_employee["FullName"]}],
+                Start = formatted_tw_start_time,
+                End = formatted_tw_end_time,
+                StartTime = formatted_tw_start_time,
+                EndTime = formatted_tw_end_time,
+                TypeId=selected_leave_type['Id'],
+                LeaveTypes = [selected_leave_type],
+                MinDate = datetime.today().strftime(date_format),
+                MaxDate = (datetime.today() + timedelta(days=365*2)).strftime(date_format),
+                DayHours = [{
+                    "Date": formatted_tw_start_time,
+                    "Count": None,
+                    "Value": 1,
+                    "Description": None,
+                    "Id": 0,
+                    "Title": None
+                    }]
+                )
+
+def submitted_vto_times(view):
+    # (start, end) unix timestamps picked in the leave request form
+    values = view["state"]["values"]
+    return (values["vto_start_time_input"]["vto_start_time"]["selected_date_time"],
+            values["vto_end_time_input"]["vto_end_time"]["selected_date_time"])
+
+def submission_errors(message):
+    return {
+        "response_action": "errors",
+        "errors": {
+            "vto_start_time_input": message,
+            "vto_end_time_input": message
+        }
+    }
+
+INVALID_RANGE_ERRORS = {
+    "response_action": "errors",
+    "errors": {
+        "vto_start_time_input": "This cannot be more than or equal to the VTO End Time.",
+        "vto_end_time_input": "This cannot be less than or equal to the VTO Start Time."
+    }
+}
+
+def workflow_step_config_view():
+    return {
+        "type": "workflow_step",
+        "callback_id": "vto_workflow_view",
+        "blocks": [
+            {
+                "type": "section",
+                "text": {
+                    "type": "plain_text",
+                    "text": "VTO Request Trigger Setting"
+                },
+            },
+            {
+                "type": "input",
+                "block_id": "vto_form_receipient_input",
+                "element": {
+                    "type": "plain_text_input",
+                    "action_id": "vto_form_receipient"
+                },
+                "label": {
+                    "type": "plain_text",
+                    "text": "Place the person who reacted with email address in here please."
+                }
+            },
+            {
+                "type": "input",
+                "block_id": "vto_channel_id_input",
+                "element": {
+                    "type": "plain_text_input",
+                    "action_id": "vto_channel_id"
+                },
+                "label": {
+                    "type": "plain_text",
+                    "text": "Place the channel variable where the react was used in please."
+                }
+            },
+            {
+                "type": "input",
+                "block_id": "vto_message_link_input",
+                "element": {
+                    "type": "plain_text_input",
+                    "action_id": "vto_message_link"
+                },
+                "label": {
+                    "type": "plain_text",
+                    "text": "Place \"Link to message reacted on\" variable in here please."
+                }
+            }
+        ]
+    }
+
+def workflow_step_update(body):
+    # JSON body for workflows.updateStep after the step configuration was saved
+    state_values = body["view"]["state"]["values"]
+    return {
+        "workflow_step_edit_id": body["workflow_step"]["workflow_step_edit_id"],
+
+        "inputs": {
+            "vtoFormReceipient": {
+                    "value": state_values["vto_form_receipient_input"]["vto_form_receipient"]["value"],
+                },
+            "vtoChannelSource": {
+                    "value": state_values["vto_channel_id_input"]["vto_channel_id"]["value"],
+                },
+            "vtoMessageLink": {
+                    "value": state_values["vto_message_link_input"]["vto_message_link"]["value"],
+                },
+            },
+        "outputs": [
+            {
+                "name": "vtoFormReceipient",
+                "type": "text",
+                "label": "VTO Form Receipient",
+            },
+            {
+                "name": "vtoChannelSource",
+                "type": "text",
+                "label": "Channel Source",
+            },
+            {
+                "name": "vtoMessageLink",
+                "type": "text",
+                "label": "Message Link",
+            },
+        ],
+    }
+
+def vto_time_blocks(initial_start_time=None, initial_end_time=None):
+    # Start and end datetimepickers, read back by submitted_vto_times
+    return [
+        {
+            "type": "input",
+            "block_id": "vto_start_time_input",
+            "element": {
+                "type": "datetimepicker",
+                "action_id": "vto_start_time",
+                "initial_date_time": initial_start_time or int(datetime.today().replace(microsecond=0, second=0, minute=0).timestamp())
+            },
+            "label": {
+                "type": "plain_text",
+                "text": "VTO Start Time",
+            }
+        },
+        {
+            "type": "input",
+            "block_id": "vto_end_time_input",
+            "element": {
+                "type": "datetimepicker",
+                "action_id": "vto_end_time",
+                "initial_date_time": initial_end_time or int((datetime.today().replace(microsecond=0, second=0, minute=0) + timedelta(hours=1)).timestamp())
+            },
+            "label": {
+                "type": "plain_text",
+                "text": "VTO End Time",
+            }
+        }
+    ]
+
+def leave_request_form_view(thread_ts, message_ts, response_url, message_mention, channel_id,
+                            initial_start_time=None, initial_end_time=None, error=None, lease_id=""):
+    # initial_*_time and error re-open the form after a failed background submission,
+    # lease_id is the VTO slot the form holds
+    view = {
+        "type": "modal",
+        "callback_id": "leave-request-submission",
+        "title": {
+            "type": "plain_text",
+            "text": "VTO Request Form",
+        },
+        "submit": {
+            "type": "plain_text",
+            "text": "Submit",
+        },
+        "close": {
+            "type": "plain_text",
+            "text": "Cancel",
+        },
+        "blocks": vto_time_blocks(initial_start_time, initial_end_time),
+        "notify_on_close": True,
+        "private_metadata": f'{{\
+            "thread_ts": "{thread_ts}",\
+            "message_ts": "{message_ts}",\
+            "response_url": "{response_url}",\
+            "message_mention": "{message_mention}",\
+            "channel_id": "{channel_id}",\
+            "lease_id": "{lease_id}"\
+            }}'
+    }
+    if error:
+        view["blocks"].insert(0, {
+            "type": "context",
+            "elements": [{"type": "mrkdwn", "text": f":warning: {error}"}]
+        })
+    return view
+
+def bulk_request_form_view():
+    # leave-request-shortcut: one VTO window for several agents, picked in Slack or typed as emails
+    return {
+        "type": "modal",
+        "callback_id": "bulk-leave-request-submission",
+        "title": {
+            "type": "plain_text",
+            "text": "Bulk VTO Request",
+        },
+        "submit": {
+            "type": "plain_text",
+            "text": "Submit",
+        },
+        "close": {
+            "type": "plain_text",
+            "text": "Cancel",
+        },
+        "blocks": [
+            {
+                "type": "input",
+                "block_id": "bulk_agents_input",
+                "optional": True,
+                "element": {
+                    "type": "multi_users_select",
+                    "action_id": "bulk_agents",
+                },
+                "label": {
+                    "type": "plain_text",
+                    "text": "Agents",
+                }
+            },
+            {
+                "type": "input",
+                "block_id": "bulk_emails_input",
+                "optional": True,
+                "element": {
+                    "type": "plain_text_input",
+                    "action_id": "bulk_emails",
+                    "multiline": True,
+                },
+                "label": {
+                    "type": "plain_text",
+                    "text": "Or Teamwork emails, one per line",
+                }
+            },
+        ] + vto_time_blocks(),
+    }
+
+def submitted_bulk_agents(view):
+    # (Slack user ids, emails) picked in the bulk request form
+    values = view["state"]["values"]
+    user_ids = values.get("bulk_agents_input", {}).get("bulk_agents", {}).get("selected_users") or []
+    emails = values.get("bulk_emails_input", {}).get("bulk_emails", {}).get("value") or ""
+    return user_ids, [email.strip() for email in re.split(r"[\s,;]+", emails) if email.strip()]
+
+def submission_retry_view(view, error):
+    # The submitted form again, with the user's times and the error on top
+    metadata = json.loads(view["private_metadata"])
+    vto_start_time, vto_end_time = submitted_vto_times(view)
+    return leave_request_form_view(thread_ts = metadata["thread_ts"],
+                                   message_ts = metadata["message_ts"],
+                                   response_url = metadata["response_url"],
+                                   message_mention = metadata["message_mention"],
+                                   channel_id = metadata["channel_id"],
+                                   initial_start_time = vto_start_time,
+                                   initial_end_time = vto_end_time,
+                                   error = error,
+                                   lease_id = metadata.get("lease_id", ""))
+
+def submission_status_view(text, private_metadata, title="VTO Request Form"):
+    # Replaces the form while the leave request is submitted in the background (SUBMISSION_FAST_ACK).
+    # Another callback_id and no notify_on_close, so closing it doesn't count as cancelling the form
+    return {
+        "type": "modal",
+        "callback_id": "leave-request-processing",
+        "title": {
+            "type": "plain_text",
+            "text": title,
+        },
+        "close": {
+            "type": "plain_text",
+            "text": "Close",
+        },
+        "blocks": text_blocks(text),
+        "notify_on_close": False,
+        "private_metadata": private_metadata
+    }
+
+def open_form_message_blocks(vto_user_id, message_ts, lease_id=None):
+    # The button's value carries the lease of the VTO slot held for vto_user_id
+    return [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"Hello <@{vto_user_id}>!\nTo submit your VTO, Please fill out this form."
+            }
+        },
+        {
+            "type": "actions",
+            "block_id": f"{message_ts}",
+            "elements": [
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Open VTO form",
+                        "emoji": True
+                    },
+                    "value": lease_id or "open-leave-request-form",
+                    "action_id": "open-leave-request-form"
+                }
+            ]
+        }
+    ]
+
+def text_blocks(text):
+    return [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": text
+            }
+        }]
@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+import contextvars
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Slack drops the answer to a view_submission after 3 seconds
+SLACK_ACK_SECONDS = float(os.environ.get("SLACK_ACK_SECONDS", 3.0))
+# Kept back from every budget to send the response and flush the logs
+DEADLINE_MARGIN_SECONDS = float(os.environ.get("DEADLINE_MARGIN_SECONDS", 0.25))
+# A call with less time left than this is skipped rather than started
+MIN_CALL_SECONDS = float(os.environ.get("DEADLINE_MIN_CALL_SECONDS", 0.1))
+
+class Deadline_Exceeded(Exception):
+    """Raised when a call can't finish before the invocation's deadline: skipped, or cut short in flight."""
+
+    def __init__(self, operation, remaining, started=False):
+        # started: the call was made but its timeout, cut to the deadline, ran out
+        super().__init__(f'{operation} {"cut short" if started else "skipped"}, '
+                         f'{remaining * 1000:.0f}ms left of the deadline')
+        self.operation = operation
+        self.remaining = remaining
+        self.started = started
+
+
+class Deadline(object):
+    """Time budget of one invocation, measured on the monotonic clock."""
+
+    def __init__(self, seconds, name="lambda"):
+        self.started = time.monotonic()
+        self.expires_at = self.lambda_expires_at = self.started + seconds
+        self.name = name
+        self.skipped = []
+
+    @classmethod
+    def from_lambda_context(cls, context):
+        # None outside Lambda, or for a context without get_remaining_time_in_millis
+        remaining = getattr(context, "get_remaining_time_in_millis", None)
+        if remaining is None:
+            return None
+        return cls(remaining() / 1000 - DEADLINE_MARGIN_SECONDS)
+
+    def narrow(self, seconds, name):
+        # Ends the budget seconds after the invocation started, if that is sooner
+        expires_at = self.started + seconds - DEADLINE_MARGIN_SECONDS
+        if expires_at < self.expires_at:
+            self.expires_at = expires_at
+            self.name = name
+
+    def widen(self):
+        # Back to the Lambda budget, e.g. for the follow-up of a write that was already made
+        self.expires_at = self.lambda_expires_at
+        self.name = "lambda"
+
+    def remaining(self):
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def allows(self, seconds):
+        return self.remaining() >= seconds
+
+    def check(self, operation, needed=MIN_CALL_SECONDS):
+        remaining = self.remaining()
+        if remaining < needed:
+            self.skipped.append(operation)
+            raise Deadline_Exceeded(operation, remaining)
+
+    def timeout(self, default):
+        # default cut to the time left; a (connect, read) tuple is cut element-wise
+        remaining = self.remaining()
+        if isinstance(default, tuple):
+            return tuple(min(value, remaining) for value in default)
+        return remaining if default is None else min(default, remaining)
+
+
+class Deadline_Tracker(object):
+    """The current invocation's Deadline, in a context variable so Stage_Graph threads share it.
+
+    handler() starts one from the Lambda context's remaining time. The
+    listener middleware narrows it to Slack's ack window for view
+    submissions answered inline, whose answer is useless once it is late;
+    the listener widens it back before posting the leave request, which
+    can't be safely retried, so the post is never cut short. Without a deadline (local runs, the asyncio
+    worker) calls keep their configured timeouts.
+    """
+
+    def __init__(self):
+        self._current = contextvars.ContextVar("deadline", default=None)
+
+    @contextmanager
+    def invocation(self, deadline):
+        token = self._current.set(deadline)
+        try:
+            yield deadline
+        finally:
+            self._current.reset(token)
+            if deadline is not None and deadline.skipped:
+                logger.warning("%s deadline skipped %s call(s): %s", deadline.name, len(deadline.skipped),
+                               deadline.skipped)
+
+    def current(self):
+        return self._current.get()
+
+    def check(self, operation, needed=MIN_CALL_SECONDS):
+        deadline = self._current.get()
+        if deadline is not None:
+            deadline.check(operation, needed)
+
+    def timeout(self, default):
+        deadline = self._current.get()
+        return default if deadline is None else deadline.timeout(default)
+
+    def widen(self):
+        deadline = self._current.get()
+        if deadline is not None:
+            deadline.widen()
+
+    def allows(self, seconds):
+        deadline = self._current.get()
+        return deadline is None or deadline.allows(seconds)
+
+    def listener_middleware(self, body, request, next):
+        # Bolt global middleware; lazy listeners run in their own invocation without an ack window
+        deadline = self._current.get()
+        if deadline is not None and body.get("type") == "view_submission" and not request.lazy_only:
+            deadline.narrow(SLACK_ACK_SECONDS, "slack ack")
+        next()
+
+
+deadlines = Deadline_Tracker()
@@ -0,0 +1,182 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from slack_bolt import BoltResponse
+
+from teamwork_integration_slack_app.stores import SQLite_Store, load_store
+
+logger = logging.getLogger(__name__)
+
+def idempotency_key(body):
+    # What Slack keeps when it redelivers a request, or None for requests that aren't deduplicated
+    if body.get("event_id"):
+        # Events API, including workflow_step_execute; retries carry the same event_id
+        return f'event:{body["event_id"]}'
+    payload_type = body.get("type")
+    view = body.get("view") or {}
+    if payload_type == "view_submission" and view.get("id"):
+        # Keyed on what was submitted, not the trigger_id every click gets: a double-click on
+        # Submit is a duplicate, a corrected resubmission isn't
+        values = json.dumps((view.get("state") or {}).get("values"), sort_keys=True)
+        return f'view_submission:{view["id"]}:{hashlib.sha256(values.encode()).hexdigest()[:16]}'
+    if payload_type == "view_closed" and view.get("id"):
+        return f'view_closed:{view["id"]}'
+    if payload_type == "block_actions" and body.get("actions"):
+        return f'block_actions:{body.get("trigger_id")}:{body["actions"][0].get("action_ts")}'
+    if body.get("trigger_id"):
+        # Shortcuts
+        return f'{payload_type}:{body["trigger_id"]}'
+    return None
+
+def answers_with_errors(body):
+    # Whether a response body shows errors on the submitted form
+    try:
+        return json.loads(body or "{}").get("response_action") == "errors"
+    except (ValueError, AttributeError):
+        return False
+
+
+class Dedupe_Store(ABC):
+    """Keys of requests already handled, each kept until it expires.
+
+    claim() must be atomic, so two containers handling the same delivery
+    can't both go ahead.
+    """
+
+    @abstractmethod
+    def claim(self, key, ttl_seconds):
+        # True if key was free (or expired) and is now held for ttl_seconds, False for a duplicate
+        pass
+
+    @abstractmethod
+    def release(self, key):
+        # Frees key, so a redelivery of a request that failed is handled again
+        pass
+
+
+class Memory_Dedupe_Store(Dedupe_Store):
+    """Per-process backend; a retry that lands on another container isn't caught."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key, ttl_seconds):
+        now = time.time()
+        with self._lock:
+            expires_at = self._keys.get(key)
+            if expires_at is not None and expires_at >= now:
+                return False
+            if len(self._keys) >= self.max_keys:
+                self._keys = {k: v for k, v in self._keys.items() if v >= now}
+            self._keys[key] = now + ttl_seconds
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._keys.pop(key, None)
+
+
+class SQLite_Dedupe_Store(SQLite_Store, Dedupe_Store):
+    """File backend, shared by the processes of one host; use a shared store across containers."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._connection().execute("""CREATE TABLE IF NOT EXISTS handled_request (
+                                          key TEXT PRIMARY KEY,
+                                          expires_at REAL NOT NULL)""")
+
+    def claim(self, key, ttl_seconds):
+        now = time.time()
+        conn = self._connection()
+        conn.execute("DELETE FROM handled_request WHERE expires_at < ?", (now,))
+        return conn.execute("INSERT OR IGNORE INTO handled_request (key, expires_at) VALUES (?, ?)",
+                            (key, now + ttl_seconds)).rowcount == 1
+
+    def release(self, key):
+        self._connection().execute("DELETE FROM handled_request WHERE key = ?", (key,))
+
+
+class Idempotency_Guard(object):
+    """Drops Slack retries and duplicate deliveries before any listener runs.
+
+    The listener middleware claims the request's idempotency_key; a request
+    whose key is already held is answered 200 at once, so Slack stops
+    retrying. handler() releases the key when the invocation answered 5xx,
+    so the next retry of a request that failed is handled, and when a form
+    was answered with errors, so it can be submitted again. Bolt's lazy
+    listeners re-deliver the same request to a new invocation on purpose;
+    those runs (request.lazy_only) are never deduplicated.
+    """
+
+    def __init__(self, store=None, ttl_seconds=3600, enabled=True):
+        self.store = store or Memory_Dedupe_Store()
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.stats = {"claimed": 0, "duplicates": 0, "released": 0}
+        self._current = contextvars.ContextVar("idempotency_key", default=None)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def invocation(self):
+        # Yields a holder the middleware fills with the claimed key; call finish() with the response
+        claim = {"key": None}
+        token = self._current.set(claim)
+        try:
+            yield claim
+        finally:
+            self._current.reset(token)
+
+    def finish(self, claim, status_code, body=""):
+        if claim["key"] is not None and (status_code >= 500 or answers_with_errors(body)):
+            self.store.release(claim["key"])
+            self._count("released")
+
+    def release(self, body):
+        # For a submission whose errors are shown later, e.g. by a lazy listener
+        key = idempotency_key(body) if self.enabled else None
+        if key is not None:
+            self.store.release(key)
+            self._count("released")
+
+    def listener_middleware(self, body, request, next):
+        # Bolt global middleware, runs after the request signature was verified
+        key = idempotency_key(body) if self.enabled and not request.lazy_only else None
+        if key is None:
+            return next()
+        if self.store.claim(key, self.ttl_seconds):
+            self._count("claimed")
+            claim = self._current.get()
+            if claim is not None:
+                claim["key"] = key
+            return next()
+        duplicates = self._count("duplicates")
+        retry = request.headers.get("x-slack-retry-num", [None])[0]
+        logger.info("dropped duplicate %s (retry %s, reason %s), %s dropped so far", key, retry,
+                    request.headers.get("x-slack-retry-reason", [None])[0], duplicates)
+        return BoltResponse(status=200, body="")
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+            return self.stats[name]
+
+
+def load_dedupe_store():
+    # IDEMPOTENCY_STORE is "memory", "sqlite" or "package.module:factory" returning a shared Dedupe_Store
+    return load_store("IDEMPOTENCY_STORE", "memory", {
+        "memory": Memory_Dedupe_Store,
+        "sqlite": lambda: SQLite_Dedupe_Store(os.environ.get("IDEMPOTENCY_DB", "/tmp/idempotency.sqlite3"))})
+
+
+idempotency_guard = Idempotency_Guard(store=load_dedupe_store(),
+                                      ttl_seconds=float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 3600)),
+                                      enabled=os.environ.get("IDEMPOTENCY_ENABLED", "true").lower() in ("1", "true", "yes"))
@@ -0,0 +1,351 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+import bisect
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+from teamwork_integration_slack_app.deadline import deadlines
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+EMF_NAMESPACE = "TeamworkIntegrationSlackApp"
+
+def operation_name(endpoint):
+    # "/api/employees/1234/locations" -> "/api/employees/{id}/locations", so histograms don't grow per id
+    return re.sub(r"/\d+", "/{id}", endpoint.split("?")[0])
+
+def payload_size(payload):
+    if payload is None:
+        return 0
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    if isinstance(payload, str):
+        return len(payload.encode())
+    return len(json.dumps(payload, default=str).encode())
+
+
+@dataclass
+class Call_Record(object):
+    target: str
+    operation: str
+    status: str
+    duration_ms: float
+    request_bytes: int = 0
+    response_bytes: int = 0
+    attempts: int = 1
+
+
+class Latency_Histogram(object):
+    """Fixed-bucket latency histogram; percentiles are the upper bound of their bucket."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+        self.errors = 0
+
+    def add(self, duration_ms, error=False):
+        self.counts[bisect.bisect_left(self.buckets, duration_ms)] += 1
+        self.count += 1
+        self.total_ms += duration_ms
+        self.min_ms = duration_ms if self.min_ms is None else min(self.min_ms, duration_ms)
+        self.max_ms = duration_ms if self.max_ms is None else max(self.max_ms, duration_ms)
+        if error:
+            self.errors += 1
+
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.buckets[i] if i < len(self.buckets) else self.max_ms
+        return self.max_ms
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / self.count, 1) if self.count else None,
+            "min_ms": self.min_ms,
+            "max_ms": self.max_ms,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+        }
+
+
+class Invocation(object):
+    """Calls made while handling one Slack request, shared with the stage threads it starts."""
+
+    def __init__(self, listener="unknown"):
+        self.listener = listener
+        self.started = time.perf_counter()
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.calls.append(record)
+
+    def summary(self):
+        with self._lock:
+            calls = list(self.calls)
+        totals = {}
+        for call in calls:
+            total = totals.setdefault(call.target, {"calls": 0, "ms": 0.0, "request_bytes": 0, "response_bytes": 0})
+            total["calls"] += 1
+            total["ms"] = round(total["ms"] + call.duration_ms, 1)
+            total["request_bytes"] += call.request_bytes
+            total["response_bytes"] += call.response_bytes
+        return {
+            "listener": self.listener,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "totals": totals,
+            "calls": [asdict(call) for call in calls],
+        }
+
+
+class Instrumentation(object):
+    """Records duration, status and payload size of every Slack and Teamwork call.
+
+    Calls are attributed to the current invocation (a context variable, so
+    Stage_Graph threads inherit it) and added to per-operation and
+    per-listener histograms that live as long as the process. One summary
+    record per invocation is printed as CloudWatch EMF or plain JSON,
+    depending on INSTRUMENTATION_FORMAT ("emf", "json" or "off").
+    """
+
+    def __init__(self, output_format="emf"):
+        self.output_format = output_format
+        self._current = contextvars.ContextVar("invocation", default=None)
+        self._operations = {}
+        self._listeners = {}
+        self._lock = threading.Lock()
+
+    def record(self, target, operation, status, duration_ms, request_bytes=0, response_bytes=0, attempts=1):
+        record = Call_Record(target=target, operation=operation, status=str(status),
+                             duration_ms=round(duration_ms, 1), request_bytes=request_bytes,
+                             response_bytes=response_bytes, attempts=attempts)
+        invocation = self._current.get()
+        if invocation is not None:
+            invocation.add(record)
+        error = not (record.status == "ok" or record.status.startswith("2"))
+        with self._lock:
+            self._operations.setdefault((target, operation), Latency_Histogram()).add(record.duration_ms, error)
+        return record
+
+    @contextmanager
+    def invocation(self, listener=None):
+        # Nested use (handler() and then the listener middleware) names the outer invocation
+        current = self._current.get()
+        if current is not None:
+            if listener:
+                current.listener = listener
+            yield current
+            return
+
+        current = Invocation(listener or "unknown")
+        token = self._current.set(current)
+        try:
+            yield current
+        finally:
+            self._current.reset(token)
+            self.finish(current)
+
+    def current(self):
+        return self._current.get()
+
+    def finish(self, invocation):
+        summary = invocation.summary()
+        with self._lock:
+            self._listeners.setdefault(invocation.listener, Latency_Histogram()).add(summary["duration_ms"])
+        if self.output_format == "emf":
+            print(json.dumps(self._emf(summary)), flush=True)
+        elif self.output_format == "json":
+            print(json.dumps(summary), flush=True)
+        return summary
+
+    def histograms(self):
+        # For a long-running server: {"operations": {"slack chat.postMessage": {...}}, "listeners": {...}}
+        with self._lock:
+            return {
+                "operations": {f'{target} {operation}': h.summary() for (target, operation), h in self._operations.items()},
+                "listeners": {name: h.summary() for name, h in self._listeners.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+            self._listeners.clear()
+
+    def listener_middleware(self, body, context, next):
+        # Bolt global middleware: names the invocation after the listener it is about to run
+        # and swaps in an instrumented copy of the WebClient Bolt built for this request
+        context["client"] = Instrumented_WebClient.from_client(context["client"])
+        with self.invocation(listener_name(body)):
+            next()
+
+    async def async_listener_middleware(self, body, context, next):
+        # Same for AsyncApp; each request runs in its own task, so its own context
+        context["client"] = instrumented_async_client(context["client"])
+        with self.invocation(listener_name(body)):
+            await next()
+
+    def _emf(self, summary):
+        slack = summary["totals"].get("slack", {})
+        teamwork = summary["totals"].get("teamwork", {})
+        metrics = {
+            "Duration": summary["duration_ms"],
+            "SlackCalls": slack.get("calls", 0),
+            "SlackMs": slack.get("ms", 0),
+            "TeamworkCalls": teamwork.get("calls", 0),
+            "TeamworkMs": teamwork.get("ms", 0),
+        }
+        units = {"Duration": "Milliseconds", "SlackMs": "Milliseconds", "TeamworkMs": "Milliseconds"}
+        return dict({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": EMF_NAMESPACE,
+                    "Dimensions": [["Listener"]],
+                    "Metrics": [{"Name": name, "Unit": units.get(name, "Count")} for name in metrics],
+                }],
+            },
+            "Listener": summary["listener"],
+            "calls": summary["calls"],
+        }, **metrics)
+
+
+def listener_name(body):
+    # "view_submission:leave-request-submission", "block_actions:open-leave-request-form", "event:workflow_step_execute"
+    payload_type = body.get("type", "unknown")
+    if payload_type == "event_callback":
+        return f'event:{body.get("event", {}).get("type", "unknown")}'
+    if "view" in body and body["view"].get("callback_id"):
+        return f'{payload_type}:{body["view"]["callback_id"]}'
+    if body.get("actions"):
+        return f'{payload_type}:{body["actions"][0].get("action_id")}'
+    if body.get("callback_id"):
+        return f'{payload_type}:{body["callback_id"]}'
+    return payload_type
+
+
+class Instrumented_WebClient(WebClient):
+    """WebClient that records every Web API call through api_call().
+
+    Calls are also cut to the invocation's deadline: the timeout is what is
+    left of it, and a call without time left raises Deadline_Exceeded.
+    """
+
+    @property
+    def timeout(self):
+        # Read by urlopen on every attempt; per thread, so concurrent stages each get their own
+        return deadlines.timeout(self._timeout)
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+
+    @classmethod
+    def from_client(cls, client: WebClient):
+        # Bolt builds a plain WebClient per request, this copies its configuration and token
+        return cls(token=client.token,
+                   base_url=client.base_url,
+                   timeout=getattr(client, "_timeout", client.timeout),
+                   ssl=client.ssl,
+                   proxy=client.proxy,
+                   headers=client.headers,
+                   team_id=getattr(client, "team_id", None),
+                   logger=client.logger,
+                   retry_handlers=client.retry_handlers)
+
+    def api_call(self, api_method, *, http_verb="POST", files=None, data=None, params=None, json=None, headers=None, auth=None):
+        deadlines.check(f"slack {api_method}")
+        started = time.perf_counter()
+        status = "error"
+        response = None
+        try:
+            response = super().api_call(api_method, http_verb=http_verb, files=files, data=data,
+                                        params=params, json=json, headers=headers, auth=auth)
+            status = "ok" if response.get("ok", True) else response.get("error", "error")
+            return response
+        except SlackApiError as e:
+            response = e.response
+            status = e.response.get("error", "error") if e.response is not None else "error"
+            raise
+        finally:
+            instrumentation.record("slack", api_method, status,
+                                   (time.perf_counter() - started) * 1000,
+                                   request_bytes=payload_size(json or data or params),
+                                   response_bytes=_response_size(response))
+
+
+_async_client_class = None
+
+def instrumented_async_client(client):
+    # AsyncWebClient counterpart of Instrumented_WebClient.from_client; defined on first use,
+    # the async client needs aiohttp which only the asyncio worker installs
+    global _async_client_class
+    if _async_client_class is None:
+        from slack_sdk.web.async_client import AsyncWebClient
+
+        class Instrumented_AsyncWebClient(AsyncWebClient):
+            async def api_call(self, api_method, *, http_verb="POST", files=None, data=None, params=None, json=None, headers=None, auth=None):
+                started = time.perf_counter()
+                status = "error"
+                response = None
+                try:
+                    response = await super().api_call(api_method, http_verb=http_verb, files=files, data=data,
+                                                      params=params, json=json, headers=headers, auth=auth)
+                    status = "ok" if response.get("ok", True) else response.get("error", "error")
+                    return response
+                except SlackApiError as e:
+                    response = e.response
+                    status = e.response.get("error", "error") if e.response is not None else "error"
+                    raise
+                finally:
+                    instrumentation.record("slack", api_method, status,
+                                           (time.perf_counter() - started) * 1000,
+                                           request_bytes=payload_size(json or data or params),
+                                           response_bytes=_response_size(response))
+
+        _async_client_class = Instrumented_AsyncWebClient
+    return _async_client_class(token=client.token,
+                               base_url=client.base_url,
+                               timeout=client.timeout,
+                               ssl=client.ssl,
+                               proxy=client.proxy,
+                               session=client.session,
+                               headers=client.headers,
+                               team_id=getattr(client, "team_id", None),
+                               logger=client.logger,
+                               retry_handlers=client.retry_handlers)
+
+
+def _response_size(response):
+    if response is None:
+        return 0
+    length = (response.headers or {}).get("content-length") or (response.headers or {}).get("Content-Length")
+    if length:
+        return int(length[0] if isinstance(length, list) else length)
+    return payload_size(response.data)
+
+
+instrumentation = Instrumentation(output_format=os.environ.get("INSTRUMENTATION_FORMAT", "emf").lower())
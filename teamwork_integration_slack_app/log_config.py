@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import random
+import re
+import sys
+
+# Payload keys whose values never reach the logs
+SECRET_KEYS = {"token", "bot_token", "password", "apitoken", "sessionid", "authorization", "x-slack-signature",
+               "response_url", "hash", "trigger_id"}
+EMAIL_KEYS = {"email", "Email"}
+
+# Also URL-encoded, as in the query strings urllib3 logs
+EMAIL_PATTERN = re.compile(r"[A-Za-z0-9._+-]+(?:@|%40)[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+TOKEN_PATTERN = re.compile(r"\b(xox[abprse]-[A-Za-z0-9-]+|xapp-[A-Za-z0-9-]+)")
+SECRET_FIELD_PATTERN = re.compile(r"""(["']?(?:APIToken|SessionId|Password|Authorization)["']?\s*[:=]\s*["']?)[^"',}\s]+""",
+                                  re.IGNORECASE)
+
+def redact_text(text):
+    text = EMAIL_PATTERN.sub(lambda m: _mask_email(m.group(0)), text)
+    text = TOKEN_PATTERN.sub(lambda m: m.group(0)[:5] + "[redacted]", text)
+    return SECRET_FIELD_PATTERN.sub(r"\1[redacted]", text)
+
+def redact(value):
+    # Deep copy of a payload with secrets removed and emails masked
+    if isinstance(value, dict):
+        return {k: "[redacted]" if str(k).lower() in SECRET_KEYS
+                else _mask_email(v) if k in EMAIL_KEYS and isinstance(v, str)
+                else redact(v)
+                for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    return value
+
+def _mask_email(email):
+    # "jane.doe@example.com" -> "j***@example.com", still tells agents apart by domain and initial
+    name, _, domain = email.replace("%40", "@").partition("@")
+    return f"{name[:1]}***@{domain}" if domain else "[redacted]"
+
+
+class Redacting_Filter(logging.Filter):
+    """Redacts the formatted message of every record that is actually emitted.
+
+    Runs on the handler, so records below the level are dropped before any
+    formatting or redaction work is done.
+    """
+
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = redact_text(message)
+        if redacted != message or record.args:
+            record.msg = redacted
+            record.args = None
+        return True
+
+
+class JSON_Formatter(logging.Formatter):
+    # One JSON object per line, CloudWatch Logs Insights picks up the fields
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None, levels=None, log_format=None, stream=None):
+    """Root logging from the environment.
+
+    LOG_LEVEL        root level, default INFO
+    LOG_LEVELS       per logger, e.g. "slack_bolt=WARNING,teamwork_integration_slack_app.teamwork_api=DEBUG"
+    LOG_FORMAT       "text" (default) or "json"
+    """
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    levels = levels if levels is not None else os.environ.get("LOG_LEVELS", "")
+    log_format = (log_format or os.environ.get("LOG_FORMAT", "text")).lower()
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    if log_format == "json":
+        handler.setFormatter(JSON_Formatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    handler.addFilter(Redacting_Filter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    for item in filter(None, (part.strip() for part in levels.split(","))):
+        name, _, value = item.partition("=")
+        logging.getLogger(name.strip()).setLevel(value.strip().upper())
+    return root
+
+
+def log_payload(logger, label, payload, sample_rate=None):
+    """Logs a redacted payload at DEBUG for a sample of calls.
+
+    LOG_PAYLOAD_SAMPLE_RATE (0.0 - 1.0, default 0.01) keeps full Slack bodies
+    and Teamwork responses out of most invocations even with DEBUG enabled.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+    rate = payload_sample_rate if sample_rate is None else sample_rate
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return False
+    payload = redact(payload)
+    logger.debug("%s: %s", label, payload if isinstance(payload, str) else json.dumps(payload, default=str))
+    return True
+
+
+payload_sample_rate = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", 0.01))
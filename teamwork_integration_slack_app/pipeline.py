@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import contextvars
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+class Stage_Aborted(Exception):
+    """Raised by a stage to stop the rest of the graph, e.g. an unknown employee."""
+
+    def __init__(self, reason, results=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.results = results if results is not None else {}
+
+
+class Stage_Graph(object):
+    """Runs named stages as soon as the stages they depend on are done.
+
+    Each stage function receives the results of its dependencies as keyword
+    arguments. Independent stages overlap on a bounded thread pool, and the
+    timings of the run are kept to report the critical path.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor or stage_executor
+        self._stages = {}
+        self.timings = {}
+
+    def add(self, name, func, deps=()):
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(f'Stage {name} depends on unknown stage {dep}')
+        self._stages[name] = (func, tuple(deps))
+        return self
+
+    def run(self):
+        results = {}
+        pending = dict(self._stages)
+        running = {}
+        started = time.perf_counter()
+        self.timings = {}
+
+        try:
+            while pending or running:
+                for name, (func, deps) in list(pending.items()):
+                    if all(dep in results for dep in deps):
+                        del pending[name]
+                        kwargs = {dep: results[dep] for dep in deps}
+                        # Copy the context so per-invocation context variables follow the stage
+                        context = contextvars.copy_context()
+                        future = self.executor.submit(context.run, self._timed, name, func, kwargs, started)
+                        running[future] = name
+
+                if not running:
+                    raise ValueError(f'Stages {list(pending)} can never run, check their dependencies')
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+        except Stage_Aborted as e:
+            # Let in-flight stages finish, nothing new is scheduled
+            for future in running:
+                future.cancel()
+            wait(running)
+            e.results = results
+            raise
+        finally:
+            self.timings["total"] = (0, time.perf_counter() - started)
+
+        return results
+
+    def critical_path(self):
+        # Walks back from the last stage through the dependency that finished last
+        finished = {name: t for name, t in self.timings.items() if name in self._stages}
+        if not finished:
+            return [], 0
+        name = max(finished, key=lambda n: finished[n][1])
+        latency = finished[name][1]
+        path = [name]
+        while True:
+            deps = [dep for dep in self._stages[name][1] if dep in finished]
+            if not deps:
+                break
+            name = max(deps, key=lambda n: finished[n][1])
+            path.append(name)
+        return list(reversed(path)), latency
+
+    def report(self):
+        path, latency = self.critical_path()
+        return {
+            "critical_path": path,
+            "critical_path_ms": round(latency * 1000, 1),
+            "stages_ms": {name: round((end - start) * 1000, 1)
+                          for name, (start, end) in self.timings.items() if name in self._stages},
+            "serial_ms": round(sum(end - start for name, (start, end) in self.timings.items()
+                                   if name in self._stages) * 1000, 1),
+        }
+
+    def _timed(self, name, func, kwargs, started):
+        stage_started = time.perf_counter() - started
+        try:
+            return func(**kwargs)
+        finally:
+            self.timings[name] = (stage_started, time.perf_counter() - started)
+
+
+# Shared by every submission of a warm container
+stage_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("SUBMISSION_MAX_WORKERS", 4)),
+                                    thread_name_prefix="stage")
@@ -0,0 +1,112 @@
+from dataclasses import dataclass, field
+import logging
+import threading
+import time
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from slack_bolt.authorization import AuthorizeResult
+
+# Slack errors that mean the cached bot token can no longer be trusted
+INVALIDATING_ERRORS = ("invalid_auth", "token_revoked", "account_inactive", "not_authed")
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Authorize_Cache(object):
+    """Keeps the AuthorizeResult of auth.test alive across warm invocations."""
+    ttl_seconds: float = 3600
+    hits: int = 0
+    misses: int = 0
+    total_hits: int = 0
+    total_misses: int = 0
+    _result: AuthorizeResult = None
+    _token: str = None
+    _expires_at: float = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def authorize(self, client: WebClient, token: str) -> AuthorizeResult:
+        with self._lock:
+            if self._result is not None and self._token == token \
+                and time.monotonic() < self._expires_at:
+                self.hits += 1
+                self.total_hits += 1
+                return self._result
+
+            self.misses += 1
+            self.total_misses += 1
+            try:
+                result = AuthorizeResult.from_auth_test_response(
+                    auth_test_response=client.auth_test(token=token),
+                    bot_token=token,
+                )
+            except SlackApiError as e:
+                self._invalidate_on(e)
+                raise
+
+            self._result = result
+            self._token = token
+            self._expires_at = time.monotonic() + self.ttl_seconds
+            return result
+
+    async def authorize_async(self, client, token: str) -> AuthorizeResult:
+        # Same as authorize() for an AsyncWebClient; the lock is never held across the await
+        with self._lock:
+            if self._result is not None and self._token == token \
+                and time.monotonic() < self._expires_at:
+                self.hits += 1
+                self.total_hits += 1
+                return self._result
+            self.misses += 1
+            self.total_misses += 1
+
+        try:
+            auth_test_response = await client.auth_test(token=token)
+        except SlackApiError as e:
+            self.invalidate_on_error(e)
+            raise
+        result = AuthorizeResult.from_auth_test_response(
+            auth_test_response=auth_test_response,
+            bot_token=token,
+        )
+
+        with self._lock:
+            self._result = result
+            self._token = token
+            self._expires_at = time.monotonic() + self.ttl_seconds
+        return result
+
+    def invalidate(self):
+        with self._lock:
+            self._result = None
+            self._token = None
+            self._expires_at = 0
+
+    def invalidate_on_error(self, error: Exception) -> bool:
+        # Drops the cached result when a Slack call failed because of the bot token
+        if isinstance(error, SlackApiError):
+            with self._lock:
+                return self._invalidate_on(error)
+        return False
+
+    def _invalidate_on(self, error: SlackApiError) -> bool:
+        if error.response.get("error") in INVALIDATING_ERRORS:
+            logger.warning("Invalidating cached Slack authorization: %s", error.response.get("error"))
+            self._result = None
+            self._token = None
+            self._expires_at = 0
+            return True
+        return False
+
+    def begin_invocation(self):
+        # Resets the per-invocation counters, the totals keep counting
+        self.hits = 0
+        self.misses = 0
+
+    def report(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": self.total_hits,
+            "total_misses": self.total_misses,
+        }
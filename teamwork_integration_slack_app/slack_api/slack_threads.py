@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+import logging
+import os
+import threading
+import time
+
+from slack_sdk import WebClient
+
+from teamwork_integration_slack_app.common import parse_vto_limit, vto_message_kind
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class VTO_Thread_Snapshot(object):
+    channel_id: str
+    thread_ts: str
+    message_text: str = ""
+    vto_limit: float = 0
+    reaction_count: int = 0
+    success_count: int = 0
+    opened_form_count: int = 0
+    message_count: int = 0
+    # False when the read stopped early because the offer is already full
+    complete: bool = True
+
+    @property
+    def is_full(self):
+        return self.message_count > 0 and self.success_count >= self.vto_limit
+
+    def add(self, message):
+        # Streaming pass: the first message of conversations.replies is the thread root
+        if self.message_count == 0:
+            self.message_text = message.get("text", "")
+            self.vto_limit = parse_vto_limit(self.message_text)
+            for r in message.get("reactions", []):
+                if r["name"] == "vto":
+                    self.reaction_count = r["count"]
+        else:
+            kind = vto_message_kind(message)
+            if kind == "success":
+                self.success_count += 1
+            elif kind == "opened":
+                self.opened_form_count += 1
+        self.message_count += 1
+
+
+class Slack_Thread_Reader(object):
+    """Reads a VTO thread (root and replies) in one cursor-paginated pass.
+
+    Counting stops as soon as the successes reach the limit, since no later
+    reply can make the offer available again. Snapshots are memoized for
+    ttl_seconds per thread, so a reaction followed by a click reads it once.
+    """
+
+    def __init__(self, ttl_seconds=10, page_size=200):
+        self.ttl_seconds = ttl_seconds
+        self.page_size = page_size
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def iter_messages(self, client: WebClient, channel_id, thread_ts, page_size=None):
+        cursor = None
+        while True:
+            response = client.conversations_replies(channel=channel_id, ts=thread_ts,
+                                                    limit=page_size or self.page_size, cursor=cursor)
+            yield from response.get("messages", [])
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not response.get("has_more") or not cursor:
+                break
+
+    async def aiter_messages(self, client, channel_id, thread_ts, page_size=None):
+        cursor = None
+        while True:
+            response = await client.conversations_replies(channel=channel_id, ts=thread_ts,
+                                                          limit=page_size or self.page_size, cursor=cursor)
+            for message in response.get("messages", []):
+                yield message
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not response.get("has_more") or not cursor:
+                break
+
+    def snapshot(self, client: WebClient, channel_id, thread_ts):
+        snapshot = self._cached(channel_id, thread_ts)
+        if snapshot is None:
+            snapshot = VTO_Thread_Snapshot(channel_id=channel_id, thread_ts=thread_ts)
+            for message in self.iter_messages(client, channel_id, thread_ts):
+                snapshot.add(message)
+                if snapshot.is_full:
+                    snapshot.complete = False
+                    break
+            self._store(snapshot)
+        return snapshot
+
+    async def asnapshot(self, client, channel_id, thread_ts):
+        snapshot = self._cached(channel_id, thread_ts)
+        if snapshot is None:
+            snapshot = VTO_Thread_Snapshot(channel_id=channel_id, thread_ts=thread_ts)
+            messages = self.aiter_messages(client, channel_id, thread_ts)
+            async for message in messages:
+                snapshot.add(message)
+                if snapshot.is_full:
+                    snapshot.complete = False
+                    break
+            await messages.aclose()
+            self._store(snapshot)
+        return snapshot
+
+    def invalidate(self, channel_id, thread_ts):
+        with self._lock:
+            self._snapshots.pop((channel_id, thread_ts), None)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+
+    def _cached(self, channel_id, thread_ts):
+        with self._lock:
+            entry = self._snapshots.get((channel_id, thread_ts))
+        if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+            return entry[1]
+        return None
+
+    def _store(self, snapshot):
+        logger.debug('VTO thread %s: %s', snapshot.thread_ts, snapshot)
+        with self._lock:
+            self._snapshots[(snapshot.channel_id, snapshot.thread_ts)] = (time.monotonic(), snapshot)
+
+
+thread_reader = Slack_Thread_Reader(ttl_seconds=float(os.environ.get("SLACK_THREAD_SNAPSHOT_TTL", 10)),
+                                    page_size=int(os.environ.get("SLACK_THREAD_PAGE_SIZE", 200)))
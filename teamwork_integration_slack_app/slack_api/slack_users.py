@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+import time
+
+from slack_sdk import WebClient
+
+logger = logging.getLogger(__name__)
+
+class Slack_User_Cache(object):
+    """id -> user and email -> id cache in front of users.info and users.lookupByEmail.
+
+    Entries expire after ttl_seconds and are replaced by user_change events.
+    warm() fills it from the paginated users.list in a few Tier-2 calls
+    (WARM_UP=users in app.py).
+    """
+
+    def __init__(self, ttl_seconds=3600):
+        self.ttl_seconds = ttl_seconds
+        self._by_id = {}
+        self._id_by_email = {}
+        self._lock = threading.Lock()
+
+    def get_user(self, client: WebClient, user_id):
+        user = self._cached_user(user_id)
+        if user is None:
+            user = client.users_info(user=user_id)["user"]
+            self.update(user)
+        return user
+
+    def lookup_by_email(self, client: WebClient, email):
+        key = email.strip().lower()
+        with self._lock:
+            user_id = self._id_by_email.get(key)
+        user = self._cached_user(user_id) if user_id is not None else None
+        if user is None:
+            user = client.users_lookupByEmail(email=email)["user"]
+            self.update(user)
+        return user
+
+    async def get_user_async(self, client, user_id):
+        # Same as get_user() for an AsyncWebClient
+        user = self._cached_user(user_id)
+        if user is None:
+            user = (await client.users_info(user=user_id))["user"]
+            self.update(user)
+        return user
+
+    async def lookup_by_email_async(self, client, email):
+        # Same as lookup_by_email() for an AsyncWebClient
+        key = email.strip().lower()
+        with self._lock:
+            user_id = self._id_by_email.get(key)
+        user = self._cached_user(user_id) if user_id is not None else None
+        if user is None:
+            user = (await client.users_lookupByEmail(email=email))["user"]
+            self.update(user)
+        return user
+
+    def warm(self, client: WebClient, page_size=200):
+        count = 0
+        cursor = None
+        while True:
+            response = client.users_list(limit=page_size, cursor=cursor)
+            for user in response["members"]:
+                if not user.get("deleted") and not user.get("is_bot"):
+                    self.update(user)
+                    count += 1
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                break
+        logger.info('Warmed the Slack user cache with %s users', count)
+        return count
+
+    def update(self, user):
+        # Also used for user_change events, which carry the full user object
+        email = (user.get("profile") or {}).get("email")
+        with self._lock:
+            previous = self._by_id.get(user["id"])
+            if previous is not None:
+                old_email = (previous[1].get("profile") or {}).get("email")
+                if old_email and old_email.lower() != (email or "").lower():
+                    self._id_by_email.pop(old_email.lower(), None)
+            self._by_id[user["id"]] = (time.monotonic(), user)
+            if email:
+                self._id_by_email[email.lower()] = user["id"]
+
+    def invalidate(self, user_id):
+        with self._lock:
+            entry = self._by_id.pop(user_id, None)
+            if entry is not None:
+                email = (entry[1].get("profile") or {}).get("email")
+                if email:
+                    self._id_by_email.pop(email.lower(), None)
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._id_by_email.clear()
+
+    def _cached_user(self, user_id):
+        with self._lock:
+            entry = self._by_id.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+            return entry[1]
+        return None
+
+
+slack_user_cache = Slack_User_Cache(ttl_seconds=float(os.environ.get("SLACK_USER_CACHE_TTL", 3600)))
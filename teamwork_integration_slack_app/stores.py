@@ -0,0 +1,28 @@
+import importlib
+import os
+import sqlite3
+import threading
+
+class SQLite_Store(object):
+    """Base of the SQLite backends: one file, a connection per thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        return conn
+
+
+def load_store(variable, default, backends):
+    # The environment variable names one of backends (name -> factory), or is a
+    # "package.module:factory" returning a shared store
+    backend = os.environ.get(variable, default)
+    if backend in backends:
+        return backends[backend]()
+    module_name, _, factory = backend.partition(":")
+    return getattr(importlib.import_module(module_name), factory)()
@@ -0,0 +1,200 @@
+from dataclasses import dataclass, field
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+import aiohttp
+
+from teamwork_integration_slack_app.instrumentation import instrumentation, operation_name, payload_size
+from teamwork_integration_slack_app.teamwork_api import tw_json
+from teamwork_integration_slack_app.teamwork_api.tw_session import TW_Session_Manager, tw_sessions
+from teamwork_integration_slack_app.teamwork_api.tw_transport import RETRY_STATUS_CODES, IDEMPOTENT_METHODS, IDEMPOTENT_ENDPOINTS
+from teamwork_integration_slack_app.teamwork_api.tw_breaker import FAILURE_STATUS_CODES, tw_breaker
+
+logger = logging.getLogger(__name__)
+
+class TW_Async_Response(object):
+    # Fully read response, so callers can use it like a requests.Response after the connection is released
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return tw_json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise aiohttp.ClientResponseError(request_info=None, history=(),
+                                              status=self.status_code,
+                                              message=self.content[:200].decode(errors="replace"))
+
+
+@dataclass
+class AsyncTW_Connector(object):
+    """asyncio counterpart of TW_Connector built on aiohttp.
+
+    Shares the Teamwork session store with TW_Connector and follows the same
+    retry policy as TW_Transport, so both can be used side by side.
+    """
+    base_url: str
+    portal: str
+    code: str
+    username: str
+    password: str
+    session_id: str = None
+    api_token: str = None
+
+    session_manager: TW_Session_Manager = field(default=None, repr=False)
+    pool_size: int = field(default_factory=lambda : int(os.environ.get("TEAMWORK_POOL_MAXSIZE", 100)))
+    max_retries: int = field(default_factory=lambda : int(os.environ.get("TEAMWORK_MAX_RETRIES", 2)))
+    backoff_base: float = 0.2
+    backoff_max: float = 2.0
+    timeout: float = field(default_factory=lambda : float(os.environ.get("TEAMWORK_READ_TIMEOUT", 10)))
+    _http: aiohttp.ClientSession = field(default=None, repr=False)
+
+    async def get_employee_by_email(self, email):
+        response = await self._send("GET", "/api/employees/list",
+                                    params= {
+                                        "sort":"",
+                                        "page":"1",
+                                        "pageSize":"10",
+                                        "group":"",
+                                        "filter":f"Email~contains~'{email}'"
+                                    })
+        response.raise_for_status()
+        return response
+
+    async def get_employee_locations(self, emp_id):
+        return await self.request("GET", f"/api/employees/{emp_id}/locations", "")
+
+    async def get_location(self, business_id):
+        return await self.get(f"/api/locations/{business_id}")
+
+    async def get_leave_types(self):
+        return await self.get('/api/leave/leavetypes')
+
+    async def calc_daily_hours(self, leave_request_json):
+        return await self.request("PUT", "/api/leave/calcdailyhours/", leave_request_json)
+
+    async def post_leave_request(self, emp_id, leave_request_json):
+        return await self.request("PUT", f'/api/leave/post/{emp_id}', leave_request_json,
+                                  params = {"validatedOnServer":"false"})
+
+    async def get(self, endpoint, **kwargs):
+        return await self._send("GET", endpoint, **kwargs)
+
+    async def post(self, endpoint, payload, **kwargs):
+        response = await self._send("POST", endpoint, json = payload, **kwargs)
+        response.raise_for_status()
+        return response
+
+    async def request(self, request_method, endpoint, payload, **kwargs):
+        # Like TW_Connector.request, an HTTP error is returned instead of raised
+        return await self._send(request_method, endpoint, data = payload, **kwargs)
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _send(self, method, endpoint, **kwargs):
+        session = await self._ensure_session()
+        response = await self._request(method, endpoint, headers = session.headers, **kwargs)
+        if response.status_code in (401, 403):
+            logger.info('Teamwork rejected the session (%s), re-authenticating...', response.status_code)
+            self.session_manager.invalidate(self._session_key(), session)
+            session = await self._ensure_session()
+            response = await self._request(method, endpoint, headers = session.headers, **kwargs)
+        return response
+
+    async def _request(self, method, endpoint, retry=None, **kwargs):
+        if retry is None:
+            retry = method.upper() in IDEMPOTENT_METHODS or endpoint.startswith(IDEMPOTENT_ENDPOINTS)
+        http = self._client()
+        tw_breaker.before_call(self.base_url)
+        attempt = 0
+        result = None
+        started = time.perf_counter()
+        try:
+            while True:
+                result = None
+                try:
+                    async with http.request(method, f"{self.base_url}" + endpoint, **kwargs) as response:
+                        result = TW_Async_Response(response.status, response.headers, await response.read())
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if not retry or attempt >= self.max_retries:
+                        raise
+                else:
+                    if result.status_code not in RETRY_STATUS_CODES \
+                        or attempt >= self.max_retries \
+                        or (not retry and result.status_code != 429):
+                        return result
+                attempt += 1
+                await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt))))
+        finally:
+            tw_breaker.after_call(self.base_url, result is None or result.status_code in FAILURE_STATUS_CODES,
+                                  time.perf_counter() - started)
+            instrumentation.record("teamwork", f"{method.upper()} {operation_name(endpoint)}",
+                                   result.status_code if result is not None else "error",
+                                   (time.perf_counter() - started) * 1000,
+                                   request_bytes=payload_size(kwargs.get("data") or kwargs.get("json")),
+                                   response_bytes=len(result.content) if result is not None else 0,
+                                   attempts=attempt + 1)
+
+    async def _ensure_session(self):
+        session = await self.session_manager.aget(self._session_key(), self._login)
+        self.session_id = session.session_id
+        self.api_token = session.api_token
+        return session
+
+    def _session_key(self):
+        return (self.base_url, self.portal, self.code, self.username)
+
+    async def _authenicate_tw(self):
+        self.session_manager.invalidate(self._session_key())
+        await self._ensure_session()
+
+    async def _login(self):
+        payload_data = json.dumps(
+            {
+            "Request": {
+                "Portal": self.portal,
+                "Code": self.code,
+                "Username": self.username,
+                "Password": self.password
+                }
+        }
+            )
+        response = await self._request("POST", "/api/ops/auth",
+                                       data = payload_data,
+                                       headers = {"Content-Type": "application/json"})
+        response.raise_for_status()
+        result = response.json()
+
+        # Check if the authentication is success
+        if not result['Success']:
+            raise Exception(f'Teamwork authentication unsuccessful, the response returned: \n{result}\n')
+        return result['Response']['SessionId'], result['Response']['APIToken']
+
+    def _client(self):
+        # Created lazily because aiohttp sessions must be opened inside the running loop
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._http
+
+    def __post_init__(self):
+        if self.session_manager is None:
+            self.session_manager = tw_sessions
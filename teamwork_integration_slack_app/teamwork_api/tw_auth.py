@@ -2,10 +2,16 @@ from dataclasses import dataclass, field, asdict
 from datetime import datetime
 import os
 import json
+import logging
 import requests
 from requests import exceptions
-from dotenv import load_dotenv
-load_dotenv()
+
+from teamwork_integration_slack_app.log_config import log_payload
+from teamwork_integration_slack_app.teamwork_api import tw_json
+from teamwork_integration_slack_app.teamwork_api.tw_session import TW_Session_Manager, tw_sessions
+from teamwork_integration_slack_app.teamwork_api.tw_transport import TW_Transport, tw_transport
+
+logger = logging.getLogger(__name__)
 
 # Convert a data class instance into a json object
 def to_json(data_instance):
@@ -21,73 +27,116 @@ class Employee(object):
     location_name: str = None
     
     def __post_init__(self):
-        print('Initialized creating an employee object...')
+        logger.debug('Initialized creating an employee object...')
     
-@dataclass
+# Every field of a Teamwork leave request with its default, in the order Teamwork sends them
+LEAVE_REQUEST_TEMPLATE = {
+    "Id": 0,
+    "Start": None,
+    "End": None,
+    "Days": 0,
+    "StartTime": None,
+    "EndTime": None,
+    "TypeId": 544,
+    "TypeName": "",
+    "Conflicts": 0,
+    "Hours": 0,
+    "CalculatedHours": 0,
+    "Balance": "",
+    "Status": 1,
+    "StatusText": "",
+    "StatusDisplay": "",
+    "TimeHours": 0,
+    "TimeTaskId": 0,
+    "EmpId": 0,
+    "EmpName": "",
+    "Notes": "",
+    "Employees": [],
+    "LeaveTypes": [],
+    "AccrualBalances": [],
+    "MinDate": None,
+    "MaxDate": None,
+    "MaxDays": 0,
+    "MaxHours": 0,
+    "SaveEntered": False,
+    "CanEdit": True,
+    "CanCancel": False,
+    "CanDelete": True,
+    "CanRemoveCancel": False,
+    "BalanceIsDays": False,
+    "OverBalance": False,
+    "CommentRequired": False,
+    "IsLeaveManagement": False,
+    "IsAllDay": False,
+    "Created": None,
+    "CanGrant": True,
+    "CanRequest": False,
+    "CanDeny": True,
+    "HasPolicy": True,
+    "Messages": "",
+    "QuotaCheck": "",
+    "LimitCheck": "",
+    "Styles": [],
+    "DayHours": [],
+}
+# Fields whose default is a list, each request gets its own
+_LIST_FIELDS = tuple(name for name, value in LEAVE_REQUEST_TEMPLATE.items() if isinstance(value, list))
+
 class Employee_Leave_Request(object):
-    Id: int = 0
-    Start: datetime = None
-    End: datetime = None
-    Days: int = 0
-    StartTime: datetime = None
-    EndTime: datetime = None
-    TypeId: int = 544
-    TypeName: str = ""
-    Conflicts: int = 0
-    Hours: int = 0
-    CalculatedHours: int = 0
-    Balance: str = ""
-    Status: int = 1
-    StatusText: str = ""
-    StatusDisplay: str = ""
-    TimeHours: int = 0
-    TimeTaskId: int = 0
-    EmpId: int = 0
-    EmpName: str = ""
-    Notes: str = ""
-    Employees: list = field(default_factory=lambda : [])
-    LeaveTypes: list = field(default_factory=lambda : [])
-    AccrualBalances: list = field(default_factory=lambda : [])
-    MinDate: datetime = None
-    MaxDate: datetime = None
-    MaxDays: int = 0
-    MaxHours: int = 0
-    SaveEntered: bool = False
-    CanEdit: bool = True
-    CanCancel: bool = False
-    CanDelete: bool = True
-    CanRemoveCancel: bool = False
-    BalanceIsDays: bool = False
-    OverBalance: bool = False
-    CommentRequired: bool = False
-    IsLeaveManagement: bool = False
-    IsAllDay: bool = False
-    Created: datetime = None
-    CanGrant: bool = True
-    CanRequest: bool = False
-    CanDeny: bool = True
-    HasPolicy: bool = True
-    Messages: str = ""
-    QuotaCheck: str = ""
-    LimitCheck: str = ""
-    Styles: list = field(default_factory=lambda : [])
-    DayHours: list = field(default_factory=lambda : [])
-    
+    """A Teamwork leave request, kept as the dict that is sent.
+
+    Built from a copy of LEAVE_REQUEST_TEMPLATE and updated in place, so a
+    request body is serialized once, by to_json(), right before it is sent.
+    Fields read and write as attributes, e.g. leave_request.DayHours = [...].
+    """
+
+    __slots__ = ("fields",)
+
+    def __init__(self, **fields):
+        unknown = fields.keys() - LEAVE_REQUEST_TEMPLATE.keys()
+        if unknown:
+            raise TypeError(f'Unknown leave request fields: {", ".join(sorted(unknown))}')
+        data = LEAVE_REQUEST_TEMPLATE.copy()
+        for name in _LIST_FIELDS:
+            data[name] = []
+        data.update(fields)
+        object.__setattr__(self, "fields", data)
+
+    def __getattr__(self, name):
+        try:
+            return self.fields[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        if name not in LEAVE_REQUEST_TEMPLATE:
+            raise AttributeError(f'Unknown leave request field: {name}')
+        self.fields[name] = value
+
+    def __eq__(self, other):
+        return isinstance(other, Employee_Leave_Request) and self.fields == other.fields
+
+    def __repr__(self):
+        return f'Employee_Leave_Request(EmpId={self.EmpId}, TypeId={self.TypeId}, Start={self.Start!r}, End={self.End!r})'
+
+    def update(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
     def from_json(self, json_data):
-        data = json.loads(json_data)
-        print(data)
+        # [{"DayHours": [...]}, ...] as returned by the leave endpoints; prefer update() with parsed data
+        data = tw_json.loads(json_data)
+        log_payload(logger, "leave request update", data)
         for d in data:
-            for key, value in d.items():
-                setattr(self, key, value)
-    
+            self.update(**d)
+
+    def to_dict(self):
+        return self.fields
+
     def to_json(self):
-        return json.dumps(self.__dict__)
-    
-    def __post_init__(self):
-        print('Initialized making a leave request object...')
-    
-    
-    
+        return tw_json.dumps(self.fields)
+
+
 @dataclass
 class TW_Connector(object):
     base_url: str
@@ -98,75 +147,118 @@ class TW_Connector(object):
     session_id: str = None
     api_token: str = None
     
-    def get_employee_by_email(self, email):
-        if not hasattr(self, 'api_token') and not hasattr(self, 'session_id') or \
-        not self.api_token and not self.session_id:
-            self._authenicate_tw()
-        url = self.base_url + "/api/employees/list"
-        print(url)
-        print(self.headers)
-        response = requests.get(url = url,
-                                headers=json.loads(self.headers),
+    session_manager: TW_Session_Manager = field(default=None, repr=False)
+    transport: TW_Transport = field(default=None, repr=False)
+    
+    def get_employee_by_email(self, email, exact=False):
+        operator = "eq" if exact else "contains"
+        response = self._send("GET", "/api/employees/list",
                                 params= {
                                     "sort":"",
                                     "page":"1",
                                     "pageSize":"10",
                                     "group":"",
-                                    "filter":f"Email~contains~'{email}'"
+                                    "filter":f"Email~{operator}~'{email}'"
                                 })
         
         response.raise_for_status()
-        result = response.json()
-        print(result)
         return response
         #return result['Data']
     
+    def available(self):
+        # False while Teamwork's circuit breaker is open, calls would raise TW_Unavailable
+        return self.transport.breaker.available(self.base_url)
+    
     def get(self, endpoint, **kwargs):
-        if not hasattr(self, 'api_token') and not hasattr(self, 'session_id') or \
-                not self.api_token and not self.session_id:
-            self._authenicate_tw()
-        
-        response = requests.get(url = f"{self.base_url}" + endpoint,
-                                headers=json.loads(self.headers),
-                                **kwargs)
+        response = self._send("GET", endpoint, **kwargs)
         
         #response.raise_for_status()
         #result = response.json()
         return response
     
     def post(self, endpoint, payload, **kwargs):
-        if not hasattr(self, 'api_token') and not hasattr(self, 'session_id') or \
-                not self.api_token and not self.session_id:
-            self._authenicate_tw()
-            
-        response = requests.post(url = f"{self.base_url}" + endpoint,
-                                json = payload,
-                                headers = json.loads(self.headers),
-                                **kwargs)
+        response = self._send("POST", endpoint, json = payload, **kwargs)
         
         response.raise_for_status()
-        response.status_code
         return response
-        #result = response.json()
-        #print(result)
     
     def request(self, request_method, endpoint, payload, **kwargs):
         try:
-            if not hasattr(self, 'api_token') and not hasattr(self, 'session_id') or \
-                    not self.api_token and not self.session_id:
-                self._authenicate_tw()
-                
-            response = requests.request(method = request_method,
-                                        url = f"{self.base_url}" + endpoint,
-                                        data = payload,
-                                        headers = json.loads(self.headers),
-                                        **kwargs)
+            response = self._send(request_method, endpoint, data = payload, **kwargs)
             response.raise_for_status()
             return response
         except requests.exceptions.HTTPError as e:
-            print(f'--- Http Error:\n {e}\n---')
+            logger.warning('Teamwork HTTP error: %s', e)
             return response
+    
+    def get_employee_locations(self, emp_id):
+        return self.request(request_method="GET",
+                            endpoint=f"/api/employees/{emp_id}/locations",
+                            payload="")
+    
+    def get_location(self, business_id):
+        return self.get(f"/api/locations/{business_id}")
+    
+    def get_leave_types(self):
+        return self.get('/api/leave/leavetypes')
+    
+    def get_employee_leave(self, emp_id, page=1, page_size=100, endpoint="/api/leave/list"):
+        # The employee's leave requests, paged and filtered like /api/employees/list
+        return self._send("GET", endpoint,
+                                params= {
+                                    "sort":"",
+                                    "page":f"{page}",
+                                    "pageSize":f"{page_size}",
+                                    "group":"",
+                                    "filter":f"EmpId~eq~{emp_id}"
+                                })
+    
+    def calc_daily_hours(self, leave_request_json):
+        return self.request(request_method = "PUT",
+                            endpoint = "/api/leave/calcdailyhours/",
+                            payload = leave_request_json)
+    
+    def post_leave_request(self, emp_id, leave_request_json):
+        return self.request(request_method = "PUT",
+                            endpoint = f'/api/leave/post/{emp_id}',
+                            payload = leave_request_json,
+                            params = {"validatedOnServer":"false"})
+    
+    def _send(self, method, endpoint, **kwargs):
+        # Sends a request with the shared session, re-authenticating once if Teamwork rejects it
+        session = self._ensure_session()
+        response = self.transport.request(method = method,
+                                          url = f"{self.base_url}" + endpoint,
+                                          endpoint = endpoint,
+                                          headers = session.headers,
+                                          **kwargs)
+        if response.status_code in (401, 403):
+            logger.info('Teamwork rejected the session (%s), re-authenticating...', response.status_code)
+            self.session_manager.invalidate(self._session_key(), session)
+            session = self._ensure_session()
+            response = self.transport.request(method = method,
+                                              url = f"{self.base_url}" + endpoint,
+                                              endpoint = endpoint,
+                                              headers = session.headers,
+                                              **kwargs)
+        return response
+    
+    def _ensure_session(self):
+        session = self.session_manager.get(self._session_key(), self._login)
+        self.session_id = session.session_id
+        self.api_token = session.api_token
+        self.headers = session.headers
+        return session
+    
+    def _session_key(self):
+        return (self.base_url, self.portal, self.code, self.username)
+    
     def _authenicate_tw(self):
+        # Forces a fresh Teamwork session and shares it with the other connectors
+        self.session_manager.invalidate(self._session_key())
+        self._ensure_session()
+    
+    def _login(self):
         # uses standard creds to authenticate via the API
         # Endpoint (verb = POST): <baseURL>/api/ops/auth
 
@@ -181,8 +273,9 @@ class TW_Connector(object):
         }
             )
         
-        response = requests.post(
+        response = self.transport.request("POST",
                             url = f'{self.base_url}/api/ops/auth',
+                            endpoint = '/api/ops/auth',
                             data = payload_data,
                             headers = {"Content-Type": "application/json"}
         )
@@ -193,22 +286,21 @@ class TW_Connector(object):
         if not result['Success']:
             raise Exception(f'Teamwork authentication unsuccessful, the response returned: \n{result}\n')
         else:
-            self.session_id = result['Response']['SessionId']
-            self.api_token = result['Response']['APIToken']
-            self.headers = json.dumps({
-                "x-session-id": f"{self.session_id}",
-                "x-api-token": f"{self.api_token}",
-                "Content-Type": "application/json"
-            })
+            return result['Response']['SessionId'], result['Response']['APIToken']
         
     def __post_init__(self):
         
-        print('Initialized Teamwork integration connection.')
+        logger.debug('Initialized Teamwork integration connection.')
+        
+        if self.session_manager is None:
+            self.session_manager = tw_sessions
+        if self.transport is None:
+            self.transport = tw_transport
         
         if not self.portal == '' and not self.code == '' \
             and not self.username == '' and not self.password == '' \
             and not self.base_url == '':
             
-            print('Authentication credientials detected. It is ready to connect to Teamwork via API.')
+            logger.debug('Authentication credientials detected. It is ready to connect to Teamwork via API.')
         else:
-            print('Blank credentials detected! Please fill in the required credentials for authenicating Teamwork via API.')
\ No newline at end of file
+            logger.warning('Blank credentials detected! Please fill in the required credentials for authenicating Teamwork via API.')
\ No newline at end of file
@@ -0,0 +1,281 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from urllib.parse import urlparse
+import logging
+import os
+import threading
+import time
+
+from teamwork_integration_slack_app.stores import SQLite_Store, load_store
+
+logger = logging.getLogger(__name__)
+
+# Breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Status codes that count as a Teamwork failure; other 4xx are answers, not outages
+FAILURE_STATUS_CODES = (500, 502, 503, 504)
+
+class TW_Unavailable(Exception):
+    """Raised instead of calling Teamwork while its circuit breaker is open."""
+
+    def __init__(self, key, retry_after):
+        super().__init__(f'Teamwork at {key} is unavailable, retry in {retry_after:.0f}s')
+        self.key = key
+        self.retry_after = retry_after
+
+
+@dataclass
+class Breaker_State(object):
+    state: str = CLOSED
+    opened_at: float = 0.0
+    # When the half-open probe was let through
+    probe_at: float = 0.0
+
+
+@dataclass
+class Breaker_Window(object):
+    calls: int = 0
+    failures: int = 0
+    slow_calls: int = 0
+
+
+class Breaker_State_Store(ABC):
+    """Breaker state and call outcomes per Teamwork host.
+
+    Outcomes are counted in buckets of bucket_seconds so the breaker can
+    read a rolling window. transition() is a compare-and-set, so with a
+    store shared by several containers only one of them opens the breaker
+    or lets the half-open probe through.
+    """
+
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def transition(self, key, expected, state):
+        # Replaces the state if it still equals expected, returns whether it did
+        pass
+
+    @abstractmethod
+    def record(self, key, bucket, failed, slow, oldest_bucket):
+        # Counts one call in bucket, buckets before oldest_bucket can be dropped
+        pass
+
+    @abstractmethod
+    def window(self, key, since_bucket):
+        # Breaker_Window summed over the buckets from since_bucket on
+        pass
+
+    @abstractmethod
+    def reset_window(self, key):
+        pass
+
+
+class Memory_Breaker_State_Store(Breaker_State_Store):
+    """Per-process backend, every container of a Lambda trips on its own."""
+
+    def __init__(self):
+        self._states = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._states.get(key) or Breaker_State()
+
+    def transition(self, key, expected, state):
+        with self._lock:
+            if (self._states.get(key) or Breaker_State()) != expected:
+                return False
+            self._states[key] = state
+            return True
+
+    def record(self, key, bucket, failed, slow, oldest_bucket):
+        with self._lock:
+            buckets = self._buckets.setdefault(key, {})
+            window = buckets.setdefault(bucket, Breaker_Window())
+            window.calls += 1
+            window.failures += int(failed)
+            window.slow_calls += int(slow)
+            for old in [b for b in buckets if b < oldest_bucket]:
+                del buckets[old]
+
+    def window(self, key, since_bucket):
+        total = Breaker_Window()
+        with self._lock:
+            for bucket, window in self._buckets.get(key, {}).items():
+                if bucket >= since_bucket:
+                    total.calls += window.calls
+                    total.failures += window.failures
+                    total.slow_calls += window.slow_calls
+        return total
+
+    def reset_window(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class SQLite_Breaker_State_Store(SQLite_Store, Breaker_State_Store):
+    """File backend, shared by the processes of one host; use a shared store across containers."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        conn = self._connection()
+        conn.execute("""CREATE TABLE IF NOT EXISTS breaker_state (
+                            key TEXT PRIMARY KEY,
+                            state TEXT NOT NULL,
+                            opened_at REAL NOT NULL,
+                            probe_at REAL NOT NULL)""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS breaker_bucket (
+                            key TEXT NOT NULL,
+                            bucket INTEGER NOT NULL,
+                            calls INTEGER NOT NULL,
+                            failures INTEGER NOT NULL,
+                            slow_calls INTEGER NOT NULL,
+                            PRIMARY KEY (key, bucket))""")
+
+    def get(self, key):
+        row = self._connection().execute("SELECT state, opened_at, probe_at FROM breaker_state WHERE key = ?",
+                                         (key,)).fetchone()
+        return Breaker_State(*row) if row else Breaker_State()
+
+    def transition(self, key, expected, state):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if self.get(key) != expected:
+                return False
+            conn.execute("INSERT OR REPLACE INTO breaker_state (key, state, opened_at, probe_at) VALUES (?, ?, ?, ?)",
+                         (key, state.state, state.opened_at, state.probe_at))
+        return True
+
+    def record(self, key, bucket, failed, slow, oldest_bucket):
+        conn = self._connection()
+        conn.execute("INSERT INTO breaker_bucket (key, bucket, calls, failures, slow_calls) VALUES (?, ?, 1, ?, ?) "
+                     "ON CONFLICT (key, bucket) DO UPDATE SET calls = calls + 1, "
+                     "failures = failures + excluded.failures, slow_calls = slow_calls + excluded.slow_calls",
+                     (key, bucket, int(failed), int(slow)))
+        conn.execute("DELETE FROM breaker_bucket WHERE key = ? AND bucket < ?", (key, oldest_bucket))
+
+    def window(self, key, since_bucket):
+        row = self._connection().execute(
+            "SELECT COALESCE(SUM(calls), 0), COALESCE(SUM(failures), 0), COALESCE(SUM(slow_calls), 0) "
+            "FROM breaker_bucket WHERE key = ? AND bucket >= ?", (key, since_bucket)).fetchone()
+        return Breaker_Window(*row)
+
+    def reset_window(self, key):
+        self._connection().execute("DELETE FROM breaker_bucket WHERE key = ?", (key,))
+
+
+class TW_Circuit_Breaker(object):
+    """Stops calling a Teamwork host that keeps failing or answering slowly.
+
+    Closed, every call goes through and its outcome is counted. Once at
+    least min_calls were made in the last window_seconds and the share of
+    failures (connection errors, timeouts, 5xx) reaches failure_rate, or
+    the share of calls slower than slow_call_seconds reaches slow_call_rate,
+    the breaker opens: calls raise TW_Unavailable without touching the
+    network. After open_seconds one probe call is let through (half-open);
+    it closes the breaker if it succeeds and opens it again if it doesn't.
+    """
+
+    def __init__(self, store=None, enabled=True, failure_rate=0.5, slow_call_rate=0.5, slow_call_seconds=5.0,
+                 min_calls=10, window_seconds=60, open_seconds=30, bucket_seconds=5):
+        self.store = store or Memory_Breaker_State_Store()
+        self.enabled = enabled
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.bucket_seconds = bucket_seconds
+
+    @classmethod
+    def from_env(cls):
+        return cls(store=load_breaker_state_store(),
+                   enabled=os.environ.get("TEAMWORK_BREAKER_ENABLED", "true").lower() in ("1", "true", "yes"),
+                   failure_rate=float(os.environ.get("TEAMWORK_BREAKER_FAILURE_RATE", 0.5)),
+                   slow_call_rate=float(os.environ.get("TEAMWORK_BREAKER_SLOW_CALL_RATE", 0.5)),
+                   slow_call_seconds=float(os.environ.get("TEAMWORK_BREAKER_SLOW_CALL_SECONDS", 5)),
+                   min_calls=int(os.environ.get("TEAMWORK_BREAKER_MIN_CALLS", 10)),
+                   window_seconds=float(os.environ.get("TEAMWORK_BREAKER_WINDOW_SECONDS", 60)),
+                   open_seconds=float(os.environ.get("TEAMWORK_BREAKER_OPEN_SECONDS", 30)))
+
+    def available(self, url):
+        # Whether a call to url would go through now, without claiming the half-open probe
+        if not self.enabled:
+            return True
+        state = self.store.get(breaker_key(url))
+        return state.state == CLOSED or self._probe_due(state, time.time())
+
+    def before_call(self, url):
+        # Raises TW_Unavailable while the breaker is open and this call isn't the probe
+        if not self.enabled:
+            return
+        key = breaker_key(url)
+        state = self.store.get(key)
+        if state.state == CLOSED:
+            return
+        now = time.time()
+        if self._probe_due(state, now) \
+            and self.store.transition(key, state, Breaker_State(HALF_OPEN, state.opened_at, now)):
+            logger.info("Teamwork breaker for %s is half-open, probing", key)
+            return
+        raise TW_Unavailable(key, max(state.opened_at + self.open_seconds - now, 0))
+
+    def after_call(self, url, failed, seconds):
+        if not self.enabled:
+            return
+        key = breaker_key(url)
+        now = time.time()
+        state = self.store.get(key)
+        if state.state == HALF_OPEN:
+            if failed:
+                self._open(key, state, now)
+            elif self.store.transition(key, state, Breaker_State(CLOSED)):
+                self.store.reset_window(key)
+                logger.warning("Teamwork breaker for %s closed", key)
+            return
+        bucket = int(now // self.bucket_seconds)
+        oldest_bucket = bucket - int(self.window_seconds // self.bucket_seconds) + 1
+        self.store.record(key, bucket, failed, seconds >= self.slow_call_seconds, oldest_bucket)
+        if state.state != CLOSED or not (failed or seconds >= self.slow_call_seconds):
+            return
+        window = self.store.window(key, oldest_bucket)
+        if window.calls >= self.min_calls and (window.failures >= self.failure_rate * window.calls
+                                               or window.slow_calls >= self.slow_call_rate * window.calls):
+            self._open(key, state, now, window)
+
+    def state(self, url):
+        return self.store.get(breaker_key(url))
+
+    def _open(self, key, state, now, window=None):
+        if self.store.transition(key, state, Breaker_State(OPEN, now)):
+            logger.warning("Teamwork breaker for %s opened for %ss: %s", key, self.open_seconds,
+                           window if window is not None else "half-open probe failed")
+
+    def _probe_due(self, state, now):
+        # A probe that never reported back (e.g. its Lambda timed out) is replaced after open_seconds
+        if state.state == OPEN:
+            return now - state.opened_at >= self.open_seconds
+        return state.state == HALF_OPEN and now - state.probe_at >= self.open_seconds
+
+
+def breaker_key(url):
+    # Teamwork host of a URL; the breaker is per host, not per endpoint
+    return urlparse(url).netloc or url
+
+def load_breaker_state_store():
+    # TEAMWORK_BREAKER_STORE is "memory", "sqlite" or "package.module:factory" returning a shared Breaker_State_Store
+    return load_store("TEAMWORK_BREAKER_STORE", "memory", {
+        "memory": Memory_Breaker_State_Store,
+        "sqlite": lambda: SQLite_Breaker_State_Store(os.environ.get("TEAMWORK_BREAKER_DB", "/tmp/tw_breaker.sqlite3"))})
+
+
+# Module-level breaker shared by the Teamwork transports of this process
+tw_breaker = TW_Circuit_Breaker.from_env()
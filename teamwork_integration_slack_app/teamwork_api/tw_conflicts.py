@@ -0,0 +1,169 @@
+from dataclasses import dataclass
+from datetime import datetime
+import bisect
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Formats of Start/End in Teamwork leave records, the first is the app's date_format
+LEAVE_DATE_FORMATS = ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f")
+# Teamwork leave records that don't take the time off: by StatusText/StatusDisplay, or by the
+# numeric Status when those are empty
+INACTIVE_LEAVE_STATUSES = ("denied", "declined", "rejected", "cancelled", "canceled")
+INACTIVE_LEAVE_STATUS_CODES = tuple(int(code) for code in
+                                    os.environ.get("TEAMWORK_INACTIVE_LEAVE_STATUS_CODES", "3,4").split(",") if code.strip())
+
+@dataclass
+class Leave_Interval(object):
+    start: float
+    end: float
+    # "teamwork" (seeded) or "posted" (accepted by this app)
+    source: str
+    added_at: float = 0.0
+
+    def overlaps(self, start, end):
+        return self.start < end and start < self.end
+
+
+def leave_timestamp(value, tz):
+    # Unix time of a Teamwork Start/End; values without an offset are in the location's timezone
+    if isinstance(value, datetime):
+        moment = value
+    else:
+        for date_format in LEAVE_DATE_FORMATS:
+            try:
+                moment = datetime.strptime(value, date_format)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f'Unrecognized Teamwork leave date: {value}')
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=tz)
+    return moment.timestamp()
+
+
+def leave_is_active(leave):
+    # Denied or cancelled leave doesn't take the time off
+    text = leave.get("StatusText") or leave.get("StatusDisplay")
+    if text:
+        return str(text).strip().lower() not in INACTIVE_LEAVE_STATUSES
+    return leave.get("Status") not in INACTIVE_LEAVE_STATUS_CODES
+
+
+class TW_Leave_Conflict_Index(object):
+    """Per-employee index of existing and pending leave, to catch overlaps before any write.
+
+    An employee's leave is loaded from Teamwork on first use and again after
+    ttl_seconds; leave this app posts is added as it happens, and kept
+    over a reload only while Teamwork's list can't be read. A 409 from
+    Teamwork forgets the employee, so their leave is loaded again. If the
+    leave list can't be read the check fails open, with what this app saw
+    itself, and Teamwork's 409 stays the last word.
+    """
+
+    def __init__(self, enabled=True, ttl_seconds=900, endpoint="/api/leave/list", page_size=100, max_pages=10):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.endpoint = endpoint
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._intervals = {}
+        self._seeded_at = {}
+        self._seed_supported = True
+        self._lock = threading.Lock()
+
+    def conflict(self, connector, emp_id, start, end, tz):
+        # The interval start..end (aware datetimes) overlaps, or None
+        if not self.enabled:
+            return None
+        self._ensure_seeded(connector, emp_id, tz)
+        start, end = start.timestamp(), end.timestamp()
+        with self._lock:
+            intervals = self._intervals.get(emp_id, [])
+            # Sorted by start: only intervals starting before end can overlap
+            for interval in intervals[:bisect.bisect_left([i.start for i in intervals], end)]:
+                if interval.overlaps(start, end):
+                    return interval
+        return None
+
+    def add(self, emp_id, start, end, source="posted"):
+        interval = Leave_Interval(start.timestamp(), end.timestamp(), source, time.time())
+        with self._lock:
+            intervals = self._intervals.setdefault(emp_id, [])
+            intervals.insert(bisect.bisect_left([i.start for i in intervals], interval.start), interval)
+        return interval
+
+    def forget(self, emp_id):
+        with self._lock:
+            self._intervals.pop(emp_id, None)
+            self._seeded_at.pop(emp_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._intervals.clear()
+            self._seeded_at.clear()
+
+    def _ensure_seeded(self, connector, emp_id, tz):
+        with self._lock:
+            seeded_at = self._seeded_at.get(emp_id)
+            if seeded_at is not None and time.monotonic() - seeded_at < self.ttl_seconds:
+                return
+            supported = self._seed_supported
+        started = time.time()
+        intervals = self._load(connector, emp_id, tz) if supported else None
+        now = time.time()
+        with self._lock:
+            posted = [i for i in self._intervals.get(emp_id, []) if i.source == "posted" and i.end > now]
+            if intervals is None:
+                # No list to go by: only the leave this app posted is known
+                intervals = posted
+            else:
+                # Teamwork's list is the truth, e.g. for posted leave a manager cancelled since;
+                # leave posted while it loaded may not be in it yet
+                intervals += [i for i in posted if i.added_at >= started]
+            self._intervals[emp_id] = sorted(intervals, key=lambda i: i.start)
+            self._seeded_at[emp_id] = time.monotonic()
+
+    def _load(self, connector, emp_id, tz):
+        # Fails open: None for an unreadable leave list, which leaves only the intervals this app posted
+        try:
+            return self._load_pages(connector, emp_id, tz)
+        except Exception as e:
+            logger.warning("Could not load the leave of employee %s, checking conflicts without it: %r", emp_id, e)
+            return None
+
+    def _load_pages(self, connector, emp_id, tz):
+        intervals = []
+        now = time.time()
+        for page in range(1, self.max_pages + 1):
+            response = connector.get_employee_leave(emp_id, page=page, page_size=self.page_size,
+                                                    endpoint=self.endpoint)
+            if response.status_code in (404, 405, 501):
+                logger.warning("Teamwork has no leave list (%s), leave conflicts only come from this app",
+                               response.status_code)
+                with self._lock:
+                    self._seed_supported = False
+                return None
+            response.raise_for_status()
+            result = response.json()
+            data = result.get("Data") or []
+            for leave in data:
+                if not leave_is_active(leave):
+                    continue
+                interval = Leave_Interval(leave_timestamp(leave["Start"], tz), leave_timestamp(leave["End"], tz), "teamwork")
+                # Past leave can't conflict with a VTO request
+                if interval.end > now:
+                    intervals.append(interval)
+            if not data or page * self.page_size >= result.get("Total", 0):
+                break
+        return intervals
+
+
+# TEAMWORK_LEAVE_CONFLICT_CHECK=false leaves overlaps to Teamwork's 409 alone
+leave_conflicts = TW_Leave_Conflict_Index(enabled=os.environ.get("TEAMWORK_LEAVE_CONFLICT_CHECK", "true").lower() in ("1", "true", "yes"),
+                                          ttl_seconds=float(os.environ.get("TEAMWORK_LEAVE_CONFLICT_TTL", 900)),
+                                          endpoint=os.environ.get("TEAMWORK_LEAVE_LIST_ENDPOINT", "/api/leave/list"))
@@ -0,0 +1,144 @@
+from dataclasses import dataclass
+from datetime import datetime, time as day_start, timedelta, timezone
+import json
+import logging
+import os
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Day_Hours_Rule(object):
+    """How Teamwork counts the hours of a leave at one location.
+
+    max_hours_per_day   a day never counts more than a shift
+    increment_hours     each day's hours are rounded to this step
+    working_days        weekdays (0 = Monday) that count, others are left out
+    value_unit          "hours", or "days" for Value as a share of max_hours_per_day
+    split_overnight     False books a window shorter than a day on its start date
+    """
+    max_hours_per_day: float = 24
+    increment_hours: float = 0.25
+    working_days: tuple = (0, 1, 2, 3, 4, 5, 6)
+    value_unit: str = "hours"
+    split_overnight: bool = True
+
+    @classmethod
+    def from_dict(cls, rule):
+        rule = dict(rule)
+        if "working_days" in rule:
+            rule["working_days"] = tuple(rule["working_days"])
+        return cls(**rule)
+
+
+def day_hours_entry(day, value):
+    # One DayHours item, as /api/leave/calcdailyhours/ returns them
+    return {"Date": f"{day.isoformat()}T00:00:00", "Count": None, "Value": value,
+            "Description": None, "Id": 0, "Title": None}
+
+def split_by_day(start, end, tz):
+    # [(date, hours)] of start..end cut at the location's midnights; DST days are 23 or 25 hours long
+    cursor, end = start.astimezone(tz), end.astimezone(tz)
+    buckets = []
+    while cursor < end:
+        next_midnight = datetime.combine(cursor.date() + timedelta(days=1), day_start(), tzinfo=tz)
+        until = min(end, next_midnight)
+        # Datetimes sharing a tzinfo subtract wall clocks, in UTC a DST day keeps its real length
+        hours = (until.astimezone(timezone.utc) - cursor.astimezone(timezone.utc)).total_seconds() / 3600
+        buckets.append((cursor.date(), hours))
+        cursor = until
+    return buckets
+
+
+class TW_Day_Hours_Engine(object):
+    """Computes a leave request's DayHours locally from per-location rules.
+
+    Rules are keyed by the location's BusinessId, "*" applies to every
+    location without its own rule. A location without any rule, or a window
+    the rule counts no hours of, falls back to PUT /api/leave/calcdailyhours/. With verify_rate > 0 that share of the
+    locally computed requests is also sent to Teamwork; mismatches are logged
+    and Teamwork's answer is used for them.
+    """
+
+    def __init__(self, rules=None, verify_rate=0.0):
+        self.rules = {str(key): value if isinstance(value, Day_Hours_Rule) else Day_Hours_Rule.from_dict(value)
+                      for key, value in (rules or {}).items()}
+        self.verify_rate = verify_rate
+        self.stats = {"local": 0, "server": 0, "verified": 0, "mismatched": 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        # TEAMWORK_DAY_HOURS_RULES is the JSON rules, or TEAMWORK_DAY_HOURS_RULES_FILE a file holding them
+        rules = os.environ.get("TEAMWORK_DAY_HOURS_RULES")
+        path = os.environ.get("TEAMWORK_DAY_HOURS_RULES_FILE")
+        if not rules and path:
+            with open(path) as f:
+                rules = f.read()
+        return cls(rules=json.loads(rules) if rules else None,
+                   verify_rate=float(os.environ.get("TEAMWORK_DAY_HOURS_VERIFY_RATE", 0)))
+
+    def rule_for(self, business_id):
+        return self.rules.get(str(business_id)) or self.rules.get("*")
+
+    def calculate(self, business_id, tz, start, end):
+        # DayHours of start..end at the location, or None without a rule for it or when the rule counts
+        # no hours: Teamwork decides whether such a request is valid, empty DayHours would post a 0 hour leave
+        rule = self.rule_for(business_id)
+        if rule is None:
+            return None
+        buckets = split_by_day(start, end, tz)
+        if not rule.split_overnight and buckets and sum(hours for _, hours in buckets) < 24:
+            buckets = [(buckets[0][0], sum(hours for _, hours in buckets))]
+
+        day_hours = []
+        for day, hours in buckets:
+            if day.weekday() not in rule.working_days:
+                continue
+            hours = min(hours, rule.max_hours_per_day)
+            if rule.increment_hours:
+                hours = round(hours / rule.increment_hours) * rule.increment_hours
+            if hours <= 0:
+                continue
+            value = hours / rule.max_hours_per_day if rule.value_unit == "days" else hours
+            day_hours.append(day_hours_entry(day, round(value, 4)))
+        return day_hours or None
+
+    def day_hours(self, connector, leave_request, location, start, end):
+        # DayHours for leave_request: local when a rule covers the location, Teamwork's otherwise
+        local = self.calculate(location.business_id, location.tz, start, end)
+        if local is None or self.should_verify():
+            server = connector.calc_daily_hours(leave_request.to_json()).json()
+            if local is None:
+                self._count("server")
+                return server
+            return self.verify(local, server, location.business_id)
+        self._count("local")
+        return local
+
+    def should_verify(self):
+        return self.verify_rate > 0 and random.random() < self.verify_rate
+
+    def verify(self, local, server, business_id):
+        # Returns Teamwork's answer, logging where the local rule disagrees with it
+        self._count("verified")
+        if not same_day_hours(local, server):
+            self._count("mismatched")
+            logger.warning("local DayHours differ from Teamwork's for location %s: local %s, server %s",
+                           business_id, local, server)
+        return server
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+def same_day_hours(local, server, tolerance=0.01):
+    # Compares {Date: Value}, Teamwork's extra fields don't matter
+    values = lambda day_hours: {item["Date"][:10]: float(item.get("Value") or 0) for item in day_hours or []}
+    local, server = values(local), values(server)
+    return local.keys() == server.keys() and all(abs(local[day] - server[day]) <= tolerance for day in local)
+
+
+day_hours_engine = TW_Day_Hours_Engine.from_env()
@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Only what the app needs from an employee record is kept in the index
+EMPLOYEE_FIELDS = ("Id", "FullName", "EmployeeNum", "Email", "LocationName", "BusinessId")
+
+def slim_employee(employee):
+    return {key: employee.get(key) for key in EMPLOYEE_FIELDS}
+
+
+class TW_Employee_Directory(object):
+    """Exact-match email -> employee index over /api/employees/list.
+
+    The whole roster is loaded page by page in the background, and refreshed
+    after ttl_seconds. Until it is loaded, or when an email is missing from
+    it, a single filtered lookup is made and its answer cached.
+    """
+
+    def __init__(self, ttl_seconds=3600, page_size=200, negative_ttl_seconds=60):
+        self.ttl_seconds = ttl_seconds
+        self.page_size = page_size
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._by_email = {}
+        self._misses = {}
+        self._loaded_at = None
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def iter_employees(self, connector, page_size=None, filter=""):
+        # Yields one employee at a time, only a single page is held in memory
+        page_size = page_size or self.page_size
+        page = 1
+        while True:
+            response = connector.get("/api/employees/list",
+                                     params= {
+                                         "sort":"",
+                                         "page":f"{page}",
+                                         "pageSize":f"{page_size}",
+                                         "group":"",
+                                         "filter":filter
+                                     })
+            response.raise_for_status()
+            result = response.json()
+            data = result.get('Data') or []
+            for employee in data:
+                yield employee
+            if not data or page * page_size >= result.get('Total', 0):
+                return
+            page += 1
+
+    def preload(self, connector):
+        by_email = {}
+        for employee in self.iter_employees(connector):
+            if employee.get("Email"):
+                by_email[employee["Email"].strip().lower()] = slim_employee(employee)
+        with self._lock:
+            self._by_email = by_email
+            self._misses = {}
+            self._loaded_at = time.monotonic()
+        logger.info('Loaded %s Teamwork employees into the directory', len(by_email))
+        return len(by_email)
+
+    def lookup(self, connector, email):
+        # Returns the slim employee record for the email, or None if Teamwork has no such employee
+        key = email.strip().lower()
+        self._refresh_if_stale(connector)
+
+        with self._lock:
+            employee = self._by_email.get(key)
+            missed_at = self._misses.get(key)
+        if employee is not None:
+            return employee
+        if missed_at is not None and time.monotonic() - missed_at < self.negative_ttl_seconds:
+            return None
+
+        # Single-key fallback for employees not (yet) in the index
+        response = connector.get_employee_by_email(email, exact=True)
+        result = response.json()
+        with self._lock:
+            if result['Total'] == 0:
+                self._misses[key] = time.monotonic()
+                return None
+            employee = slim_employee(result['Data'][0])
+            self._by_email[key] = employee
+            return employee
+
+    def lookup_many(self, connector, emails):
+        # {email: employee or None} in one pass: an unloaded or stale index is loaded inline
+        # instead of a filtered lookup per email; only emails missing from a fresh index fall back
+        with self._lock:
+            fresh = self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds
+        if not fresh:
+            self.preload(connector)
+            with self._lock:
+                return {email: self._by_email.get(email.strip().lower()) for email in emails}
+        return {email: self.lookup(connector, email) for email in emails}
+
+    def invalidate(self, email=None):
+        with self._lock:
+            if email is None:
+                self._by_email = {}
+                self._misses = {}
+                self._loaded_at = None
+            else:
+                self._by_email.pop(email.strip().lower(), None)
+                self._misses.pop(email.strip().lower(), None)
+
+    def _refresh_if_stale(self, connector):
+        with self._lock:
+            if self._loading:
+                return
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+                return
+            self._loading = True
+        threading.Thread(target=self._background_preload, args=(connector,),
+                         name="employee-directory-preload", daemon=True).start()
+
+    def _background_preload(self, connector):
+        try:
+            self.preload(connector)
+        except Exception:
+            logger.exception('Preloading the Teamwork employee directory failed')
+        finally:
+            with self._lock:
+                self._loading = False
+
+
+employee_directory = TW_Employee_Directory(ttl_seconds=float(os.environ.get("TEAMWORK_DIRECTORY_TTL", 3600)),
+                                           page_size=int(os.environ.get("TEAMWORK_DIRECTORY_PAGE_SIZE", 200)))
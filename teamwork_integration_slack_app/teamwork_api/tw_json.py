@@ -0,0 +1,29 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# TEAMWORK_JSON_BACKEND is "orjson" or "json"; unset uses orjson when it is installed (the "fast-json" extra)
+_backend = os.environ.get("TEAMWORK_JSON_BACKEND", "").lower()
+
+orjson = None
+if _backend in ("", "orjson"):
+    try:
+        import orjson
+    except ImportError:
+        if _backend == "orjson":
+            logger.warning("TEAMWORK_JSON_BACKEND=orjson but orjson is not installed, using json")
+
+backend = "orjson" if orjson is not None else "json"
+
+def dumps(obj):
+    # Request body for Teamwork: bytes with orjson, str with json; requests sends either as is
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"))
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
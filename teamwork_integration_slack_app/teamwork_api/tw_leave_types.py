@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+import time
+
+from teamwork_integration_slack_app.common import VTO_LEAVE_TYPE_TITLE, VTO_LEAVE_TYPE_CODE
+
+logger = logging.getLogger(__name__)
+
+class TW_Leave_Type_Not_Found(Exception):
+    pass
+
+
+class TW_Leave_Type_Catalog(object):
+    """In-memory catalog of /api/leave/leavetypes indexed by Id, Code and Title.
+
+    The list is downloaded once; after ttl_seconds the stale catalog keeps
+    answering while a background thread refreshes it.
+    """
+
+    def __init__(self, ttl_seconds=900):
+        self.ttl_seconds = ttl_seconds
+        self._by_id = {}
+        self._by_code = {}
+        self._by_title = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get_vto_leave_type(self, connector):
+        self._ensure_loaded(connector)
+        return self._vto_leave_type()
+
+    async def get_vto_leave_type_async(self, connector):
+        # Same as get_vto_leave_type() for an AsyncTW_Connector; a missing or stale catalog is
+        # downloaded on the event loop, the lock is never held across the await
+        with self._lock:
+            due = self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl_seconds
+        if due:
+            response = await connector.get_leave_types()
+            response.raise_for_status()
+            self._index(response.json())
+        return self._vto_leave_type()
+
+    def get_by_id(self, connector, type_id):
+        self._ensure_loaded(connector)
+        return self._by_id.get(type_id)
+
+    def get_by_code(self, connector, code):
+        self._ensure_loaded(connector)
+        return self._by_code.get(code)
+
+    def get_by_title(self, connector, title):
+        self._ensure_loaded(connector)
+        return self._by_title.get(title)
+
+    def refresh(self, connector):
+        response = connector.get_leave_types()
+        response.raise_for_status()
+        self._index(response.json())
+
+    def clear(self):
+        with self._lock:
+            self._by_id, self._by_code, self._by_title = {}, {}, {}
+            self._loaded_at = None
+
+    def _ensure_loaded(self, connector):
+        with self._lock:
+            loaded_at = self._loaded_at
+            if loaded_at is not None:
+                if time.monotonic() - loaded_at < self.ttl_seconds or self._refreshing:
+                    return
+                self._refreshing = True
+
+        if loaded_at is None:
+            # Nothing to serve yet, the first caller loads it inline
+            with self._lock:
+                if self._loaded_at is not None:
+                    return
+                self.refresh(connector)
+            return
+
+        threading.Thread(target=self._background_refresh, args=(connector,),
+                         name="leave-type-refresh", daemon=True).start()
+
+    def _background_refresh(self, connector):
+        try:
+            self.refresh(connector)
+        except Exception:
+            logger.exception('Refreshing the Teamwork leave types failed, keeping the stale catalog')
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _vto_leave_type(self):
+        leave_type = self._by_title.get(VTO_LEAVE_TYPE_TITLE) or self._by_code.get(VTO_LEAVE_TYPE_CODE)
+        if leave_type is None:
+            raise TW_Leave_Type_Not_Found(f'No Teamwork leave type titled "{VTO_LEAVE_TYPE_TITLE}" '
+                                          f'or coded "{VTO_LEAVE_TYPE_CODE}" was found.')
+        return leave_type
+
+    def _index(self, leave_types):
+        by_id, by_code, by_title = {}, {}, {}
+        for leave_type in leave_types:
+            by_id[leave_type["Id"]] = leave_type
+            # Later entries win, as the original linear scan did
+            if leave_type.get("Code"):
+                by_code[leave_type["Code"]] = leave_type
+            if leave_type.get("Title"):
+                by_title[leave_type["Title"]] = leave_type
+        # refresh() may run while the lock is held by the first load
+        self._by_id, self._by_code, self._by_title = by_id, by_code, by_title
+        self._loaded_at = time.monotonic()
+
+
+leave_type_catalog = TW_Leave_Type_Catalog(ttl_seconds=float(os.environ.get("TEAMWORK_LEAVE_TYPES_TTL", 900)))
@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+from datetime import timedelta, timezone, tzinfo
+import logging
+import os
+import re
+import threading
+import time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger(__name__)
+
+# Teamwork shows Windows time zone display names, e.g. "(UTC-05:00) Eastern Time (US & Canada)"
+WINDOWS_TIMEZONES = {
+    "Eastern Time (US & Canada)": "America/New_York",
+    "Central Time (US & Canada)": "America/Chicago",
+    "Mountain Time (US & Canada)": "America/Denver",
+    "Pacific Time (US & Canada)": "America/Los_Angeles",
+    "Arizona": "America/Phoenix",
+    "Alaska": "America/Anchorage",
+    "Hawaii": "Pacific/Honolulu",
+    "Indiana (East)": "America/Indiana/Indianapolis",
+    "Atlantic Time (Canada)": "America/Halifax",
+    "Newfoundland": "America/St_Johns",
+    "Saskatchewan": "America/Regina",
+    "Central America": "America/Guatemala",
+    "Guadalajara, Mexico City, Monterrey": "America/Mexico_City",
+    "Bogota, Lima, Quito, Rio Branco": "America/Bogota",
+    "Coordinated Universal Time": "UTC",
+    "Dublin, Edinburgh, Lisbon, London": "Europe/London",
+    "Amsterdam, Berlin, Bern, Rome, Stockholm, Vienna": "Europe/Berlin",
+    "Chennai, Kolkata, Mumbai, New Delhi": "Asia/Kolkata",
+    "Manila": "Asia/Manila",
+}
+
+TIMEZONE_LABEL = re.compile(r"^\(UTC(?:(?P<sign>[+-])(?P<hours>\d{2}):(?P<minutes>\d{2}))?\)\s*(?P<name>.*)$")
+
+def resolve_timezone(timezone_label) -> tzinfo:
+    # Prefers the DST-aware zone, falls back to the fixed offset written in the label
+    match = TIMEZONE_LABEL.match(timezone_label.strip())
+    if match is None:
+        raise ValueError(f'Unrecognized Teamwork time zone: {timezone_label}')
+
+    zone_name = WINDOWS_TIMEZONES.get(match.group("name"))
+    if zone_name is not None:
+        try:
+            return ZoneInfo(zone_name)
+        except ZoneInfoNotFoundError:
+            logger.warning('Time zone %s is not installed, using the fixed offset of "%s"', zone_name, timezone_label)
+
+    if match.group("sign") is None:
+        return timezone.utc
+    offset = timedelta(hours=int(match.group("hours")), minutes=int(match.group("minutes")))
+    return timezone(-offset if match.group("sign") == "-" else offset)
+
+
+@dataclass
+class TW_Location(object):
+    business_id: int
+    business_name: str
+    timezone_label: str
+    tz: tzinfo
+
+    @property
+    def timezone_string(self):
+        # "UTC-05:00", as shown in the DEBUG submission message
+        return self.timezone_label.strip()[1:].split(")")[0]
+
+
+class TW_Location_Registry(object):
+    """Caches locations by BusinessId and each employee's default location.
+
+    Only the first submission of an employee pays /api/employees/{id}/locations,
+    and only the first of a location pays /api/locations/{BusinessId}.
+    """
+
+    def __init__(self, employee_ttl_seconds=6 * 3600, location_ttl_seconds=24 * 3600):
+        self.employee_ttl_seconds = employee_ttl_seconds
+        self.location_ttl_seconds = location_ttl_seconds
+        self._locations = {}
+        self._employee_defaults = {}
+        self._lock = threading.Lock()
+
+    def get_default_location(self, connector, emp_id):
+        business_id, business_name = self._cached(self._employee_defaults, emp_id, self.employee_ttl_seconds) or (None, None)
+        if business_id is None:
+            default = None
+            for loc in connector.get_employee_locations(emp_id).json():
+                if loc['IsDefault']:
+                    default = loc
+            if default is None:
+                return None
+            business_id, business_name = default['BusinessId'], default.get('BusinessName')
+            self._store(self._employee_defaults, emp_id, (business_id, business_name))
+
+        return self.get_location(connector, business_id, business_name)
+
+    def get_location(self, connector, business_id, business_name=None):
+        location = self._cached(self._locations, business_id, self.location_ttl_seconds)
+        if location is None:
+            detail = connector.get_location(business_id).json()
+            location = TW_Location(business_id=business_id,
+                                   business_name=business_name or detail.get('BusinessName') or detail.get('Name'),
+                                   timezone_label=detail['TimeZone'],
+                                   tz=resolve_timezone(detail['TimeZone']))
+            self._store(self._locations, business_id, location)
+        return location
+
+    def forget_employee(self, emp_id):
+        with self._lock:
+            self._employee_defaults.pop(emp_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._locations.clear()
+            self._employee_defaults.clear()
+
+    def _cached(self, cache, key, ttl_seconds):
+        with self._lock:
+            entry = cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] < ttl_seconds:
+            return entry[1]
+        return None
+
+    def _store(self, cache, key, value):
+        with self._lock:
+            cache[key] = (time.monotonic(), value)
+
+
+location_registry = TW_Location_Registry(employee_ttl_seconds=float(os.environ.get("TEAMWORK_EMPLOYEE_LOCATION_TTL", 6 * 3600)),
+                                         location_ttl_seconds=float(os.environ.get("TEAMWORK_LOCATION_TTL", 24 * 3600)))
@@ -0,0 +1,117 @@
+from dataclasses import dataclass
+from functools import cached_property
+import asyncio
+import os
+import threading
+import time
+
+@dataclass
+class TW_Session(object):
+    session_id: str
+    api_token: str
+    expires_at: float = 0
+
+    @cached_property
+    def headers(self):
+        # Built once per session; requests merges it into a new dict per call and never mutates it
+        return {
+            "x-session-id": f"{self.session_id}",
+            "x-api-token": f"{self.api_token}",
+            "Content-Type": "application/json"
+        }
+
+    def is_expired(self):
+        return time.monotonic() >= self.expires_at
+
+
+class TW_Session_Manager(object):
+    """Shares Teamwork sessions between connectors, keyed by portal credentials.
+
+    A session is only refreshed once it expires or a call reports it as
+    rejected (401/403). Refreshes are serialized per key so a burst of
+    threads triggers a single POST /api/ops/auth.
+    """
+
+    def __init__(self, ttl_seconds=1800):
+        self.ttl_seconds = ttl_seconds
+        self._sessions = {}
+        self._key_locks = {}
+        self._async_key_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, login):
+        # login() performs the actual authentication and returns (session_id, api_token)
+        session = self._current(key)
+        if session is not None:
+            return session
+
+        with self._key_lock(key):
+            # Another thread may have refreshed it while we were waiting
+            session = self._current(key)
+            if session is not None:
+                return session
+
+            session_id, api_token = login()
+            session = TW_Session(session_id=session_id,
+                                 api_token=api_token,
+                                 expires_at=time.monotonic() + self.ttl_seconds)
+            with self._lock:
+                self._sessions[key] = session
+            return session
+
+    async def aget(self, key, alogin):
+        # Same as get() for AsyncTW_Connector, alogin() is a coroutine function
+        session = self._current(key)
+        if session is not None:
+            return session
+
+        async with self._async_key_lock(key):
+            session = self._current(key)
+            if session is not None:
+                return session
+
+            session_id, api_token = await alogin()
+            session = TW_Session(session_id=session_id,
+                                 api_token=api_token,
+                                 expires_at=time.monotonic() + self.ttl_seconds)
+            with self._lock:
+                self._sessions[key] = session
+            return session
+
+    def invalidate(self, key, session=None):
+        # Only drop the session the caller saw rejected, not a newer one
+        with self._lock:
+            current = self._sessions.get(key)
+            if current is not None and (session is None or current is session):
+                del self._sessions[key]
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def _current(self, key):
+        with self._lock:
+            session = self._sessions.get(key)
+        if session is not None and not session.is_expired():
+            return session
+        return None
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _async_key_lock(self, key):
+        # asyncio locks belong to one event loop, so they are kept per loop
+        loop_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            lock = self._async_key_locks.get(loop_key)
+            if lock is None:
+                lock = self._async_key_locks[loop_key] = asyncio.Lock()
+            return lock
+
+
+# Module-level manager so warm invocations reuse the same Teamwork session
+tw_sessions = TW_Session_Manager(ttl_seconds=float(os.environ.get("TEAMWORK_SESSION_TTL", 1800)))
@@ -0,0 +1,184 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from teamwork_integration_slack_app.instrumentation import instrumentation, operation_name, payload_size
+from teamwork_integration_slack_app.teamwork_api.tw_breaker import FAILURE_STATUS_CODES, tw_breaker
+from teamwork_integration_slack_app.deadline import MIN_CALL_SECONDS, Deadline_Exceeded, deadlines
+
+# Status codes worth retrying; 429 means the request was not processed at all
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Methods that are safe to resend after a 5xx or a dropped connection
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+# Teamwork uses PUT for these, but they only compute and never write
+IDEMPOTENT_ENDPOINTS = ("/api/ops/auth", "/api/leave/calcdailyhours", "/api/leave/checkdailyhours")
+
+class TW_Transport(object):
+    """Shared keep-alive HTTP transport for every Teamwork call.
+
+    One requests.Session with a pooled adapter is kept per process so the
+    calls of a submission (and of warm invocations) reuse the same
+    TCP+TLS connections. Failed calls are retried a bounded number of
+    times with full-jitter exponential backoff. Every call goes through the
+    circuit breaker, which raises TW_Unavailable while Teamwork is down,
+    and is cut to the invocation's deadline: timeouts shrink to the time
+    left, a call without time left raises Deadline_Exceeded and retries
+    stop when the next attempt couldn't finish.
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=10, max_retries=2,
+                 backoff_base=0.2, backoff_max=2.0, default_timeout=(3.05, 10),
+                 endpoint_timeouts=None, breaker=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.default_timeout = default_timeout
+        # Longest matching endpoint prefix wins, values are (connect, read) timeouts
+        self.endpoint_timeouts = endpoint_timeouts or {}
+        self.breaker = breaker or tw_breaker
+        self._stats = {"requests": 0, "retries": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._session = self._new_session()
+
+    @classmethod
+    def from_env(cls):
+        return cls(pool_connections=int(os.environ.get("TEAMWORK_POOL_CONNECTIONS", 4)),
+                   pool_maxsize=int(os.environ.get("TEAMWORK_POOL_MAXSIZE", 10)),
+                   max_retries=int(os.environ.get("TEAMWORK_MAX_RETRIES", 2)),
+                   backoff_base=float(os.environ.get("TEAMWORK_BACKOFF_BASE", 0.2)),
+                   backoff_max=float(os.environ.get("TEAMWORK_BACKOFF_MAX", 2.0)),
+                   default_timeout=(float(os.environ.get("TEAMWORK_CONNECT_TIMEOUT", 3.05)),
+                                    float(os.environ.get("TEAMWORK_READ_TIMEOUT", 10))),
+                   endpoint_timeouts={
+                       "/api/ops/auth": (3.05, 5),
+                       "/api/employees/list": (3.05, 15),
+                       "/api/leave/post": (3.05, 20),
+                   })
+
+    def request(self, method, url, endpoint="", retry=None, **kwargs):
+        # retry=None lets the method/endpoint decide whether a resend is safe
+        if retry is None:
+            retry = method.upper() in IDEMPOTENT_METHODS or endpoint.startswith(IDEMPOTENT_ENDPOINTS)
+        timeout = kwargs.pop("timeout", None) or self.timeout_for(endpoint)
+        operation = f"teamwork {method.upper()} {operation_name(endpoint)}"
+        # Skipped before the breaker, so a call the invocation has no time for can't take the half-open probe
+        deadlines.check(operation)
+        self.breaker.before_call(url)
+
+        attempt = 0
+        response = None
+        cut_short = False
+        started = time.perf_counter()
+        try:
+            while True:
+                self._count("requests")
+                response = None
+                # Each attempt only gets what is left of the invocation's deadline
+                kwargs["timeout"] = deadlines.timeout(timeout)
+                try:
+                    response = self._session.request(method=method, url=url, **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    self._count("errors")
+                    delay = self._backoff(attempt + 1)
+                    if not retry or attempt >= self.max_retries or not deadlines.allows(delay + MIN_CALL_SECONDS):
+                        if isinstance(e, requests.exceptions.Timeout) and kwargs["timeout"] != timeout:
+                            # The deadline cut this attempt short, not Teamwork
+                            cut_short = True
+                            raise Deadline_Exceeded(operation, 0.0, started=True) from e
+                        raise
+                else:
+                    # A 429 was rejected before any work, so it is always safe to resend
+                    if response.status_code not in RETRY_STATUS_CODES \
+                        or attempt >= self.max_retries \
+                        or (not retry and response.status_code != 429):
+                        return response
+                    self._count("errors")
+                    delay = self._retry_after(response)
+                    delay = self._backoff(attempt + 1) if delay is None else min(delay, self.backoff_max)
+                    if not deadlines.allows(delay + MIN_CALL_SECONDS):
+                        # No time left for another attempt, the caller gets this answer
+                        return response
+
+                attempt += 1
+                self._count("retries")
+                time.sleep(delay)
+        finally:
+            # One outcome per call, retries included: an agent waited that long either way.
+            # A timeout cut short by the deadline says nothing about Teamwork, so it isn't counted
+            if not cut_short:
+                self.breaker.after_call(url, response is None or response.status_code in FAILURE_STATUS_CODES,
+                                        time.perf_counter() - started)
+            instrumentation.record("teamwork", f"{method.upper()} {operation_name(endpoint)}",
+                                   response.status_code if response is not None else "error",
+                                   (time.perf_counter() - started) * 1000,
+                                   request_bytes=payload_size(kwargs.get("data") or kwargs.get("json")),
+                                   response_bytes=len(response.content) if response is not None else 0,
+                                   attempts=attempt + 1)
+
+    def timeout_for(self, endpoint):
+        match = ""
+        for prefix in self.endpoint_timeouts:
+            if endpoint.startswith(prefix) and len(prefix) > len(match):
+                match = prefix
+        return self.endpoint_timeouts[match] if match else self.default_timeout
+
+    def pool_stats(self):
+        # Aggregated urllib3 pool numbers, useful to size pool_maxsize for the Lambda concurrency
+        pools = []
+        for adapter in set(self._session.adapters.values()):
+            manager = adapter.poolmanager
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                pools.append({
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    # The pool queue is pre-filled with None placeholders for unopened slots
+                    "idle": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0,
+                    "maxsize": pool.pool.maxsize if pool.pool is not None else 0,
+                })
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pools"] = pools
+        return stats
+
+    def close(self):
+        self._session.close()
+
+    def _new_session(self):
+        session = requests.Session()
+        # Retries are done by request() so they can follow our own policy
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_after(self, response):
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            return None
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+
+# Module-level transport shared by every TW_Connector in this process
+tw_transport = TW_Transport.from_env()
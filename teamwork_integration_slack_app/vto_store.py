@@ -0,0 +1,232 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import logging
+import os
+import time
+import uuid
+
+from teamwork_integration_slack_app.stores import SQLite_Store, load_store
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of VTO_State_Store.reserve()
+RESERVED = "reserved"
+QUEUE_FULL = "queue_full"
+FULL = "full"
+
+# How long a slot is held for: a posted form button, an opened form, a submission in flight
+BUTTON_LEASE_SECONDS = float(os.environ.get("VTO_BUTTON_LEASE_SECONDS", 600))
+FORM_LEASE_SECONDS = float(os.environ.get("VTO_FORM_LEASE_SECONDS", 900))
+SUBMISSION_LEASE_SECONDS = float(os.environ.get("VTO_SUBMISSION_LEASE_SECONDS", 120))
+
+@dataclass
+class VTO_Lease(object):
+    lease_id: str
+    channel_id: str
+    thread_ts: str
+    user_id: str
+    expires_at: float
+
+    def is_live(self, now=None):
+        return self.expires_at >= (time.time() if now is None else now)
+
+
+@dataclass
+class VTO_Offer_State(object):
+    channel_id: str
+    thread_ts: str
+    vto_limit: float
+    opened_count: int = 0
+    success_count: int = 0
+
+    @property
+    def is_full(self):
+        return self.success_count >= self.vto_limit
+
+    @property
+    def is_queue_full(self):
+        # Every slot is either confirmed or held by an open form
+        return self.success_count + self.opened_count >= self.vto_limit
+
+
+class VTO_State_Store(ABC):
+    """Slot counters of one VTO offer, keyed by channel and thread_ts.
+
+    A slot is held by a lease with an expiry: taken when the form button is
+    posted, renewed when the form is opened and again when it is submitted,
+    released on cancel and turned into a success on an accepted leave request.
+    opened_count is the number of live leases, so a button nobody clicks gives
+    its slot back when its lease expires. reserve/confirm/release must be
+    atomic, so concurrent reactions and submissions can't hand out more slots
+    than the offer has.
+    """
+
+    @abstractmethod
+    def get(self, channel_id, thread_ts):
+        pass
+
+    @abstractmethod
+    def seed(self, state):
+        # Stores a state rebuilt from the thread unless one already exists, returns the stored one.
+        # Only the limit and success_count are kept: forms without a lease here can't be submitted
+        pass
+
+    @abstractmethod
+    def reserve(self, channel_id, thread_ts, user_id, lease_seconds=BUTTON_LEASE_SECONDS):
+        # Returns (RESERVED | QUEUE_FULL | FULL, state, lease or None); an agent's live lease is reused
+        pass
+
+    @abstractmethod
+    def renew(self, lease_id, lease_seconds):
+        # Extends a live lease, returns it, or None if it expired, was released or never existed
+        pass
+
+    @abstractmethod
+    def confirm(self, channel_id, thread_ts, lease_id):
+        # The leave request was accepted: the lease becomes a success, even if it expired meanwhile
+        pass
+
+    @abstractmethod
+    def release(self, channel_id, thread_ts, lease_id):
+        pass
+
+
+class SQLite_VTO_State_Store(SQLite_Store, VTO_State_Store):
+    """Local backend; every container of a Lambda has its own file, so use a shared store across containers."""
+
+    def __init__(self, path, max_age_seconds=7 * 24 * 3600):
+        super().__init__(path)
+        self.max_age_seconds = max_age_seconds
+        conn = self._connection()
+        conn.execute("""CREATE TABLE IF NOT EXISTS vto_offer (
+                            channel_id TEXT NOT NULL,
+                            thread_ts TEXT NOT NULL,
+                            vto_limit REAL NOT NULL,
+                            success_count INTEGER NOT NULL DEFAULT 0,
+                            updated_at REAL NOT NULL,
+                            PRIMARY KEY (channel_id, thread_ts))""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS vto_lease (
+                            lease_id TEXT PRIMARY KEY,
+                            channel_id TEXT NOT NULL,
+                            thread_ts TEXT NOT NULL,
+                            user_id TEXT NOT NULL,
+                            expires_at REAL NOT NULL)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS vto_lease_offer ON vto_lease (channel_id, thread_ts, expires_at)")
+
+    def get(self, channel_id, thread_ts):
+        row = self._connection().execute(
+            "SELECT channel_id, thread_ts, vto_limit, "
+            "(SELECT COUNT(*) FROM vto_lease l WHERE l.channel_id = o.channel_id AND l.thread_ts = o.thread_ts "
+            "AND l.expires_at >= ?), success_count FROM vto_offer o "
+            "WHERE channel_id = ? AND thread_ts = ?", (time.time(), channel_id, thread_ts)).fetchone()
+        return VTO_Offer_State(*row) if row else None
+
+    def seed(self, state):
+        conn = self._connection()
+        expired = time.time() - self.max_age_seconds
+        conn.execute("DELETE FROM vto_offer WHERE updated_at < ?", (expired,))
+        conn.execute("DELETE FROM vto_lease WHERE expires_at < ?", (expired,))
+        conn.execute("INSERT OR IGNORE INTO vto_offer (channel_id, thread_ts, vto_limit, success_count, updated_at) "
+                     "VALUES (?, ?, ?, ?, ?)",
+                     (state.channel_id, state.thread_ts, state.vto_limit, state.success_count, time.time()))
+        return self.get(state.channel_id, state.thread_ts)
+
+    def reserve(self, channel_id, thread_ts, user_id, lease_seconds=BUTTON_LEASE_SECONDS):
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute("SELECT lease_id FROM vto_lease WHERE channel_id = ? AND thread_ts = ? AND user_id = ? "
+                           "AND expires_at >= ?", (channel_id, thread_ts, user_id, now)).fetchone()
+        lease = self.renew(row[0], lease_seconds) if row else None
+        if lease is None:
+            # A single conditional INSERT, so two reservations can't both take the last slot
+            lease_id = uuid.uuid4().hex
+            inserted = conn.execute(
+                "INSERT INTO vto_lease (lease_id, channel_id, thread_ts, user_id, expires_at) "
+                "SELECT ?, ?, ?, ?, ? FROM vto_offer o WHERE o.channel_id = ? AND o.thread_ts = ? "
+                "AND o.success_count + (SELECT COUNT(*) FROM vto_lease l WHERE l.channel_id = o.channel_id "
+                "AND l.thread_ts = o.thread_ts AND l.expires_at >= ?) < o.vto_limit",
+                (lease_id, channel_id, thread_ts, user_id, now + lease_seconds, channel_id, thread_ts, now)).rowcount
+            if inserted:
+                lease = VTO_Lease(lease_id, channel_id, thread_ts, user_id, now + lease_seconds)
+        state = self.get(channel_id, thread_ts)
+        if lease is not None:
+            return RESERVED, state, lease
+        return (FULL if state.is_full else QUEUE_FULL), state, None
+
+    def renew(self, lease_id, lease_seconds):
+        now = time.time()
+        conn = self._connection()
+        updated = conn.execute("UPDATE vto_lease SET expires_at = MAX(expires_at, ?) WHERE lease_id = ? AND expires_at >= ?",
+                               (now + lease_seconds, lease_id, now)).rowcount
+        if not updated:
+            return None
+        row = conn.execute("SELECT lease_id, channel_id, thread_ts, user_id, expires_at FROM vto_lease WHERE lease_id = ?",
+                           (lease_id,)).fetchone()
+        return VTO_Lease(*row) if row else None
+
+    def confirm(self, channel_id, thread_ts, lease_id):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM vto_lease WHERE lease_id = ?", (lease_id,))
+            conn.execute("UPDATE vto_offer SET success_count = success_count + 1, updated_at = ? "
+                         "WHERE channel_id = ? AND thread_ts = ?", (time.time(), channel_id, thread_ts))
+        return self.get(channel_id, thread_ts)
+
+    def release(self, channel_id, thread_ts, lease_id):
+        self._connection().execute("DELETE FROM vto_lease WHERE lease_id = ? AND channel_id = ? AND thread_ts = ?",
+                                   (lease_id, channel_id, thread_ts))
+        return self.get(channel_id, thread_ts)
+
+
+class Thread_VTO_State_Store(VTO_State_Store):
+    """Degraded backend without leases: every count is read from the offer's thread.
+
+    The slots are the thread's success posts and form buttons, as before the
+    lease store; leases aren't tracked, so a form keeps its slot until its
+    button is deleted and two reactions at once can both take the last one.
+    snapshot(channel_id, thread_ts) returns the thread's VTO_Thread_Snapshot.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def get(self, channel_id, thread_ts):
+        snapshot = self.snapshot(channel_id, thread_ts)
+        return VTO_Offer_State(channel_id, thread_ts, snapshot.vto_limit,
+                               opened_count=snapshot.opened_form_count, success_count=snapshot.success_count)
+
+    def seed(self, state):
+        return self.get(state.channel_id, state.thread_ts)
+
+    def reserve(self, channel_id, thread_ts, user_id, lease_seconds=BUTTON_LEASE_SECONDS):
+        state = self.get(channel_id, thread_ts)
+        if state.is_full:
+            return FULL, state, None
+        if state.is_queue_full:
+            return QUEUE_FULL, state, None
+        return RESERVED, state, VTO_Lease(uuid.uuid4().hex, channel_id, thread_ts, user_id, time.time() + lease_seconds)
+
+    def renew(self, lease_id, lease_seconds):
+        # Every form button holds its slot while it is in the thread
+        return VTO_Lease(lease_id, "", "", "", time.time() + lease_seconds)
+
+    def confirm(self, channel_id, thread_ts, lease_id):
+        # The success post is the record
+        return None
+
+    def release(self, channel_id, thread_ts, lease_id):
+        # Deleting the form button is the record
+        return None
+
+
+def load_vto_state_store(snapshot=None):
+    # VTO_STATE_STORE is "sqlite" or "package.module:factory" returning a shared VTO_State_Store
+    if os.environ.get("VTO_STATE_STORE") is None and os.environ.get("AWS_LAMBDA_FUNCTION_NAME") \
+        and snapshot is not None:
+        # A SQLite file per container would lose leases between the click, the submission and its
+        # lazy run, and wouldn't enforce the offer's limit across containers
+        logger.warning("VTO_STATE_STORE is not set on Lambda: counting VTO slots from the thread, without leases")
+        return Thread_VTO_State_Store(snapshot)
+    return load_store("VTO_STATE_STORE", "sqlite", {
+        "sqlite": lambda: SQLite_VTO_State_Store(os.environ.get("VTO_STATE_DB", "/tmp/vto_state.sqlite3"))})
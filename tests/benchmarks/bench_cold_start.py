@@ -0,0 +1,78 @@
+"""Cold-start benchmark of the Lambda handler.
+
+Every run is a fresh interpreter, like a new Lambda container: it times the
+import of app.py (the init phase) and the first and second handler() calls
+with a leave request submission, against the stub Slack and Teamwork servers.
+
+    python tests/benchmarks/bench_cold_start.py [--runs 10] [--latency 0.02] [--warm-up slack,teamwork]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from tests.benchmarks.stub_servers import start_stub_servers, stub_environment
+
+
+def child():
+    from tests.benchmarks.slack_events import Lambda_Context, signed_event, submission_payload
+
+    started = time.perf_counter()
+    import teamwork_integration_slack_app.app as app_module
+    imported = time.perf_counter()
+    first = app_module.handler(signed_event(submission_payload(user_id="U1")), Lambda_Context())
+    first_done = time.perf_counter()
+    app_module.handler(signed_event(submission_payload(user_id="U2")), Lambda_Context())
+    second_done = time.perf_counter()
+
+    print(json.dumps({
+        "init_ms": (imported - started) * 1000,
+        "first_call_ms": (first_done - imported) * 1000,
+        "second_call_ms": (second_done - first_done) * 1000,
+        "first_status": first["statusCode"],
+        "modules": len(sys.modules),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every stub response")
+    parser.add_argument("--warm-up", default="", help="WARM_UP targets for the init phase, e.g. slack,teamwork")
+    args = parser.parse_args()
+
+    slack, teamwork = start_stub_servers(args.latency)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for run in range(args.runs):
+            env = dict(os.environ, **stub_environment(slack, teamwork),
+                       AWS_LAMBDA_FUNCTION_NAME="teamwork-integration-slack-app",
+                       LOG_LEVEL="WARNING",
+                       VTO_STATE_DB=os.path.join(tmp, f"vto_state_{run}.sqlite3"),
+                       WARM_UP=args.warm_up,
+                       PYTHONPATH=ROOT)
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"],
+                                 env=env, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(f'{args.runs} cold starts, {args.latency * 1000:.0f} ms stub latency, WARM_UP="{args.warm_up}"')
+    for key in ("init_ms", "first_call_ms", "second_call_ms"):
+        values = sorted(r[key] for r in results)
+        print(f'  {key:15} median {statistics.median(values):8.1f}   min {values[0]:8.1f}   max {values[-1]:8.1f}')
+    print(f'  modules loaded  {results[0]["modules"]}, first call status {results[0]["first_status"]}')
+    print(f'  slack calls     {dict(slack.calls)}')
+    print(f'  teamwork calls  {dict(teamwork.calls)}')
+
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        child()
+    else:
+        main()
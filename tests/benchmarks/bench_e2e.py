@@ -0,0 +1,188 @@
+"""End-to-end benchmark of the Lambda handler against the stub Slack and Teamwork servers.
+
+Drives the three listener flows through app.handler() in one warm process:
+
+    execute      workflow_step_execute, a :vto: reaction on an offer
+    open_form    block_actions of the "Open VTO form" button
+    submission   view_submission of the leave request form
+
+and reports p50/p95/p99 latency, throughput and outbound calls per flow. Every
+run is saved to tests/benchmarks/results/ (git-ignored) so runs can be compared:
+
+    python tests/benchmarks/bench_e2e.py --iterations 200 --latency 0.02 --label baseline
+    python tests/benchmarks/bench_e2e.py --iterations 200 --latency 0.02 --compare latest
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+sys.path.insert(0, ROOT)
+
+from tests.benchmarks.stub_servers import start_stub_servers, stub_environment
+from tests.benchmarks.slack_events import Lambda_Context, signed_event, submission_payload, \
+    workflow_step_execute_payload, open_form_payload, vto_offer_message
+
+FLOWS = ("execute", "open_form", "submission")
+
+
+def percentile(values, p):
+    # Nearest rank on sorted values
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def offer_ts(i, reactions_per_offer):
+    return f"1700000000.{i // reactions_per_offer:06d}"
+
+
+def build_events(flow, iterations, reactions_per_offer, slack):
+    # The i-th reaction, button click and submission all belong to agent U{i} on the same offer;
+    # a submission sends the form (and slot lease) the click opened
+    events = []
+    for i in range(iterations):
+        user_id = f"U{i % 400}"
+        thread_ts = offer_ts(i, reactions_per_offer)
+        if flow == "execute":
+            payload, form = workflow_step_execute_payload(f"{user_id.lower()}@example.com", f"Ev{i}", thread_ts=thread_ts), False
+        elif flow == "open_form":
+            payload, form = open_form_payload(user_id, thread_ts=thread_ts), True
+        else:
+            payload, form = submission_payload(user_id=user_id, thread_ts=thread_ts,
+                                               view=slack.opened_view(f"trigger-{user_id}")), True
+        events.append(signed_event(payload, form=form))
+    return events
+
+
+def run_flow(app_module, events, concurrency):
+    def invoke(event):
+        started = time.perf_counter()
+        response = app_module.handler(event, Lambda_Context())
+        return (time.perf_counter() - started) * 1000, response["statusCode"]
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(invoke, events))
+    else:
+        results = [invoke(event) for event in events]
+    elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def summarize(results, elapsed, calls, iterations):
+    latencies = sorted(ms for ms, _ in results)
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2),
+        "throughput_per_s": round(iterations / elapsed, 1),
+        "errors": sum(1 for _, status in results if status != 200),
+        "outbound_calls_per_invocation": {name: round(count / iterations, 2) for name, count in sorted(calls.items())},
+        "outbound_calls_total_per_invocation": round(sum(calls.values()) / iterations, 2),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(compare):
+    if compare == "latest":
+        files = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))
+        if not files:
+            return None, None
+        compare = files[-1]
+    with open(compare) as f:
+        return compare, json.load(f)
+
+
+def print_report(report, previous=None):
+    params = report["parameters"]
+    print(f'{params["iterations"]} iterations per flow, {params["latency"] * 1000:.0f} ms stub latency, '
+          f'concurrency {params["concurrency"]}, revision {report["revision"]}')
+    print(f'  {"flow":12} {"p50":>8} {"p95":>8} {"p99":>8} {"req/s":>8} {"calls":>6} {"errors":>6}')
+    for flow, stats in report["flows"].items():
+        line = (f'  {flow:12} {stats["p50_ms"]:8.1f} {stats["p95_ms"]:8.1f} {stats["p99_ms"]:8.1f} '
+                f'{stats["throughput_per_s"]:8.1f} {stats["outbound_calls_total_per_invocation"]:6.2f} {stats["errors"]:6}')
+        before = (previous or {}).get("flows", {}).get(flow)
+        if before:
+            line += (f'   p50 {stats["p50_ms"] - before["p50_ms"]:+.1f} ms, p95 {stats["p95_ms"] - before["p95_ms"]:+.1f} ms, '
+                     f'calls {stats["outbound_calls_total_per_invocation"] - before["outbound_calls_total_per_invocation"]:+.2f}')
+        print(line)
+        print(f'  {"":12} {stats["outbound_calls_per_invocation"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every stub response")
+    parser.add_argument("--concurrency", type=int, default=1, help="concurrent handler() calls, 1 is the Lambda model")
+    parser.add_argument("--reactions-per-offer", type=int, default=5)
+    parser.add_argument("--flows", default=",".join(FLOWS))
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--compare", help='a results file, or "latest"')
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    previous_path, previous = load_previous(args.compare) if args.compare else (None, None)
+
+    slack, teamwork = start_stub_servers(args.latency)
+    tmp = tempfile.mkdtemp()
+    os.environ.update(stub_environment(slack, teamwork),
+                      AWS_LAMBDA_FUNCTION_NAME="teamwork-integration-slack-app",
+                      LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+                      INSTRUMENTATION_FORMAT=os.environ.get("INSTRUMENTATION_FORMAT", "off"),
+                      VTO_STATE_DB=os.path.join(tmp, "vto_state.sqlite3"))
+    import teamwork_integration_slack_app.app as app_module
+
+    for i in range(0, args.iterations, args.reactions_per_offer):
+        slack.seed_thread(vto_offer_message(args.reactions_per_offer, thread_ts=offer_ts(i, args.reactions_per_offer)))
+
+    report = {
+        "label": args.label,
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "parameters": {"iterations": args.iterations, "latency": args.latency, "concurrency": args.concurrency,
+                       "reactions_per_offer": args.reactions_per_offer},
+        "flows": {},
+    }
+    for flow in args.flows.split(","):
+        events = build_events(flow, args.iterations, args.reactions_per_offer, slack)
+        slack.reset_calls()
+        teamwork.reset_calls()
+        results, elapsed = run_flow(app_module, events, args.concurrency)
+        calls = Counter({f"slack {k}": v for k, v in slack.calls.items()})
+        calls.update({f"teamwork {k}": v for k, v in teamwork.calls.items()})
+        report["flows"][flow] = summarize(results, elapsed, calls, args.iterations)
+
+    if previous_path:
+        print(f'compared with {os.path.relpath(previous_path, ROOT)}')
+    print_report(report, previous)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f'{time.strftime("%Y%m%d-%H%M%S")}-{args.label}.json')
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f'saved {os.path.relpath(path, ROOT)}')
+
+
+if __name__ == "__main__":
+    main()
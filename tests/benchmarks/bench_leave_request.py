@@ -0,0 +1,139 @@
+"""Microbenchmark of the leave request payload work done by one submission.
+
+Compares the dataclass path the app used to take with the compact
+Employee_Leave_Request, on the json and (when installed) orjson backends:
+
+    legacy     dataclass, to_json(), from_json(json.dumps([{"DayHours": ...}])) with a setattr
+               loop, to_json() again, and the connector's headers re-encoded on every call
+    compact    template dict copy, DayHours set in place, one serialization per request body,
+               session headers built once
+
+Reports time per submission, peak traced memory during one submission and
+the memory one leave request object keeps:
+
+    python tests/benchmarks/bench_leave_request.py --iterations 20000
+"""
+import argparse
+import dataclasses
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from teamwork_integration_slack_app.common import leave_request_fields
+from teamwork_integration_slack_app.teamwork_api import tw_json
+from teamwork_integration_slack_app.teamwork_api.tw_auth import Employee_Leave_Request, LEAVE_REQUEST_TEMPLATE
+from teamwork_integration_slack_app.teamwork_api.tw_session import TW_Session
+
+EMPLOYEE = {"Id": 1234, "FullName": "Doe, Jane"}
+LEAVE_TYPE = {"Id": 544, "Title": "VTO: Slack", "Code": None}
+FIELDS = leave_request_fields(EMPLOYEE, LEAVE_TYPE, "2023-11-14T09:00:00-0500", "2023-11-14T13:00:00-0500")
+# calcdailyhours answer, parsed by requests in both paths
+DAY_HOURS = [{"Date": "2023-11-14T00:00:00", "Count": None, "Value": 4, "Description": None, "Id": 0, "Title": None}]
+
+
+def _legacy_class():
+    # The former @dataclass Employee_Leave_Request, field for field
+    fields = [(name, type(value) if value is not None else object,
+               dataclasses.field(default_factory=list) if isinstance(value, list) else value)
+              for name, value in LEAVE_REQUEST_TEMPLATE.items()]
+
+    def from_json(self, json_data):
+        for d in json.loads(json_data):
+            for key, value in d.items():
+                setattr(self, key, value)
+
+    def to_json(self):
+        return json.dumps(self.__dict__)
+
+    return dataclasses.make_dataclass("Legacy_Leave_Request", fields,
+                                      namespace={"from_json": from_json, "to_json": to_json})
+
+Legacy_Leave_Request = _legacy_class()
+
+
+class Legacy_Session(object):
+    # TW_Session.headers was a property building the dict on every access
+    session_id, api_token = "session", "token"
+
+    @property
+    def headers(self):
+        return {"x-session-id": f"{self.session_id}", "x-api-token": f"{self.api_token}",
+                "Content-Type": "application/json"}
+
+
+def legacy_submission(session=Legacy_Session()):
+    request = Legacy_Leave_Request(**FIELDS)
+    # Every _send: _ensure_session re-encoded the headers, then the request used a fresh dict
+    json.dumps(session.headers), session.headers
+    calc_body = request.to_json()
+    request.from_json(json.dumps([{"DayHours": DAY_HOURS}]))
+    json.dumps(session.headers), session.headers
+    post_body = request.to_json()
+    return calc_body, post_body
+
+
+def compact_submission(session=TW_Session("session", "token")):
+    request = Employee_Leave_Request(**FIELDS)
+    session.headers
+    calc_body = request.to_json()
+    request.DayHours = DAY_HOURS
+    session.headers
+    post_body = request.to_json()
+    return calc_body, post_body
+
+
+def measure(func, iterations):
+    seconds = min(timeit.repeat(func, number=iterations, repeat=5)) / iterations
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return seconds * 1e6, peak
+
+
+def retained(cls, fields):
+    # Bytes still allocated once one request object is built
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = cls(**fields)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del obj
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    # Same bodies on both paths, so the comparison is like for like
+    assert json.loads(legacy_submission()[1]) == json.loads(compact_submission()[1])
+
+    fast_json = tw_json.orjson
+    runs = [("legacy (json)", legacy_submission, Legacy_Leave_Request, None)]
+    runs.append(("compact (json)", compact_submission, Employee_Leave_Request, None))
+    if fast_json is not None:
+        runs.append(("compact (orjson)", compact_submission, Employee_Leave_Request, fast_json))
+
+    print(f'{args.iterations} submissions per run, {len(LEAVE_REQUEST_TEMPLATE)} leave request fields')
+    print(f'  {"path":18} {"us/submission":>14} {"peak KiB":>9} {"object bytes":>13}')
+    baseline = None
+    for name, func, cls, backend in runs:
+        tw_json.orjson = backend
+        us, peak = measure(func, args.iterations)
+        size = retained(cls, FIELDS)
+        baseline = baseline or us
+        print(f'  {name:18} {us:14.2f} {peak / 1024:9.1f} {size:13}   {baseline / us:.1f}x')
+    tw_json.orjson = fast_json
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Per-invocation cost of logging.
+
+Runs warm handler() invocations (leave request submissions against the stub
+servers, no added latency) in a fresh interpreter per configuration, with the
+log output going to a file as it would to CloudWatch, and reports the time
+and the log bytes per invocation. Each submission is an agent's first, sent
+with the form (and slot lease) their untimed reaction and click opened.
+
+"verbose" is the old behaviour: DEBUG everywhere and every Slack body and
+Teamwork payload logged. "default" is LOG_LEVEL=INFO with sampled payloads.
+
+    python tests/benchmarks/bench_logging.py [--invocations 200]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from tests.benchmarks.stub_servers import start_stub_servers, stub_environment
+from tests.benchmarks.slack_events import vto_offer_message
+
+WARM_UP = 5
+
+CONFIGURATIONS = {
+    "verbose": {"LOG_LEVEL": "DEBUG", "LOG_PAYLOAD_SAMPLE_RATE": "1"},
+    "debug-sampled": {"LOG_LEVEL": "DEBUG", "LOG_PAYLOAD_SAMPLE_RATE": "0.01"},
+    "default": {"LOG_LEVEL": "INFO", "LOG_PAYLOAD_SAMPLE_RATE": "0.01"},
+    "warning": {"LOG_LEVEL": "WARNING", "LOG_PAYLOAD_SAMPLE_RATE": "0"},
+}
+
+
+def child(invocations, result_path, thread_ts):
+    from tests.benchmarks.bench_vto_burst import slack_stub_call
+    from tests.benchmarks.slack_events import Lambda_Context, signed_event, submission_payload, \
+        workflow_step_execute_payload, open_form_payload
+    import teamwork_integration_slack_app.app as app_module
+
+    # Untimed: every agent reacts and opens the form, taking a slot
+    submissions = []
+    for i in range(WARM_UP + invocations):
+        user_id = f"U{i}"
+        app_module.handler(signed_event(workflow_step_execute_payload(f"{user_id.lower()}@example.com", f"E{i}",
+                                                                      thread_ts=thread_ts), form=False),
+                           Lambda_Context())
+        app_module.handler(signed_event(open_form_payload(user_id, thread_ts=thread_ts)), Lambda_Context())
+        view = slack_stub_call(os.environ["SLACK_API_URL"], "benchmark.openedView", trigger_id=f"trigger-{user_id}")["view"]
+        submissions.append(signed_event(submission_payload(user_id=user_id, thread_ts=thread_ts, view=view)))
+
+    # Warm the caches first, only steady-state invocations are timed
+    for event in submissions[:WARM_UP]:
+        app_module.handler(event, Lambda_Context())
+    sys.stdout.flush()
+    log_bytes = os.fstat(sys.stdout.fileno()).st_size
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for event in submissions[WARM_UP:]:
+        app_module.handler(event, Lambda_Context())
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    with open(result_path, "w") as f:
+        json.dump({"ms": elapsed * 1000 / invocations,
+                   "cpu_ms": cpu * 1000 / invocations,
+                   "bytes": (os.fstat(sys.stdout.fileno()).st_size - log_bytes) / invocations}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invocations", type=int, default=200)
+    args = parser.parse_args()
+
+    slack, teamwork = start_stub_servers(0.0)
+    print(f'{args.invocations} warm submissions per configuration')
+    print(f'  {"configuration":15} {"ms/invocation":>14} {"cpu ms":>8} {"log bytes":>10}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for n, (name, config) in enumerate(CONFIGURATIONS.items()):
+            # A fresh offer thread per configuration, with a slot for every agent
+            thread_ts = f"1700000000.{n:06d}"
+            slack.seed_thread(vto_offer_message(WARM_UP + args.invocations, thread_ts=thread_ts))
+            result_path = os.path.join(tmp, f"{name}.json")
+            env = dict(os.environ, **stub_environment(slack, teamwork), **config,
+                       AWS_LAMBDA_FUNCTION_NAME="teamwork-integration-slack-app",
+                       INSTRUMENTATION_FORMAT="off",
+                       VTO_STATE_DB=os.path.join(tmp, f"vto_state_{name}.sqlite3"),
+                       PYTHONPATH=ROOT)
+            with open(os.path.join(tmp, f"{name}.log"), "w") as log:
+                subprocess.run([sys.executable, os.path.abspath(__file__), "--child", str(args.invocations), result_path,
+                                thread_ts],
+                               env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT, check=True)
+            with open(result_path) as f:
+                result = json.load(f)
+            print(f'  {name:15} {result["ms"]:14.2f} {result["cpu_ms"]:8.2f} {result["bytes"]:10.0f}')
+
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        child(int(sys.argv[2]), sys.argv[3], sys.argv[4])
+    else:
+        main()
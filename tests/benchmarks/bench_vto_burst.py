@@ -0,0 +1,271 @@
+"""Burst load generator for one VTO offer, with an oversubscription check.
+
+Reproduces the worst production moment: dozens of agents react :vto: to an
+offer within seconds. Every agent runs the full sequence through app.handler():
+
+    reaction     workflow_step_execute, posts the agent's form button (or queue full / limit reached)
+    click        block_actions of the agent's own button, opens the form
+    submit       view_submission of the form the app opened, posts the leave request to Teamwork
+
+A share of the agents (--cancel-rate) close the form instead of submitting;
+agents without a leave request react again in the next wave.
+
+Each --containers child process stands in for a Lambda container, with
+--concurrency handler() calls at a time. By default they share one VTO state
+database; --isolated-stores gives each its own, as /tmp is on Lambda.
+
+Fails (exit 1) when more leave requests reached Teamwork, or more Success
+posts reached the thread, than the offer's limit (rounding_vto_number of
+the number in the offer post):
+
+    python tests/benchmarks/bench_vto_burst.py --agents 60 --limit 5 --latency 0.02
+    python tests/benchmarks/bench_vto_burst.py --agents 60 --limit 5 --containers 4 --isolated-stores
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from tests.benchmarks.stub_servers import start_stub_servers, stub_environment
+from tests.benchmarks.slack_events import Lambda_Context, signed_event, submission_payload, view_closed_payload, \
+    workflow_step_execute_payload, open_form_payload, vto_offer_message, VTO_THREAD_TS
+
+STEPS = ("reaction", "click", "submit", "cancel")
+
+
+def percentile(values, p):
+    # Nearest rank on sorted values
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def slack_stub_call(slack_url, method, **args):
+    # Straight to the Slack stub, outside the app's instrumented clients
+    data = urllib.parse.urlencode(args).encode()
+    with urllib.request.urlopen(urllib.request.Request(slack_url + method, data=data)) as response:
+        return json.loads(response.read())
+
+
+def form_button(slack_url, user_id, channel_id="C1", thread_ts=VTO_THREAD_TS):
+    # The button message the app posted for user_id, or None
+    messages = slack_stub_call(slack_url, "conversations.replies", channel=channel_id, ts=thread_ts)["messages"]
+    for message in reversed(messages[1:]):
+        blocks = message.get("blocks") or []
+        if len(blocks) > 1 and f"<@{user_id}>" in blocks[0].get("text", {}).get("text", "") \
+                and blocks[1].get("type") == "actions":
+            return message["ts"], blocks[1]["elements"][0]["value"]
+    return None
+
+
+class Agent_Run(object):
+    """One agent's reaction -> click -> submit sequences across the waves."""
+
+    def __init__(self, app_module, slack_url, user_id, cancel_rate, seed):
+        self.app_module = app_module
+        self.slack_url = slack_url
+        self.user_id = user_id
+        self.cancel_rate = cancel_rate
+        self.random = random.Random(f"{seed}-{user_id}")
+        self.latencies = {step: [] for step in STEPS}
+        self.outcomes = Counter()
+        self.errors = 0
+        self.submitted = False
+
+    def invoke(self, step, payload, form=True):
+        started = time.perf_counter()
+        response = self.app_module.handler(signed_event(payload, form=form), Lambda_Context())
+        self.latencies[step].append((time.perf_counter() - started) * 1000)
+        if response["statusCode"] != 200:
+            self.errors += 1
+        return response
+
+    def sequence(self, wave):
+        # Returns the sequence's duration (ms) and outcome
+        started = time.perf_counter()
+        outcome = self._sequence(wave)
+        self.outcomes[outcome] += 1
+        return (time.perf_counter() - started) * 1000, outcome
+
+    def _sequence(self, wave):
+        self.invoke("reaction", workflow_step_execute_payload(f"{self.user_id.lower()}@example.com",
+                                                              f"Ev{self.user_id}-{wave}"), form=False)
+        button = form_button(self.slack_url, self.user_id)
+        if button is None:
+            return "no_button"
+
+        message_ts, button_value = button
+        trigger_id = f"trigger-{self.user_id}-{wave}"
+        click = open_form_payload(self.user_id, message_ts=message_ts, button_value=button_value)
+        click["trigger_id"] = trigger_id
+        self.invoke("click", click)
+        view = slack_stub_call(self.slack_url, "benchmark.openedView", trigger_id=trigger_id)["view"]
+        if view is None:
+            return "no_form"
+
+        if self.random.random() < self.cancel_rate:
+            self.invoke("cancel", view_closed_payload(self.user_id, view=view))
+            return "cancelled"
+        self.invoke("submit", submission_payload(user_id=self.user_id, view=view))
+        self.submitted = True
+        return "submitted"
+
+
+def run_container(args):
+    # Child process: one warm "container" running its agents, reports as JSON on stdout
+    import teamwork_integration_slack_app.app as app_module
+
+    slack_url = os.environ["SLACK_API_URL"]
+    agents = [Agent_Run(app_module, slack_url, user_id, args.cancel_rate, args.seed)
+              for user_id in args.users.split(",")]
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    sequences = []
+    started = time.time()
+    for wave in range(args.waves):
+        pending = [agent for agent in agents if not agent.submitted]
+        if not pending:
+            break
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            sequences += list(pool.map(lambda agent: agent.sequence(wave), pending))
+        time.sleep(args.wave_gap)
+    finished = time.time()
+
+    print(json.dumps({
+        "started": started,
+        "finished": finished,
+        "sequences": [ms for ms, _ in sequences],
+        "outcomes": sum((agent.outcomes for agent in agents), Counter()),
+        "latencies": {step: sum((agent.latencies[step] for agent in agents), []) for step in STEPS},
+        "errors": sum(agent.errors for agent in agents),
+    }), flush=True)
+
+
+def latency_summary(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {"count": len(values),
+            "p50_ms": round(percentile(values, 50), 1),
+            "p95_ms": round(percentile(values, 95), 1),
+            "p99_ms": round(percentile(values, 99), 1),
+            "max_ms": round(values[-1], 1)}
+
+
+def check_oversubscription(slack, teamwork, vto_limit):
+    # Leave requests that reached Teamwork and Success posts in the thread, against the offer's limit
+    from teamwork_integration_slack_app.common import parse_vto_limit, vto_message_kind
+
+    thread = slack.thread(VTO_THREAD_TS)
+    limit = parse_vto_limit(thread[0]["text"])
+    leave_posts = sum(count for key, count in teamwork.calls.items() if "/api/leave/post/" in key)
+    success_posts = sum(1 for message in thread[1:] if vto_message_kind(message) == "success")
+    return {
+        "offer_limit": vto_limit,
+        "parsed_limit": limit,
+        "teamwork_leave_posts": leave_posts,
+        "teamwork_calls": sum(teamwork.calls.values()),
+        "success_posts": success_posts,
+        "form_buttons_left": sum(1 for message in thread[1:] if vto_message_kind(message) == "opened"),
+        "oversubscribed": leave_posts > limit or success_posts > limit,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=40)
+    parser.add_argument("--limit", type=float, default=5, help="slots in the offer post, parsed by rounding_vto_number")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every stub response")
+    parser.add_argument("--containers", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent sequences per container")
+    parser.add_argument("--isolated-stores", action="store_true", help="one VTO state database per container")
+    parser.add_argument("--waves", type=int, default=2)
+    parser.add_argument("--wave-gap", type=float, default=0.2)
+    parser.add_argument("--cancel-rate", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--users", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_container(args)
+        return
+
+    slack, teamwork = start_stub_servers(args.latency)
+    slack.seed_thread(vto_offer_message(args.limit))
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, **stub_environment(slack, teamwork),
+               AWS_LAMBDA_FUNCTION_NAME="teamwork-integration-slack-app",
+               LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+               INSTRUMENTATION_FORMAT=os.environ.get("INSTRUMENTATION_FORMAT", "off"))
+
+    users = [f"U{i}" for i in range(args.agents)]
+    children = []
+    for c in range(args.containers):
+        database = f"vto_state_{c}.sqlite3" if args.isolated_stores else "vto_state.sqlite3"
+        command = [sys.executable, os.path.abspath(__file__), "--child",
+                   "--users", ",".join(users[c::args.containers]),
+                   "--concurrency", str(args.concurrency), "--waves", str(args.waves),
+                   "--wave-gap", str(args.wave_gap), "--cancel-rate", str(args.cancel_rate), "--seed", str(args.seed)]
+        children.append(subprocess.Popen(command, cwd=ROOT, text=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         env=dict(env, VTO_STATE_DB=os.path.join(tmp, database))))
+
+    # Imports (the cold start) are out of the measurement, every container starts the burst together
+    for child in children:
+        while child.stdout.readline().strip() != "ready":
+            if child.poll() is not None:
+                sys.exit(f"container exited with {child.returncode}")
+    for child in children:
+        child.stdin.write("go\n")
+        child.stdin.flush()
+
+    reports = []
+    for child in children:
+        output, _ = child.communicate()
+        if child.returncode != 0:
+            sys.exit(f"container exited with {child.returncode}")
+        reports.append(json.loads(output.strip().splitlines()[-1]))
+
+    sequences = sum((report["sequences"] for report in reports), [])
+    elapsed = max(r["finished"] for r in reports) - min(r["started"] for r in reports)
+    outcomes = sum((Counter(report["outcomes"]) for report in reports), Counter())
+    check = check_oversubscription(slack, teamwork, args.limit)
+
+    print(f'{args.agents} agents, offer of {args.limit:g} ({check["parsed_limit"]:g} after rounding), '
+          f'{args.containers} container(s) x {args.concurrency}, '
+          f'{"isolated" if args.isolated_stores else "shared"} VTO state, {args.latency * 1000:.0f} ms stub latency')
+    print(f'  {len(sequences)} sequences in {elapsed:.2f} s, {len(sequences) / elapsed:.1f} sequences/s, '
+          f'{sum(r["errors"] for r in reports)} non-200 responses')
+    print(f'  outcomes {dict(sorted(outcomes.items()))}')
+    print(f'  {"step":10} {"count":>6} {"p50":>8} {"p95":>8} {"p99":>8} {"max":>8}')
+    for step, values in [("sequence", sequences)] + \
+            [(step, sum((r["latencies"][step] for r in reports), [])) for step in STEPS]:
+        stats = latency_summary(values)
+        if stats["count"]:
+            print(f'  {step:10} {stats["count"]:6} {stats["p50_ms"]:8.1f} {stats["p95_ms"]:8.1f} '
+                  f'{stats["p99_ms"]:8.1f} {stats["max_ms"]:8.1f}')
+    print(f'  Teamwork leave posts {check["teamwork_leave_posts"]}, Success posts {check["success_posts"]}, '
+          f'limit {check["parsed_limit"]:g}, form buttons left {check["form_buttons_left"]}, '
+          f'{check["teamwork_calls"]} Teamwork calls in all')
+
+    if check["oversubscribed"]:
+        print("OVERSUBSCRIBED: more VTO leave requests than the offer allows")
+        sys.exit(1)
+    print("ok: no oversubscription")
+
+
+if __name__ == "__main__":
+    main()
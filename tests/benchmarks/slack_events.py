@@ -0,0 +1,134 @@
+"""Signed API Gateway (HTTP API) events carrying Slack payloads, for driving app.handler()."""
+from urllib.parse import urlencode
+import hashlib
+import hmac
+import itertools
+import json
+import time
+
+VTO_THREAD_TS = "1699999999.000100"
+
+_submissions = itertools.count(1)
+
+class Lambda_Context(object):
+    function_name = "teamwork-integration-slack-app"
+    aws_request_id = "benchmark"
+    invoked_function_arn = "arn:aws:lambda:us-east-1:000000000000:function:teamwork-integration-slack-app"
+
+    def __init__(self, timeout_ms=30000):
+        self._deadline = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+def signed_event(payload, signing_secret="secret", form=True, retry_num=None):
+    # retry_num adds the headers of a Slack retry of the same payload
+    body = urlencode({"payload": json.dumps(payload)}) if form else json.dumps(payload)
+    timestamp = str(int(time.time()))
+    signature = "v0=" + hmac.new(signing_secret.encode(), f"v0:{timestamp}:{body}".encode(), hashlib.sha256).hexdigest()
+    return {
+        "requestContext": {"http": {"method": "POST"}},
+        "body": body,
+        "isBase64Encoded": False,
+        "headers": {
+            "content-type": "application/x-www-form-urlencoded" if form else "application/json",
+            "x-slack-request-timestamp": timestamp,
+            "x-slack-signature": signature,
+            **({"x-slack-retry-num": str(retry_num), "x-slack-retry-reason": "http_timeout"} if retry_num else {}),
+        },
+    }
+
+def submission_payload(user_id="U1", start=1700000000, end=1700003600, thread_ts=VTO_THREAD_TS, channel_id="C1",
+                       message_ts="2000000000.000100", view=None, payload_type="view_submission"):
+    # view_submission of the leave request form; view is the one the app opened, when known
+    private_metadata = json.dumps({"thread_ts": thread_ts, "message_ts": message_ts, "response_url": "",
+                                   "message_mention": user_id, "channel_id": channel_id})
+    if view is not None:
+        private_metadata = view["private_metadata"]
+    payload = {
+        "type": payload_type,
+        "team": {"id": "T1"},
+        "user": {"id": user_id},
+        "api_app_id": "A1",
+        "token": "token",
+        # Slack gives every submission a new trigger_id
+        "trigger_id": f"trigger-{user_id}-{next(_submissions)}",
+        "view": {
+            "id": f"V{user_id}",
+            "type": "modal",
+            "callback_id": "leave-request-submission",
+            "private_metadata": private_metadata,
+            "notify_on_close": True,
+            "hash": "hash",
+            "state": {"values": {"vto_start_time_input": {"vto_start_time": {"selected_date_time": start}},
+                                 "vto_end_time_input": {"vto_end_time": {"selected_date_time": end}}}},
+        },
+    }
+    if view is not None:
+        payload["view"]["id"] = view.get("id", payload["view"]["id"])
+    return payload
+
+def view_closed_payload(user_id="U1", view=None, **kwargs):
+    # The user cancelled the leave request form
+    payload = submission_payload(user_id=user_id, view=view, payload_type="view_closed", **kwargs)
+    payload["is_cleared"] = False
+    return payload
+
+def workflow_step_execute_payload(email, event_id, channel_id="C1", thread_ts=VTO_THREAD_TS):
+    # Event callback sent when someone reacts :vto: to the offer
+    return {
+        "type": "event_callback",
+        "team_id": "T1",
+        "api_app_id": "A1",
+        "event_id": event_id,
+        "event_time": int(time.time()),
+        "token": "token",
+        "event": {
+            "type": "workflow_step_execute",
+            "callback_id": "vto_workflow_view",
+            "workflow_step": {
+                "workflow_step_execute_id": f"execute-{event_id}",
+                "workflow_id": "W1",
+                "workflow_instance_id": f"instance-{event_id}",
+                "step_id": "step",
+                "inputs": {
+                    "vtoFormReceipient": {"value": email},
+                    "vtoChannelSource": {"value": f"<#{channel_id}>"},
+                    "vtoMessageLink": {"value": f"https://example.slack.com/archives/{channel_id}/p{thread_ts.replace('.', '')}"},
+                },
+                "outputs": [],
+            },
+        },
+    }
+
+def vto_offer_message(vto_limit, thread_ts=VTO_THREAD_TS):
+    # Root message of a VTO offer thread, as seeded into the Slack stub
+    return {"ts": thread_ts, "text": f"VTO is available: {float(vto_limit):.1f} spots", "reactions": [{"name": "vto", "count": 0}]}
+
+def open_form_payload(user_id, thread_ts=VTO_THREAD_TS, channel_id="C1", message_ts="2000000000.000100",
+                      button_value="open-leave-request-form"):
+    # block_actions of the "Open VTO form" button posted for user_id
+    return {
+        "type": "block_actions",
+        "team": {"id": "T1"},
+        "user": {"id": user_id},
+        "api_app_id": "A1",
+        "token": "token",
+        "trigger_id": f"trigger-{user_id}",
+        "response_url": "https://hooks.slack.com/actions/T1/1/benchmark",
+        "container": {"type": "message", "message_ts": message_ts, "channel_id": channel_id,
+                      "is_ephemeral": False, "thread_ts": thread_ts},
+        "channel": {"id": channel_id},
+        "message": {
+            "ts": message_ts,
+            "thread_ts": thread_ts,
+            "blocks": [
+                {"type": "section", "block_id": "greeting",
+                 "text": {"type": "mrkdwn", "text": f"Hello <@{user_id}>!\nTo submit your VTO, Please fill out this form."}},
+                {"type": "actions", "block_id": thread_ts, "elements": []},
+            ],
+        },
+        "actions": [{"type": "button", "action_id": "open-leave-request-form", "block_id": thread_ts,
+                     "value": button_value, "action_ts": str(time.time())}],
+    }
@@ -0,0 +1,236 @@
+"""Local stand-ins for the Slack Web API and the Teamwork API, used by the benchmarks.
+
+Both servers answer just enough of each API for the app's listeners to run end to
+end, count every call by method/endpoint and can add a fixed latency per request.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import itertools
+import json
+import re
+import threading
+import time
+
+ROSTER_SIZE = 450
+
+class Stub_Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # socketserver's default listen backlog of 5 resets connections under a burst
+    request_queue_size = 128
+
+    def __init__(self, handler, latency=0.0):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.state = {}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def count(self, key):
+        with self.lock:
+            self.calls[key] += 1
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls.clear()
+
+    def thread(self, thread_ts):
+        # Slack stub only: messages of a thread, root first
+        with self.lock:
+            return list(self.state.get("threads", {}).get(thread_ts, []))
+
+    def opened_view(self, trigger_id):
+        # Slack stub only: the view last opened with trigger_id
+        with self.lock:
+            return self.state.get("views", {}).get(trigger_id)
+
+    def seed_thread(self, root_message):
+        # Slack stub only: makes root_message the first message of its thread
+        with self.lock:
+            self.state.setdefault("threads", {})[root_message["ts"]] = [dict(root_message)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes, without this delayed ACKs add ~40 ms per call
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "json" in self.headers.get("Content-Type", ""):
+            return json.loads(raw or b"{}")
+        return {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+
+
+def _decoded(value):
+    # Form-encoded calls carry blocks and views as JSON strings
+    return json.loads(value) if isinstance(value, str) else value
+
+
+class Slack_Handler(_Handler):
+    # Threads are kept per thread_ts, so conversations.replies sees what chat.postMessage posted
+
+    def do_POST(self):
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        self.server.count(method)
+        time.sleep(self.server.latency)
+        args = self.body()
+        args.update({k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()})
+        threads = self.server.state.setdefault("threads", {})
+        ts_counter = self.server.state.setdefault("ts", itertools.count(1))
+
+        if method == "auth.test":
+            return self.reply(200, {"ok": True, "user_id": "UBOT", "bot_id": "B1", "team_id": "T1",
+                                    "url": "https://example.slack.com/", "user": "bot", "team": "team"})
+        if method in ("users.info", "users.lookupByEmail"):
+            user_id = args["user"] if method == "users.info" else args["email"].split("@")[0].upper()
+            return self.reply(200, {"ok": True, "user": {"id": user_id, "tz": "America/New_York", "tz_offset": -18000,
+                                                         "profile": {"email": f"{user_id.lower()}@example.com",
+                                                                     "display_name": user_id}}})
+        if method in ("conversations.history", "conversations.replies"):
+            with self.server.lock:
+                messages = list(threads.get(args.get("ts") or args.get("latest"), []))
+            return self.reply(200, {"ok": True, "messages": messages, "has_more": False})
+        if method == "chat.postMessage":
+            with self.server.lock:
+                ts = f"{2000000000 + next(ts_counter)}.000100"
+                threads.setdefault(args.get("thread_ts"), []).append(
+                    {"ts": ts, "text": args.get("text", ""), "username": args.get("username", ""),
+                     "blocks": _decoded(args.get("blocks"))})
+            return self.reply(200, {"ok": True, "ts": ts, "channel": args.get("channel")})
+        if method == "chat.delete":
+            with self.server.lock:
+                for messages in threads.values():
+                    messages[:] = [m for m in messages if m["ts"] != args.get("ts") or m is messages[0]]
+            return self.reply(200, {"ok": True})
+        if method == "views.open":
+            # Kept per trigger_id, so a client can submit the form the app actually opened
+            with self.server.lock:
+                view = dict(_decoded(args.get("view")), id=f"V{next(ts_counter)}")
+                self.server.state.setdefault("views", {})[args.get("trigger_id")] = view
+            return self.reply(200, {"ok": True, "view": view})
+        if method == "benchmark.openedView":
+            # Not a Slack method: lets a load generator in another process fetch the form it was shown
+            with self.server.lock:
+                view = self.server.state.get("views", {}).get(args.get("trigger_id"))
+            return self.reply(200, {"ok": view is not None, "view": view})
+        return self.reply(200, {"ok": True, "view": {"id": "V1"}})
+
+
+class Teamwork_Handler(_Handler):
+    # A roster of ROSTER_SIZE agents with emails u{i}@example.com, all at one Eastern location
+
+    def route(self, method):
+        path = urlparse(self.path).path
+        self.server.count(re.sub(r"/\d+", "/{id}", f"{method} {path}"))
+        time.sleep(self.server.latency)
+        if self.server.state.get("outage"):
+            # teamwork.state["outage"] = 503 simulates Teamwork being down
+            self.body()
+            return self.reply(self.server.state["outage"], {"Message": "Service Unavailable"})
+        if path == "/api/ops/auth":
+            self.body()
+            return self.reply(200, {"Success": True, "Response": {"SessionId": "session", "APIToken": "token"}})
+        if path == "/api/employees/list":
+            query = parse_qs(urlparse(self.path).query, keep_blank_values=True)
+            filter = query.get("filter", [""])[0]
+            if not filter:
+                page, size = int(query["page"][0]), int(query["pageSize"][0])
+                roster = [{"Id": 1000 + i, "FullName": f"Agent {i}", "Email": f"u{i}@example.com"} for i in range(ROSTER_SIZE)]
+                return self.reply(200, {"Data": roster[(page - 1) * size: page * size], "Total": len(roster)})
+            email = re.search(r"'(.*)'", filter).group(1)
+            if email.startswith("unknown"):
+                return self.reply(200, {"Data": [], "Total": 0})
+            # Same Id as in the roster, so the filtered lookup and the preload agree
+            roster_index = re.fullmatch(r"u(\d+)@example\.com", email)
+            emp_id = 1000 + int(roster_index.group(1)) if roster_index else 100 + sum(map(ord, email)) % 1000
+            return self.reply(200, {"Data": [{"Id": emp_id, "FullName": "Doe, Jane", "Email": email}], "Total": 1})
+        if re.fullmatch(r"/api/employees/\d+/locations", path):
+            return self.reply(200, [{"BusinessId": 7, "BusinessName": "Nova-V (ET)", "IsDefault": True}])
+        if re.fullmatch(r"/api/locations/\d+", path):
+            return self.reply(200, {"BusinessId": 7, "TimeZone": "(UTC-05:00) Eastern Time (US & Canada)"})
+        if path == "/api/leave/leavetypes":
+            return self.reply(200, [{"Id": 1, "Title": "PTO", "Code": "PTO"}, {"Id": 544, "Title": "VTO: Slack", "Code": None}])
+        if path.startswith("/api/leave/calcdailyhours"):
+            # Hours per calendar day of Start..End, in the offset the request carries
+            body = self.body()
+            start, end = (datetime.strptime(body[key], "%Y-%m-%dT%H:%M:%S%z") for key in ("Start", "End"))
+            day_hours = []
+            while start < end:
+                until = min(end, datetime.combine(start.date() + timedelta(days=1), datetime.min.time(), start.tzinfo))
+                day_hours.append({"Date": f"{start.date().isoformat()}T00:00:00", "Count": None,
+                                  "Value": round((until - start).total_seconds() / 3600, 2),
+                                  "Description": None, "Id": 0, "Title": None})
+                start = until
+            return self.reply(200, day_hours)
+        if path == "/api/leave/list" and "leave" in self.server.state:
+            emp_id = int(re.search(r"EmpId~eq~(\d+)", parse_qs(urlparse(self.path).query)["filter"][0]).group(1))
+            with self.server.lock:
+                leave = [{"EmpId": emp_id, "Start": start, "End": end} for start, end in self.server.state["leave"].get(emp_id, [])]
+            return self.reply(200, {"Data": leave, "Total": len(leave)})
+        if path.startswith("/api/leave/post/"):
+            body = self.body()
+            if "leave" in self.server.state:
+                # The leave book: a request overlapping the employee's earlier leave is answered 409
+                emp_id = int(path.rsplit("/", 1)[1])
+                start, end = (datetime.strptime(body[key], "%Y-%m-%dT%H:%M:%S%z") for key in ("Start", "End"))
+                with self.server.lock:
+                    booked = self.server.state["leave"].setdefault(emp_id, [])
+                    if any(datetime.strptime(s, "%Y-%m-%dT%H:%M:%S%z") < end and start < datetime.strptime(e, "%Y-%m-%dT%H:%M:%S%z")
+                           for s, e in booked):
+                        return self.reply(409, {"Message": "Conflicted with another leave request"})
+                    booked.append((body["Start"], body["End"]))
+            return self.reply(200, {"Id": 1})
+        return self.reply(404, {})
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_PUT(self):
+        self.route("PUT")
+
+    def do_POST(self):
+        self.route("POST")
+
+
+def start_stub_servers(latency=0.0, leave_book=False):
+    # Returns (slack, teamwork) servers running on daemon threads; with leave_book Teamwork
+    # keeps the leave it accepted, lists it and answers 409 to overlaps, otherwise it accepts anything
+    slack, teamwork = Stub_Server(Slack_Handler, latency), Stub_Server(Teamwork_Handler, latency)
+    if leave_book:
+        teamwork.state["leave"] = {}
+    return slack, teamwork
+
+def stub_environment(slack, teamwork, signing_secret="secret"):
+    # Environment that points app.py at the stubs
+    return {
+        "SLACK_BOT_TOKEN": "xoxb-benchmark",
+        "SLACK_SIGNING_SECRET": signing_secret,
+        "SLACK_API_URL": slack.url + "/api/",
+        "TEAMWORK_URL": teamwork.url,
+        "TEAMWORK_PORTAL": "portal",
+        "TEAMWORK_CODE": "code",
+        "TEAMWORK_USERNAME": "benchmark",
+        "TEAMWORK_PASSWORD": "benchmark",
+        # The benchmarks point VTO_STATE_DB at one file shared by their containers
+        "VTO_STATE_STORE": "sqlite",
+        # Without a leave book every resubmission is accepted, as it was before the conflict index
+        "TEAMWORK_LEAVE_CONFLICT_CHECK": "true" if "leave" in teamwork.state else "false",
+    }
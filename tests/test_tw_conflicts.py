@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+
+from teamwork_integration_slack_app.teamwork_api.tw_conflicts import TW_Leave_Conflict_Index
+
+START = datetime(2030, 1, 1, 9, tzinfo=timezone.utc)
+END = datetime(2030, 1, 1, 17, tzinfo=timezone.utc)
+
+class Response(object):
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class Connector(object):
+    """Serves one page of leave records and counts the calls."""
+
+    def __init__(self, leave=(), status_code=200):
+        self.leave = list(leave)
+        self.status_code = status_code
+        self.calls = 0
+
+    def get_employee_leave(self, emp_id, page=1, page_size=100, endpoint=None):
+        self.calls += 1
+        return Response(self.status_code, {"Data": self.leave, "Total": len(self.leave)})
+
+
+def leave(**fields):
+    return dict({"Start": "2030-01-01T00:00:00", "End": "2030-01-02T00:00:00", "Status": 1}, **fields)
+
+def conflict(index, connector):
+    return index.conflict(connector, 1, START, END, timezone.utc)
+
+
+def test_seeded_leave_conflicts():
+    connector = Connector([leave()])
+    index = TW_Leave_Conflict_Index()
+    assert conflict(index, connector).source == "teamwork"
+    assert conflict(index, connector).source == "teamwork"
+    assert connector.calls == 1
+
+
+def test_inactive_statuses_are_skipped():
+    for record in (leave(Status=3), leave(Status=4), leave(StatusText="Denied"), leave(StatusDisplay="Cancelled")):
+        assert conflict(TW_Leave_Conflict_Index(), Connector([record])) is None
+    assert conflict(TW_Leave_Conflict_Index(), Connector([leave(StatusText="Approved", Status=4)])) is not None
+
+
+def test_reload_drops_posted_leave_teamwork_no_longer_lists():
+    # e.g. a VTO this app posted that a manager cancelled
+    connector = Connector()
+    index = TW_Leave_Conflict_Index(ttl_seconds=0)
+    assert conflict(index, connector) is None
+    index.add(1, START, END)
+    assert conflict(index, connector) is None
+
+
+def test_posted_leave_is_kept_while_the_list_cant_be_read():
+    index = TW_Leave_Conflict_Index(ttl_seconds=0)
+    assert conflict(index, Connector()) is None
+    index.add(1, START, END)
+    assert conflict(index, Connector(status_code=500)).source == "posted"
+
+
+def test_unreadable_list_fails_open():
+    for connector in (Connector(status_code=500), Connector([{"Start": None}]), Connector(status_code=404)):
+        assert conflict(TW_Leave_Conflict_Index(), connector) is None
@@ -0,0 +1,88 @@
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+
+from teamwork_integration_slack_app.teamwork_api.tw_day_hours import Day_Hours_Rule, TW_Day_Hours_Engine, \
+    split_by_day
+
+NEW_YORK = ZoneInfo("America/New_York")
+
+class Response(object):
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class Connector(object):
+    """Answers calcdailyhours with one fixed day and counts the calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def calc_daily_hours(self, leave_request):
+        self.calls += 1
+        return Response([{"Date": "2030-01-05T00:00:00", "Value": 0}])
+
+
+class Leave_Request(object):
+    def to_json(self):
+        return {}
+
+
+class Location(object):
+    business_id = 1
+    tz = timezone.utc
+
+
+def local(*args):
+    return datetime(*args, tzinfo=NEW_YORK)
+
+
+def test_split_overnight_window():
+    assert split_by_day(local(2030, 1, 7, 22), local(2030, 1, 8, 6), NEW_YORK) == \
+        [(date(2030, 1, 7), 2.0), (date(2030, 1, 8), 6.0)]
+
+
+def test_split_multi_day_window():
+    assert split_by_day(local(2030, 1, 7, 12), local(2030, 1, 9, 12), NEW_YORK) == \
+        [(date(2030, 1, 7), 12.0), (date(2030, 1, 8), 24.0), (date(2030, 1, 9), 12.0)]
+
+
+def test_split_is_in_the_location_timezone():
+    # 03:00-09:00 UTC is 22:00-04:00 in New York
+    start, end = datetime(2030, 1, 8, 3, tzinfo=timezone.utc), datetime(2030, 1, 8, 9, tzinfo=timezone.utc)
+    assert split_by_day(start, end, NEW_YORK) == [(date(2030, 1, 7), 2.0), (date(2030, 1, 8), 4.0)]
+
+
+def test_split_across_dst_transitions():
+    # Clocks go forward on 2030-03-10 and back on 2030-11-03
+    assert split_by_day(local(2030, 3, 9, 22), local(2030, 3, 11), NEW_YORK) == \
+        [(date(2030, 3, 9), 2.0), (date(2030, 3, 10), 23.0)]
+    assert split_by_day(local(2030, 11, 3), local(2030, 11, 3, 6), NEW_YORK) == [(date(2030, 11, 3), 7.0)]
+    assert split_by_day(local(2030, 11, 2, 20), local(2030, 11, 4), NEW_YORK) == \
+        [(date(2030, 11, 2), 4.0), (date(2030, 11, 3), 25.0)]
+
+
+def test_calculate_rounds_and_caps_each_day():
+    engine = TW_Day_Hours_Engine({"*": Day_Hours_Rule(max_hours_per_day=8, increment_hours=0.5)})
+    day_hours = engine.calculate(1, NEW_YORK, local(2030, 1, 7, 13, 10), local(2030, 1, 8, 14))
+    assert [(item["Date"], item["Value"]) for item in day_hours] == \
+        [("2030-01-07T00:00:00", 8.0), ("2030-01-08T00:00:00", 8.0)]
+
+
+def test_windows_without_hours_fall_back_to_teamwork():
+    weekdays = Day_Hours_Rule(working_days=(0, 1, 2, 3, 4))
+    engine = TW_Day_Hours_Engine({"*": weekdays})
+    # 2030-01-05 is a Saturday
+    saturday = (datetime(2030, 1, 5, 9, tzinfo=timezone.utc), datetime(2030, 1, 5, 17, tzinfo=timezone.utc))
+    assert engine.calculate(1, timezone.utc, *saturday) is None
+    # Five minutes rounds to 0 hours
+    assert TW_Day_Hours_Engine({"*": Day_Hours_Rule()}).calculate(
+        1, timezone.utc, datetime(2030, 1, 7, 9, tzinfo=timezone.utc), datetime(2030, 1, 7, 9, 5, tzinfo=timezone.utc)) is None
+
+    connector = Connector()
+    assert engine.day_hours(connector, Leave_Request(), Location(), *saturday) == \
+        [{"Date": "2030-01-05T00:00:00", "Value": 0}]
+    assert connector.calls == 1
+    assert engine.stats["server"] == 1
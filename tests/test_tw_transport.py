@@ -0,0 +1,57 @@
+import socket
+
+import pytest
+import requests
+
+from teamwork_integration_slack_app.deadline import Deadline, Deadline_Exceeded, deadlines
+from teamwork_integration_slack_app.teamwork_api.tw_breaker import OPEN, CLOSED, TW_Circuit_Breaker, \
+    Memory_Breaker_State_Store, breaker_key
+from teamwork_integration_slack_app.teamwork_api.tw_transport import TW_Transport
+
+def refused_url():
+    # A port nothing listens on
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/api/employees/list"
+
+def transport(breaker):
+    # The default timeouts, longer than Slack's ack window
+    return TW_Transport(max_retries=0, default_timeout=(3.05, 10), breaker=breaker)
+
+def breaker():
+    return TW_Circuit_Breaker(store=Memory_Breaker_State_Store(), min_calls=5)
+
+
+def test_connection_errors_open_the_breaker_under_a_narrowed_deadline():
+    tw_breaker, url = breaker(), refused_url()
+    deadline = Deadline(30)
+    deadline.narrow(2.75, "slack ack")
+    with deadlines.invocation(deadline):
+        for _ in range(5):
+            with pytest.raises(requests.exceptions.ConnectionError):
+                transport(tw_breaker).request("GET", url, endpoint="/api/employees/list")
+    assert tw_breaker.state(url).state == OPEN
+
+
+def test_connection_errors_open_the_breaker_without_a_deadline():
+    tw_breaker, url = breaker(), refused_url()
+    for _ in range(5):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            transport(tw_breaker).request("GET", url, endpoint="/api/employees/list")
+    assert tw_breaker.state(url).state == OPEN
+
+
+def test_a_call_cut_short_by_the_deadline_is_not_counted():
+    tw_breaker = breaker()
+    # Accepts connections into the backlog but never answers
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen(8)
+        url = f"http://127.0.0.1:{server.getsockname()[1]}/api/employees/list"
+        with deadlines.invocation(Deadline(0.6)):
+            with pytest.raises(Deadline_Exceeded) as e:
+                transport(tw_breaker).request("GET", url, endpoint="/api/employees/list")
+    assert e.value.started
+    assert tw_breaker.store.window(breaker_key(url), 0).calls == 0
+    assert tw_breaker.state(url).state == CLOSED